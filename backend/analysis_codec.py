@@ -0,0 +1,61 @@
+"""Storage format of conversation analyses, shared by the API and the maintenance scripts"""
+import json
+import os
+import zlib
+from typing import Any, Dict, Union
+
+# Conversation.analysis_json is stored as a versioned binary record (see encode_analysis);
+# payloads at least this large are zlib-compressed
+ANALYSIS_COMPRESS_MIN_BYTES = int(os.environ.get("ANALYSIS_COMPRESS_MIN_BYTES", "256"))
+ANALYSIS_COMPRESS_LEVEL = int(os.environ.get("ANALYSIS_COMPRESS_LEVEL", "6"))
+
+# Record layout: format version, codec, bitmask of ANALYSIS_COLUMN_FIELDS left out
+# because the row's own column already holds them, then compact JSON
+ANALYSIS_FORMAT_VERSION = 1
+ANALYSIS_CODEC_RAW = 0
+ANALYSIS_CODEC_ZLIB = 1
+ANALYSIS_COLUMN_FIELDS = ("original_text", "context", "detected_tone", "tone_category", "confidence")
+
+
+def encode_analysis(analysis: Dict[str, Any], columns: Dict[str, Any]) -> bytes:
+    """Pack an analysis into the compact storage format, dropping fields duplicated in columns."""
+    payload = dict(analysis)
+    omitted = 0
+    for bit, field in enumerate(ANALYSIS_COLUMN_FIELDS):
+        if field in payload and field in columns and payload[field] == columns[field]:
+            del payload[field]
+            omitted |= 1 << bit
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    codec = ANALYSIS_CODEC_RAW
+    if len(body) >= ANALYSIS_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(body, ANALYSIS_COMPRESS_LEVEL)
+        if len(compressed) < len(body):
+            body, codec = compressed, ANALYSIS_CODEC_ZLIB
+    return bytes((ANALYSIS_FORMAT_VERSION, codec, omitted)) + body
+
+
+def decode_analysis(raw: Union[bytes, str, None], columns: Dict[str, Any]) -> Dict[str, Any]:
+    """Read a stored analysis in either the compact format or legacy JSON text."""
+    if not raw:
+        return {}
+    if isinstance(raw, str):
+        return json.loads(raw)
+    if raw[:1] == b"{":
+        return json.loads(raw.decode("utf-8"))
+    version, codec, omitted = raw[0], raw[1], raw[2]
+    if version != ANALYSIS_FORMAT_VERSION:
+        raise ValueError(f"Unsupported analysis format version {version}")
+    body = raw[3:]
+    if codec == ANALYSIS_CODEC_ZLIB:
+        body = zlib.decompress(body)
+    elif codec != ANALYSIS_CODEC_RAW:
+        raise ValueError(f"Unsupported analysis codec {codec}")
+    analysis = json.loads(body.decode("utf-8"))
+    for bit, field in enumerate(ANALYSIS_COLUMN_FIELDS):
+        if omitted & (1 << bit):
+            analysis[field] = columns.get(field)
+    return analysis
+
+
+def is_legacy_analysis(raw: Union[bytes, str, None]) -> bool:
+    return isinstance(raw, str) or (isinstance(raw, bytes) and raw[:1] == b"{")
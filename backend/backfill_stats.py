@@ -0,0 +1,21 @@
+"""Rebuild the per-user tone rollup (conversation_stats) from existing conversations"""
+import sys
+import time
+
+from main import SessionLocal, stats_rollup
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        users, buckets = stats_rollup.backfill(db, batch_size=batch_size)
+    finally:
+        db.close()
+
+    print(f"Rebuilt {buckets} buckets for {users} users in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
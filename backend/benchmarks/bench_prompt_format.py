@@ -0,0 +1,130 @@
+"""Microbenchmark: prompt size and parse cost of the line format vs structured JSON output
+
+Builds the analysis prompt both ways for a few sample texts and reports its
+length in characters and tokens, then times parse_tone_analysis_response on
+equivalent responses in each format (asserting both parse to the same analysis).
+
+Token counts are estimated (words + punctuation) unless --count-tokens is given,
+which asks Gemini's count_tokens endpoint (needs GEMINI_API_KEY).
+
+    python benchmarks/bench_prompt_format.py [--count-tokens] [--iterations N]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+from main import GeminiTextToningAnalyzer, load_genai
+
+REPEATS = 5
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+SAMPLES = [
+    ("short", "Thanks for the update!", None),
+    ("email", "Hi team, the release slipped to Friday because QA found two blockers. "
+              "Can everyone confirm they can cover the weekend on-call?", "email to engineering"),
+    ("long", " ".join(["We appreciate your patience while we work through the backlog of support requests."] * 8),
+     "customer announcement"),
+]
+
+ANALYSIS = {
+    "detected_tone": "Professional",
+    "confidence": 0.86,
+    "tone_category": "professional",
+    "explanation": "Clear, task-focused wording addressed to colleagues.",
+    "enhanced_versions": [
+        {"tone": "Formal", "text": "Dear colleagues, the release has been postponed until Friday."},
+        {"tone": "Friendly", "text": "Hey folks, quick heads-up: the release moved to Friday."},
+        {"tone": "Empathetic", "text": "I know this is frustrating, but the release is now on Friday."},
+    ],
+    "suggestions": ["Name the two blockers", "Say who to contact", "Give a deadline for replies"],
+}
+
+
+def line_response() -> str:
+    versions = "\n".join(
+        f"{index}. {version['tone']}: {version['text']}"
+        for index, version in enumerate(ANALYSIS["enhanced_versions"], start=1)
+    )
+    suggestions = "\n".join(f"- {suggestion}" for suggestion in ANALYSIS["suggestions"])
+    return (
+        f"DETECTED_TONE: {ANALYSIS['detected_tone']}\n"
+        f"CONFIDENCE: {ANALYSIS['confidence']}\n"
+        f"TONE_CATEGORY: {ANALYSIS['tone_category']}\n"
+        f"EXPLANATION: {ANALYSIS['explanation']}\n\n"
+        f"ENHANCED_VERSIONS:\n{versions}\n\nSUGGESTIONS:\n{suggestions}\n"
+    )
+
+
+def structured_response() -> str:
+    return json.dumps({
+        "tone": ANALYSIS["detected_tone"],
+        "confidence": ANALYSIS["confidence"],
+        "category": ANALYSIS["tone_category"],
+        "explanation": ANALYSIS["explanation"],
+        "enhanced": ANALYSIS["enhanced_versions"],
+        "suggestions": ANALYSIS["suggestions"],
+    })
+
+
+def token_counter(count_tokens: bool) -> Callable[[str], int]:
+    if not count_tokens:
+        return lambda prompt: len(TOKEN_PATTERN.findall(prompt))
+    genai = load_genai()
+    genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+    model = genai.GenerativeModel(os.environ.get("GEMINI_MODEL", "gemini-1.5-flash"))
+    return lambda prompt: model.count_tokens(prompt).total_tokens
+
+
+def best_of(func, iterations: int) -> float:
+    timings: List[float] = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) / iterations
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare the line and structured JSON analysis formats")
+    parser.add_argument("--count-tokens", action="store_true", help="count tokens with Gemini instead of estimating")
+    parser.add_argument("--iterations", type=int, default=2000, help="parses per timing run")
+    args = parser.parse_args(argv)
+
+    analyzer = GeminiTextToningAnalyzer()
+    count = token_counter(args.count_tokens)
+    label = "tokens" if args.count_tokens else "~tokens"
+
+    print(f"{'prompt':>8} {'line chars':>11} {'json chars':>11} {'line ' + label:>13} {'json ' + label:>13} {'saved':>6}")
+    for name, text, context in SAMPLES:
+        line_prompt = analyzer._build_analysis_prompt(text, context, structured=False)
+        json_prompt = analyzer._build_analysis_prompt(text, context, structured=True)
+        line_tokens, json_tokens = count(line_prompt), count(json_prompt)
+        print(
+            f"{name:>8} {len(line_prompt):>11} {len(json_prompt):>11} {line_tokens:>13} {json_tokens:>13} "
+            f"{1 - json_tokens / line_tokens:>6.0%}"
+        )
+
+    line_text, json_text = line_response(), structured_response()
+    expected = {"original_text": "sample", **ANALYSIS}
+    assert analyzer.parse_tone_analysis_response(line_text, "sample") == expected, "line format parse differs"
+    assert analyzer.parse_tone_analysis_response(json_text, "sample") == expected, "structured parse differs"
+
+    line_cost = best_of(lambda: analyzer.parse_tone_analysis_response(line_text, "sample"), args.iterations)
+    json_cost = best_of(lambda: analyzer.parse_tone_analysis_response(json_text, "sample"), args.iterations)
+    print()
+    print(f"{'response':>8} {'chars':>6} {'parse us':>9}")
+    print(f"{'line':>8} {len(line_text):>6} {line_cost * 1e6:>9.2f}")
+    print(f"{'json':>8} {len(json_text):>6} {json_cost * 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Microbenchmark: per-row cost of serializing a /conversations page
+
+Compares the standard path (row dicts validated against response_model,
+then stdlib JSON) with the FAST_RESPONSES path (row tuples straight to orjson).
+
+    python benchmarks/bench_serialization.py [rows ...]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import select
+
+from main import (
+    ConversationSummary,
+    Conversation,
+    HAS_ORJSON,
+    SessionLocal,
+    conversation_summaries_response,
+)
+
+REPEATS = 5
+loop = asyncio.new_event_loop()
+
+
+def load_rows(count: int):
+    db = SessionLocal()
+    try:
+        db.query(Conversation).delete()
+        base = datetime(2024, 1, 1)
+        db.add_all(
+            Conversation(
+                user_id=1,
+                original_text=f"Thanks so much for the update on ticket {i}, I'll review it tomorrow.",
+                context="email",
+                detected_tone="friendly",
+                tone_category="friendly",
+                confidence=0.87,
+                analysis_json=b"",
+                created_at=base + timedelta(seconds=i),
+            )
+            for i in range(count)
+        )
+        db.commit()
+        return db.execute(
+            select(
+                Conversation.id,
+                Conversation.original_text,
+                Conversation.detected_tone,
+                Conversation.tone_category,
+                Conversation.confidence,
+                Conversation.context,
+                Conversation.created_at,
+            ).order_by(Conversation.created_at.desc(), Conversation.id.desc())
+        ).all()
+    finally:
+        db.close()
+
+
+def standard_body(rows, field) -> bytes:
+    # What FastAPI does for a response_model route returning dicts
+    content = loop.run_until_complete(
+        serialize_response(field=field, response_content=[row._asdict() for row in rows], is_coroutine=True)
+    )
+    return JSONResponse(content).body
+
+
+def fast_body(rows) -> bytes:
+    return conversation_summaries_response(rows).body
+
+
+def best_of(func, *args) -> float:
+    timings: List[float] = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    if not HAS_ORJSON:
+        print("orjson is required: pip install orjson")
+        sys.exit(1)
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    field = create_response_field(name="bench", type_=List[ConversationSummary])
+    print(f"{'rows':>8} {'standard us/row':>16} {'fast us/row':>12} {'speedup':>8}")
+    for size in sizes:
+        rows = load_rows(size)
+        assert json.loads(standard_body(rows, field)) == json.loads(fast_body(rows)), "fast path output differs"
+        standard = best_of(standard_body, rows, field)
+        fast = best_of(fast_body, rows)
+        print(f"{size:>8} {standard / size * 1e6:>16.2f} {fast / size * 1e6:>12.2f} {standard / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""Load test the backend against a local Gemini stand-in
+
+Starts the app on a temporary SQLite database with FakeGeminiModel in place of
+Gemini, drives each scenario at the given concurrency levels and prints
+p50/p95/p99 latency and requests per second as JSON.
+
+    python benchmarks/load_test.py --concurrency 1,8,32 --requests 200 \\
+        --latency-ms 300 --jitter-ms 100 --rate-limit-ratio 0.05 --output results.json
+
+Requires httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCENARIOS = ("analyze", "quick", "conversations", "login", "me", "register")
+PASSWORD = "load-test-password"
+
+FULL_RESPONSE = """DETECTED_TONE: Friendly
+CONFIDENCE: 0.91
+TONE_CATEGORY: friendly
+EXPLANATION: A warm, informal note with an appreciative tone.
+ENHANCED_VERSIONS:
+1. Formal: Thank you very much for your assistance with this matter.
+2. Casual: Thanks a ton for the help!
+3. Professional: I appreciate your support on this.
+4. Enthusiastic: Thank you so much, this is fantastic!
+SUGGESTIONS:
+- Mention what specifically helped
+- Keep the closing short
+"""
+# Tone present but no enhanced versions: parses with fallback enhancements
+PARTIAL_RESPONSE = """DETECTED_TONE: Neutral
+CONFIDENCE: 0.6
+TONE_CATEGORY: neutral
+EXPLANATION: Plain statement.
+"""
+GARBAGE_RESPONSE = "I'm sorry, I can't help with that request."
+RESPONSE_SHAPES = {
+    "full": FULL_RESPONSE,
+    "partial": PARTIAL_RESPONSE,
+    "garbage": GARBAGE_RESPONSE,
+    "empty": "",
+}
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Drop-in for genai.GenerativeModel with configurable latency, jitter, 429s and response shapes."""
+
+    def __init__(
+        self,
+        latency: float = 0.3,
+        jitter: float = 0.1,
+        rate_limit_ratio: float = 0.0,
+        shapes: Optional[Dict[str, float]] = None,
+        seed: int = 0,
+    ):
+        self.model_name = "models/fake-gemini"
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.shapes = shapes or {"full": 1.0}
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+
+    def _next(self):
+        self.calls += 1
+        delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        if self.random.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return delay, None
+        shape = self.random.choices(list(self.shapes), weights=list(self.shapes.values()))[0]
+        return delay, RESPONSE_SHAPES[shape]
+
+    @staticmethod
+    def _rate_limit_error():
+        return Exception("429 Resource has been exhausted (e.g. check quota). Please retry in 1s.")
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs):
+        delay, text = self._next()
+        time.sleep(delay)
+        if text is None:
+            raise self._rate_limit_error()
+        if stream:
+            return [FakeResponse(line + "\n") for line in text.splitlines()]
+        return FakeResponse(text)
+
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        delay, text = self._next()
+        await asyncio.sleep(delay)
+        if text is None:
+            raise self._rate_limit_error()
+        if stream:
+            return self._stream(text)
+        return FakeResponse(text)
+
+    @staticmethod
+    async def _stream(text: str):
+        for line in text.splitlines():
+            await asyncio.sleep(0)
+            yield FakeResponse(line + "\n")
+
+
+class BackgroundServer:
+    """Run uvicorn on a daemon thread so the load generator owns the main event loop."""
+
+    def __init__(self, app, port: int):
+        import uvicorn
+
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Server failed to start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(scenario: str, concurrency: int, latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def build_request(scenario: str, sequence: int, token: str) -> Dict[str, Any]:
+    auth = {"Authorization": f"Bearer {token}"}
+    if scenario == "analyze":
+        # Unique text per request so the analysis cache doesn't answer it
+        text = f"Thanks so much for helping with the release, request {sequence}!"
+        return {"method": "POST", "url": "/analyze-tone", "json": {"text": text, "context": "email"}, "headers": auth}
+    if scenario == "quick":
+        return {"method": "POST", "url": "/quick-analyze", "params": {"text": f"This is amazing news {sequence}!"}}
+    if scenario == "conversations":
+        return {"method": "GET", "url": "/conversations", "params": {"limit": 50}, "headers": auth}
+    if scenario == "login":
+        return {"method": "POST", "url": "/auth/login", "data": {"username": "load@example.com", "password": PASSWORD}}
+    if scenario == "me":
+        return {"method": "GET", "url": "/auth/me", "headers": auth}
+    if scenario == "register":
+        email = f"load-{os.getpid()}-{sequence}@example.com"
+        return {"method": "POST", "url": "/auth/register", "json": {"email": email, "password": PASSWORD}}
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+async def run_level(client, scenario: str, concurrency: int, total_requests: int, token: str, counter) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(total_requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            request = build_request(scenario, next(counter), token)
+            started = time.perf_counter()
+            try:
+                response = await client.request(**request)
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(scenario, concurrency, latencies, errors, time.perf_counter() - started)
+
+
+async def run_suite(base_url: str, args, fake_model: FakeGeminiModel, main) -> Dict[str, Any]:
+    import httpx
+
+    counter = itertools.count()
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        await client.post("/auth/register", json={"email": "load@example.com", "password": PASSWORD})
+        login = await client.post("/auth/login", data={"username": "load@example.com", "password": PASSWORD})
+        login.raise_for_status()
+        token = login.json()["access_token"]
+        seed_conversations(main, args.seed_conversations)
+
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                result = await run_level(client, scenario, concurrency, args.requests, token, counter)
+                results.append(result)
+                print(
+                    f"{scenario:<14} c={concurrency:<4} rps={result['rps']:<9} p50={result['p50_ms']}ms "
+                    f"p95={result['p95_ms']}ms p99={result['p99_ms']}ms errors={result['errors']}",
+                    file=sys.stderr,
+                )
+
+        health = (await client.get("/health")).json()
+
+    return {
+        "config": {
+            "requests_per_level": args.requests,
+            "concurrency": args.concurrency,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "rate_limit_ratio": args.rate_limit_ratio,
+            "gemini_rpm": args.gemini_rpm,
+            "shapes": args.shapes,
+            "seed_conversations": args.seed_conversations,
+        },
+        "fake_gemini": {"calls": fake_model.calls, "rate_limited": fake_model.rate_limited},
+        "results": results,
+        "health": health,
+    }
+
+
+def seed_conversations(main, count: int):
+    if count <= 0:
+        return
+    db = main.SessionLocal()
+    try:
+        user = db.query(main.User).filter(main.User.email == "load@example.com").one()
+        analysis = {"detected_tone": "friendly", "tone_category": "friendly", "confidence": 0.9, "enhanced_versions": [], "suggestions": []}
+        db.add_all(
+            main.Conversation(
+                user_id=user.id,
+                original_text=f"Seeded conversation {i}",
+                detected_tone="friendly",
+                tone_category="friendly",
+                confidence=0.9,
+                analysis_json=main.encode_analysis(analysis, {}),
+            )
+            for i in range(count)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def parse_shapes(value: str) -> Dict[str, float]:
+    """'full=0.9,garbage=0.1' -> {"full": 0.9, "garbage": 0.1}"""
+    shapes = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in RESPONSE_SHAPES:
+            raise argparse.ArgumentTypeError(f"Unknown response shape {name!r} (choose from {', '.join(RESPONSE_SHAPES)})")
+        shapes[name] = float(weight or 1)
+    return shapes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), default=list(SCENARIOS[:5]),
+                        help=f"comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in v.split(",")], default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="fraction of Gemini calls failing with 429")
+    parser.add_argument("--gemini-rpm", type=float, default=0, help="rate limiter quota in requests/min (0 = unlimited)")
+    parser.add_argument("--shapes", type=parse_shapes, default={"full": 1.0}, help="e.g. full=0.9,partial=0.05,garbage=0.05")
+    parser.add_argument("--seed-conversations", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    # Isolated database and no real Gemini before the app is imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/load_test.db"
+    os.environ["GEMINI_API_KEY"] = ""
+    os.environ["GEMINI_MODEL_CACHE_PATH"] = ""
+    import main as backend
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    fake_model = FakeGeminiModel(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        rate_limit_ratio=args.rate_limit_ratio,
+        shapes=args.shapes,
+    )
+    backend.gemini_analyzer.model = fake_model
+    backend.gemini_analyzer.initialized = True
+    # Unlimited by default, to measure the service rather than the production quota
+    backend.gemini_analyzer.limiter = backend.AdaptiveRateLimiter(rate_per_minute=args.gemini_rpm)
+
+    port = free_port()
+    with BackgroundServer(backend.app, port):
+        report = asyncio.run(run_suite(f"http://127.0.0.1:{port}", args, fake_model, backend))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
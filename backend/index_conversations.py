@@ -0,0 +1,28 @@
+"""Add conversations saved before the search index existed to the FTS index"""
+import sys
+import time
+
+from main import SessionLocal, conversation_search, engine
+
+
+def main():
+    # The app only creates the index at import in sync database mode, so make sure here
+    with engine.begin() as connection:
+        conversation_search.create(connection)
+    if not conversation_search.available:
+        print("The search index is not available (needs SQLite with FTS5 and SEARCH_INDEX_ENABLED=true).")
+        sys.exit(1)
+
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        indexed = conversation_search.backfill(db, batch_size=batch_size)
+    finally:
+        db.close()
+
+    print(f"Indexed {indexed} conversations in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
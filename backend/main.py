@@ -2,16 +2,34 @@ from __future__ import annotations
 
 import os
 import re
+import math
+import base64
 import json
 import time
+import copy
+import csv
+import io
+import asyncio
+import bisect
+import codecs
+import hashlib
+import importlib.util
+import zlib
 import logging
-from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+import sqlite3
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager
+from typing import List, Optional, Dict, Any, Tuple, Union, Deque, Iterator
 from enum import Enum
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -20,13 +38,32 @@ from sqlalchemy import (
     Column,
     Integer,
     String,
+    Date,
     DateTime,
     Text,
     Float,
     ForeignKey,
+    Index,
+    LargeBinary,
+    TypeDecorator,
+    and_,
+    bindparam,
     create_engine,
+    event,
+    func,
+    inspect,
+    or_,
+    select,
+    update,
 )
+from sqlalchemy import text as sql_text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -39,28 +76,260 @@ try:
 except ImportError:
     logger.warning("python-dotenv not installed")
 
-# Import Gemini
+# Imported after load_dotenv so its ANALYSIS_COMPRESS_* settings can come from .env
+from analysis_codec import ANALYSIS_COLUMN_FIELDS, decode_analysis, encode_analysis, is_legacy_analysis
+
+# NumPy powers the optional local tone classifier
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+    logger.warning("NumPy not installed - local tone classifier disabled")
+
+# orjson backs the optional FAST_RESPONSES mode
 try:
-    import google.generativeai as genai
-    HAS_GEMINI = True
+    import orjson  # noqa: F401 - used through ORJSONResponse
+    HAS_ORJSON = True
 except ImportError:
+    HAS_ORJSON = False
+
+# Gemini: google.generativeai is only imported once initialization needs it (see load_genai)
+genai = None
+try:
+    HAS_GEMINI = importlib.util.find_spec("google.generativeai") is not None
+except ModuleNotFoundError:
+    # find_spec raises instead of returning None when the parent "google" package is missing
     HAS_GEMINI = False
+if not HAS_GEMINI:
     logger.error("Google Generative AI not installed. Run: pip install google-generativeai")
 
+
+def load_genai():
+    global genai
+    if genai is None:
+        import google.generativeai as genai_module
+        genai = genai_module
+    return genai
+
 APP_NAME = "smart-text-toning-analyzer"
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./text_toner.db")
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "change-me-super-secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "120"))
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "4096"))
+AUTH_USER_CACHE_SIZE = int(os.environ.get("AUTH_USER_CACHE_SIZE", "4096"))
+AUTH_USER_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_USER_CACHE_TTL_SECONDS", "30"))
+
+# bcrypt runs on its own pool so login storms can't starve other work;
+# beyond workers + max queue, requests get 503 with Retry-After
+PASSWORD_HASH_EXECUTOR = os.environ.get("PASSWORD_HASH_EXECUTOR", "thread").strip().lower()  # thread | process
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+# "native" uses the async Gemini client, "executor" runs the sync client on a bounded thread pool
+GEMINI_ASYNC_MODE = os.environ.get("GEMINI_ASYNC_MODE", "native").strip().lower()
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "4"))
+
+# AIMD token bucket in front of Gemini: starts at the quota (0 disables limiting), halves on
+# 429 (honoring Retry-After / retry hints) and climbs back by the recovery step per success
+GEMINI_RATE_LIMIT_RPM = float(os.environ.get("GEMINI_RATE_LIMIT_RPM", "30"))
+GEMINI_RATE_LIMIT_BURST = float(os.environ.get("GEMINI_RATE_LIMIT_BURST", "2"))
+GEMINI_RATE_LIMIT_MIN_RPM = float(os.environ.get("GEMINI_RATE_LIMIT_MIN_RPM", "2"))
+GEMINI_RATE_LIMIT_BACKOFF = float(os.environ.get("GEMINI_RATE_LIMIT_BACKOFF", "0.5"))
+GEMINI_RATE_LIMIT_RECOVERY_RPM = float(os.environ.get("GEMINI_RATE_LIMIT_RECOVERY_RPM", "1"))
+RETRY_HINT_PATTERN = re.compile(r"retry[ _-]?(?:in|delay|after)?\D{0,20}?(\d+(?:\.\d+)?)\s*(ms)?", re.IGNORECASE)
+
+# Model discovery runs in the background after startup (fallback analysis until it finishes);
+# candidate probes run concurrently under a deadline and the winner is cached on disk
+GEMINI_INIT_BACKGROUND = os.environ.get("GEMINI_INIT_BACKGROUND", "true").lower() == "true"
+GEMINI_PROBE_CONCURRENCY = int(os.environ.get("GEMINI_PROBE_CONCURRENCY", "4"))
+GEMINI_PROBE_DEADLINE_SECONDS = float(os.environ.get("GEMINI_PROBE_DEADLINE_SECONDS", "20"))
+GEMINI_MODEL_CACHE_PATH = os.environ.get("GEMINI_MODEL_CACHE_PATH", ".gemini_model.json")
+GEMINI_MODEL_CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_MODEL_CACHE_TTL_SECONDS", "86400"))
+GEMINI_FALLBACK_MODELS = [
+    "gemini-1.5-flash-001",
+    "gemini-1.5-pro-001",
+    "gemini-1.0-pro",
+    "gemini-pro",
+    "gemini-1.5-flash",
+    "gemini-1.5-pro",
+]
+
+# Up to POOL_SIZE working models are kept; calls go to the fastest healthy one, a second
+# model is hedged in once a call outlives that model's latency percentile, and a model is
+# skipped for the cooldown after BREAKER_FAILURES consecutive errors (all skipped = fallback)
+GEMINI_MODEL_POOL_SIZE = int(os.environ.get("GEMINI_MODEL_POOL_SIZE", "2"))
+GEMINI_CALL_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_CALL_TIMEOUT_SECONDS", "30"))
+GEMINI_HEDGE_ENABLED = os.environ.get("GEMINI_HEDGE_ENABLED", "true").lower() == "true"
+GEMINI_HEDGE_PERCENTILE = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", "0.95"))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.environ.get("GEMINI_HEDGE_MIN_SAMPLES", "10"))
+GEMINI_BREAKER_FAILURES = int(os.environ.get("GEMINI_BREAKER_FAILURES", "3"))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Bump whenever _build_analysis_prompt or parse_tone_analysis_response changes output
+PROMPT_VERSION = "1"
+# Compact prompt asking for a single JSON object (with response_mime_type when the installed
+# google-generativeai supports it), parsed and validated in one pass; streamed and batched
+# prompts keep the line format
+GEMINI_STRUCTURED_OUTPUT = os.environ.get("GEMINI_STRUCTURED_OUTPUT", "false").lower() == "true"
+ENHANCEMENT_TONES = "Formal, Casual, Professional, Friendly, Persuasive, Inspirational, Empathetic, Authoritative, Enthusiastic"
+STRUCTURED_RESPONSE_PATTERN = re.compile(r"^\s*(?:```(?:json)?\s*)?(\{.*\})\s*(?:```)?\s*$", re.DOTALL | re.IGNORECASE)
+ANALYSIS_CACHE_ENABLED = os.environ.get("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "1024"))
+ANALYSIS_CACHE_TTL_SECONDS = int(os.environ.get("ANALYSIS_CACHE_TTL_SECONDS", "86400"))
+ANALYSIS_CACHE_PERSIST = os.environ.get("ANALYSIS_CACHE_PERSIST", "false").lower() == "true"
+CACHE_BYPASS_HEADER = "X-Bypass-Cache"
+
+# SQLite file (WAL) shared by all workers on the host: holds the Gemini rate limiter's
+# bucket and a shared analysis cache tier, so N workers act as one quota-aware client
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH", "").strip()
+
+# Micro-batching: analyses arriving within the window share one Gemini prompt
+GEMINI_BATCH_ENABLED = os.environ.get("GEMINI_BATCH_ENABLED", "false").lower() == "true"
+GEMINI_BATCH_WINDOW_MS = int(os.environ.get("GEMINI_BATCH_WINDOW_MS", "50"))
+GEMINI_BATCH_MAX_SIZE = int(os.environ.get("GEMINI_BATCH_MAX_SIZE", "8"))
+BATCH_ITEM_DELIMITER = "=== ITEM {index} ==="
+BATCH_ITEM_PATTERN = re.compile(r"^\s*=+\s*ITEM\s+(\d+)\s*=+\s*$", re.IGNORECASE | re.MULTILINE)
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
+# JSON file mapping tone -> list of phrases or {phrase: weight}; defaults to DEFAULT_TONE_LEXICON
+TONE_LEXICON_PATH = os.environ.get("TONE_LEXICON_PATH", "").strip()
+
+# Local hashed n-gram classifier: "off" only uses it for the Gemini fallback,
+# "enhance" takes the tone from it and asks Gemini for enhancements only,
+# "local" answers confident predictions without calling Gemini at all
+LOCAL_CLASSIFIER_PATH = os.environ.get("LOCAL_CLASSIFIER_PATH", "tone_classifier.npz")
+LOCAL_CLASSIFIER_ROUTING = os.environ.get("LOCAL_CLASSIFIER_ROUTING", "off").strip().lower()
+LOCAL_CLASSIFIER_THRESHOLD = float(os.environ.get("LOCAL_CLASSIFIER_THRESHOLD", "0.85"))
+
+# /conversations keyset pagination
+CONVERSATION_PAGE_DEFAULT = int(os.environ.get("CONVERSATION_PAGE_DEFAULT", "50"))
+CONVERSATION_PAGE_MAX = int(os.environ.get("CONVERSATION_PAGE_MAX", "200"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# SQLite FTS5 index over original_text and the enhanced versions, kept in sync on insert
+# (session flush), update and delete (triggers); other databases fall back to a LIKE scan
+SEARCH_INDEX_ENABLED = os.environ.get("SEARCH_INDEX_ENABLED", "true").lower() == "true"
+SEARCH_PAGE_DEFAULT = int(os.environ.get("SEARCH_PAGE_DEFAULT", "20"))
+SEARCH_PAGE_MAX = int(os.environ.get("SEARCH_PAGE_MAX", "100"))
+SEARCH_MAX_TERMS = 16
+NEXT_OFFSET_HEADER = "X-Next-Offset"
+
+# /conversations/export reads through a server-side cursor this many rows at a time
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_COMPRESS_LEVEL = int(os.environ.get("EXPORT_COMPRESS_LEVEL", "6"))
+
+# Serialize hot responses with orjson and skip response_model re-validation
+FAST_RESPONSES = os.environ.get("FAST_RESPONSES", "false").lower() == "true"
+if FAST_RESPONSES and not HAS_ORJSON:
+    logger.warning("FAST_RESPONSES needs orjson (pip install orjson) - using standard responses")
+    FAST_RESPONSES = False
+
+# /quick-analyze/batch: texts per process-pool shard, pool size (0 = score inline), shards in flight
+QUICK_BATCH_SHARD_SIZE = int(os.environ.get("QUICK_BATCH_SHARD_SIZE", "500"))
+QUICK_BATCH_WORKERS = int(os.environ.get("QUICK_BATCH_WORKERS", str(os.cpu_count() or 1)))
+QUICK_BATCH_MAX_INFLIGHT = int(os.environ.get("QUICK_BATCH_MAX_INFLIGHT", str(2 * max(QUICK_BATCH_WORKERS, 1))))
+
+# Connection pool sizing; unset values keep SQLAlchemy's defaults
+DB_POOL_SETTINGS = {
+    setting: int(os.environ[env_name])
+    for setting, env_name in (
+        ("pool_size", "DB_POOL_SIZE"),
+        ("max_overflow", "DB_MAX_OVERFLOW"),
+        ("pool_timeout", "DB_POOL_TIMEOUT"),
+        ("pool_recycle", "DB_POOL_RECYCLE"),
+    )
+    if os.environ.get(env_name)
+}
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Prometheus-text /metrics; when disabled, instrumentation calls return immediately
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "false").lower() == "true"
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Write-behind: conversations are queued and inserted in batches by a background task;
+# requests wait up to WRITE_BEHIND_ID_TIMEOUT_SECONDS for their id (null if the flush is slower)
+WRITE_BEHIND_ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL_MS", "100"))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_ID_TIMEOUT_SECONDS = float(os.environ.get("WRITE_BEHIND_ID_TIMEOUT_SECONDS", "2"))
+
+# An async driver in DATABASE_URL (e.g. sqlite+aiosqlite://) switches the request
+# path to AsyncSession; scripts and background helpers keep a sync engine.
+ASYNC_DRIVERS = {"aiosqlite": "pysqlite", "asyncpg": "psycopg2", "aiomysql": "pymysql", "asyncmy": "pymysql"}
+database_url = make_url(DATABASE_URL)
+ASYNC_DATABASE = database_url.get_driver_name() in ASYNC_DRIVERS
+SYNC_DATABASE_URL = (
+    database_url.set(drivername=f"{database_url.get_backend_name()}+{ASYNC_DRIVERS[database_url.get_driver_name()]}")
+    if ASYNC_DATABASE else database_url
 )
+IS_SQLITE = database_url.get_backend_name() == "sqlite"
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers proceed while a writer commits; NORMAL skips the fsync per commit
+    cursor = dbapi_connection.cursor()
+    if SQLITE_JOURNAL_MODE:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    if SQLITE_SYNCHRONOUS:
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def build_engine_kwargs(url) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = dict(DB_POOL_SETTINGS)
+    if IS_SQLITE:
+        kwargs["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases use a single-connection pool that takes no sizing
+            for setting in DB_POOL_SETTINGS:
+                del kwargs[setting]
+        elif DB_POOL_SETTINGS and url.get_driver_name() == "aiosqlite":
+            # aiosqlite defaults to NullPool, which rejects pool sizing
+            kwargs["poolclass"] = AsyncAdaptedQueuePool
+    return kwargs
+
+
+engine = create_engine(SYNC_DATABASE_URL, **build_engine_kwargs(SYNC_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(database_url, **build_engine_kwargs(database_url)) if ASYNC_DATABASE else None
+AsyncSessionLocal = (
+    async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    if async_engine is not None else None
+)
+
+if IS_SQLITE:
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    if async_engine is not None:
+        event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+AnySession = Union[Session, AsyncSession]
 Base = declarative_base()
 
+
+class AnalysisBlob(TypeDecorator):
+    """Binary column that hands legacy TEXT values back untouched instead of failing to coerce them."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return value.encode("utf-8")
+        return value
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if isinstance(value, memoryview):
+                return value.tobytes()
+            return value
+        return process
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
@@ -77,6 +346,9 @@ class ToneCategory(Enum):
     NEUTRAL = "neutral"
 
 
+TONE_CATEGORY_VALUES = frozenset(tone.value for tone in ToneCategory)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -91,6 +363,10 @@ class User(Base):
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Backs the keyset-paginated history listing
+        Index("ix_conversations_user_created_id", "user_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -99,12 +375,41 @@ class Conversation(Base):
     detected_tone = Column(String(100), nullable=True)
     tone_category = Column(String(100), nullable=True)
     confidence = Column(Float, nullable=True)
-    analysis_json = Column(Text, nullable=False)
+    # Compact binary record (encode_analysis); rows written before it still hold JSON text
+    analysis_json = Column(AnalysisBlob, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
     user = relationship("User", back_populates="conversations")
 
+    @property
+    def analysis(self) -> Dict[str, Any]:
+        """Decode the stored analysis on access."""
+        return decode_analysis(self.analysis_json, {field: getattr(self, field) for field in ANALYSIS_COLUMN_FIELDS})
+
+
+class ConversationStat(Base):
+    """Rollup of conversations per user, UTC day and tone category, updated as rows are inserted."""
+    __tablename__ = "conversation_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    tone_category = Column(String(100), primary_key=True)
+    conversations = Column(Integer, nullable=False, default=0)
+    # Confidence is nullable, so its average needs its own count
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+    confidence_count = Column(Integer, nullable=False, default=0)
+    enhancements = Column(Integer, nullable=False, default=0)
+
+
+class AnalysisCacheEntry(Base):
+    __tablename__ = "analysis_cache"
+
+    cache_key = Column(String(64), primary_key=True)
+    analysis_json = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 class ToneAnalysisRequest(BaseModel):
     text: str
     context: Optional[str] = None  # e.g., "email", "social media", "business", "casual"
@@ -150,6 +455,7 @@ class TokenResponse(Token):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    user_id: Optional[int] = None
 
 
 class ConversationSummary(BaseModel):
@@ -169,12 +475,216 @@ class ConversationDetail(ConversationSummary):
     analysis: Dict[str, Any]
 
 
-def get_db() -> Session:
-    db = SessionLocal()
-    try:
+class ToneStatsBucket(BaseModel):
+    day: date
+    tone_category: str
+    conversations: int
+    average_confidence: Optional[float] = None
+    enhancements: int
+
+
+class ToneStatsTotal(BaseModel):
+    tone_category: str
+    conversations: int
+    share: float
+    average_confidence: Optional[float] = None
+    enhancements: int
+
+
+class ConversationStatsResponse(BaseModel):
+    conversations: int
+    tones: List[ToneStatsTotal]
+    days: List[ToneStatsBucket]
+
+
+class ConversationSearchResult(ConversationSummary):
+    # Matched text with hits in [brackets]; rank is bm25, lower is better (both None without FTS5)
+    snippet: Optional[str] = None
+    rank: Optional[float] = None
+
+
+@asynccontextmanager
+async def db_session():
+    """Open an AsyncSession in async database mode, otherwise a regular Session."""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+async def get_db():
+    async with db_session() as db:
         yield db
-    finally:
-        db.close()
+
+
+async def db_execute(db: AnySession, statement, params: Optional[Dict[str, Any]] = None):
+    if isinstance(db, AsyncSession):
+        return await db.execute(statement, params)
+    return db.execute(statement, params)
+
+
+async def db_get(db: AnySession, model, primary_key: Any):
+    if isinstance(db, AsyncSession):
+        return await db.get(model, primary_key)
+    return db.get(model, primary_key)
+
+
+async def db_commit(db: AnySession, *refresh: Any):
+    """Commit and reload the given instances (e.g. to pick up generated ids)."""
+    if isinstance(db, AsyncSession):
+        await db.commit()
+        for instance in refresh:
+            await db.refresh(instance)
+    else:
+        db.commit()
+        for instance in refresh:
+            db.refresh(instance)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout."""
+
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+
+class StageTimer:
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics: "Metrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    """In-process stage histograms, counters and gauges rendered as Prometheus text."""
+
+    STAGE_HELP = "Latency of each request stage in seconds"
+    COUNTER_HELP = {
+        "fallback": "Analyses served by the smart fallback instead of Gemini",
+        "parse_failures": "Gemini responses that could not be parsed fully (canned fallback used)",
+        "gemini_rate_limited": "Gemini calls rejected with 429 / quota errors",
+        "gemini_hedged": "Gemini calls that sent a hedged request to a second model",
+        "gemini_failovers": "Gemini calls retried on a second model after the first one failed",
+        "gemini_backup_wins": "Gemini calls answered by a hedged or failover model",
+        "gemini_circuit_open": "Analyses sent to the fallback because every model's breaker was open",
+    }
+    GAUGE_HELP = {
+        "inflight_requests": "Analysis requests currently being served",
+        "gemini_inflight_calls": "Gemini calls currently in flight",
+    }
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self.stages: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {name: 0 for name in self.COUNTER_HELP}
+        self.gauges: Dict[Tuple[str, str], float] = {}
+        self._gauge_callbacks: Dict[str, Tuple[str, Any]] = {}
+
+    def observe(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def timer(self, stage: str):
+        return StageTimer(self, stage) if self.enabled else NULL_TIMER
+
+    def inc(self, name: str, amount: float = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge_add(self, name: str, amount: float, label: str = ""):
+        if self.enabled:
+            key = (name, label)
+            self.gauges[key] = self.gauges.get(key, 0) + amount
+
+    def register_gauge(self, name: str, help_text: str, callback):
+        """Report a value owned elsewhere; callback returns a number or a {label: number} dict."""
+        self._gauge_callbacks[name] = (help_text, callback)
+
+    def render(self) -> str:
+        lines: List[str] = [
+            f"# HELP texttoner_stage_seconds {self.STAGE_HELP}",
+            "# TYPE texttoner_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'texttoner_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            cumulative += histogram.counts[-1]
+            lines.append(f'texttoner_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+            lines.append(f'texttoner_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'texttoner_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+        for name, value in self.counters.items():
+            lines.append(f"# HELP texttoner_{name}_total {self.COUNTER_HELP.get(name, name)}")
+            lines.append(f"# TYPE texttoner_{name}_total counter")
+            lines.append(f"texttoner_{name}_total {value}")
+        for name, help_text in self.GAUGE_HELP.items():
+            lines.append(f"# HELP texttoner_{name} {help_text}")
+            lines.append(f"# TYPE texttoner_{name} gauge")
+            for (gauge_name, label), value in sorted(self.gauges.items()):
+                if gauge_name == name:
+                    labels = f'{{endpoint="{label}"}}' if label else ""
+                    lines.append(f"texttoner_{name}{labels} {value}")
+        for name, (help_text, callback) in self._gauge_callbacks.items():
+            lines.append(f"# HELP texttoner_{name} {help_text}")
+            lines.append(f"# TYPE texttoner_{name} gauge")
+            value = callback()
+            if isinstance(value, dict):
+                for label, label_value in value.items():
+                    lines.append(f'texttoner_{name}{{name="{label}"}} {label_value}')
+            else:
+                lines.append(f"texttoner_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+async def db_release(db: AnySession, *keep: Any):
+    """End the open transaction so its connection goes back to the pool, detaching `keep` so it stays loaded."""
+    for instance in keep:
+        db.expunge(instance)
+    if isinstance(db, AsyncSession):
+        await db.rollback()
+    else:
+        db.rollback()
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -185,17 +695,122 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def get_user_by_email(db: Session, email: str) -> Optional[User]:
+def _timed_password_call(func, args: Tuple[Any, ...]) -> Tuple[Any, float, float]:
+    # Wall-clock timestamps so they stay comparable across worker processes
+    started_at = time.time()
+    result = func(*args)
+    return result, started_at, time.time()
+
+
+class PasswordHashPool:
+    """Dedicated, bounded worker pool for bcrypt with admission control."""
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        mode: str = PASSWORD_HASH_EXECUTOR,
+        max_queue: int = PASSWORD_HASH_MAX_QUEUE,
+    ):
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.max_queue = max_queue
+        self._executor = None
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queued_seconds = 0.0
+        self.hashing_seconds = 0.0
+
+    async def run(self, func, *args):
+        """Run a password function on the pool, or raise 503 if the queue is full."""
+        if self._pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is busy, please retry shortly",
+                headers={"Retry-After": str(self._retry_after())},
+            )
+
+        self._pending += 1
+        submitted_at = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started_at, finished_at = await loop.run_in_executor(
+                self._get_executor(), _timed_password_call, func, args,
+            )
+        finally:
+            self._pending -= 1
+        self.completed += 1
+        self.queued_seconds += max(0.0, started_at - submitted_at)
+        self.hashing_seconds += finished_at - started_at
+        metrics.observe("password_hash_queue", max(0.0, started_at - submitted_at))
+        metrics.observe("password_hash_compute", finished_at - started_at)
+        return result
+
+    async def prewarm(self):
+        """Start every worker and load bcrypt before serving.
+
+        Otherwise the first calls in process mode count the worker spawn as
+        queue time, skewing the queue metric and the Retry-After estimate.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            loop.run_in_executor(executor, get_password_hash, "prewarm") for _ in range(self.workers)
+        ))
+        logger.info(f"Password hashing pool ready: {self.workers} {self.mode} worker(s) in {time.perf_counter() - started:.2f}s")
+
+    def _retry_after(self) -> int:
+        average = self.hashing_seconds / self.completed if self.completed else 0.25
+        return max(1, math.ceil(average * self._pending / self.workers))
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executor": self.mode,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queued_seconds_total": round(self.queued_seconds, 4),
+            "hashing_seconds_total": round(self.hashing_seconds, 4),
+        }
+
+
+password_hasher = PasswordHashPool()
+
+
+async def get_user_by_email(db: AnySession, email: str) -> Optional[User]:
     if not email:
         return None
-    return db.query(User).filter(User.email == email.lower()).first()
+    result = await db_execute(db, select(User).where(User.email == email.lower()).limit(1))
+    return result.scalars().first()
 
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-    user = get_user_by_email(db, email)
+async def authenticate_user(db: AnySession, email: str, password: str) -> Optional[User]:
+    user = await get_user_by_email(db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    # Don't hold a pooled connection while bcrypt runs
+    await db_release(db, user)
+    if not await password_hasher.run(verify_password, password, user.hashed_password):
         return None
     return user
 
@@ -208,319 +823,2915 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
     return encoded_jwt
 
 
+class AuthCache:
+    """Verified-token and user-row caches for the get_current_user fast path.
+    
+    Tokens stay cached until their own exp; users are kept as detached rows
+    for a short TTL. Call invalidate_user whenever a user's email or
+    password changes (the User after_update hook does this for ORM writes).
+    """
+
+    def __init__(
+        self,
+        token_cache_size: int = AUTH_TOKEN_CACHE_SIZE,
+        user_cache_size: int = AUTH_USER_CACHE_SIZE,
+        user_ttl_seconds: float = AUTH_USER_CACHE_TTL_SECONDS,
+    ):
+        self.token_cache_size = token_cache_size
+        self.user_cache_size = user_cache_size
+        self.user_ttl_seconds = user_ttl_seconds
+        self._tokens: "OrderedDict[str, Tuple[float, TokenData]]" = OrderedDict()
+        self._users: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+        self.token_hits = 0
+        self.token_misses = 0
+        self.user_hits = 0
+        self.user_misses = 0
+
+    def get_token(self, token: str) -> Optional[TokenData]:
+        entry = self._tokens.get(token)
+        if entry is not None:
+            expires_at, token_data = entry
+            if expires_at > time.time():
+                self._tokens.move_to_end(token)
+                self.token_hits += 1
+                return token_data
+            del self._tokens[token]
+        self.token_misses += 1
+        return None
+
+    def set_token(self, token: str, token_data: TokenData, expires_at: float):
+        self._tokens[token] = (expires_at, token_data)
+        self._tokens.move_to_end(token)
+        while len(self._tokens) > self.token_cache_size:
+            self._tokens.popitem(last=False)
+
+    def get_user(self, user_id: int) -> Optional[User]:
+        entry = self._users.get(user_id)
+        if entry is not None:
+            expires_at, user = entry
+            if expires_at > time.time():
+                self._users.move_to_end(user_id)
+                self.user_hits += 1
+                return user
+            del self._users[user_id]
+        self.user_misses += 1
+        return None
+
+    def set_user(self, user: User):
+        self._users[user.id] = (time.time() + self.user_ttl_seconds, user)
+        self._users.move_to_end(user.id)
+        while len(self._users) > self.user_cache_size:
+            self._users.popitem(last=False)
+
+    def invalidate_user(self, user_id: Optional[int] = None, email: Optional[str] = None):
+        """Drop cached state for a user after an email or password change."""
+        if user_id is not None:
+            self._users.pop(user_id, None)
+        email = email.lower() if email else None
+        stale = [
+            token for token, (_, token_data) in self._tokens.items()
+            if (user_id is not None and token_data.user_id == user_id) or (email and token_data.email == email)
+        ]
+        for token in stale:
+            del self._tokens[token]
+
+    def clear(self):
+        self._tokens.clear()
+        self._users.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tokens": len(self._tokens),
+            "users": len(self._users),
+            "token_hits": self.token_hits,
+            "token_misses": self.token_misses,
+            "user_hits": self.user_hits,
+            "user_misses": self.user_misses,
+        }
+
+
+auth_cache = AuthCache()
+
+
+@event.listens_for(User, "after_update")
+def invalidate_auth_cache_on_user_update(mapper, connection, target: User):
+    state = inspect(target)
+    if state.attrs.email.history.has_changes() or state.attrs.hashed_password.history.has_changes():
+        previous_emails = state.attrs.email.history.deleted or ()
+        auth_cache.invalidate_user(target.id, target.email)
+        for email in previous_emails:
+            auth_cache.invalidate_user(email=email)
+
+
+@event.listens_for(User, "after_delete")
+def invalidate_auth_cache_on_user_delete(mapper, connection, target: User):
+    auth_cache.invalidate_user(target.id, target.email)
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
+    db: AnySession = Depends(get_db),
 ) -> User:
+    with metrics.timer("auth"):
+        return await resolve_current_user(token, db)
+
+
+async def resolve_current_user(token: str, db: AnySession) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: Optional[str] = payload.get("sub")
-        if email is None:
+    token_data = auth_cache.get_token(token)
+    if token_data is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            email: Optional[str] = payload.get("sub")
+            if email is None:
+                raise credentials_exception
+            token_data = TokenData(email=email.lower(), user_id=payload.get("uid"))
+        except (JWTError, ValueError):
+            raise credentials_exception from None
+        if payload.get("exp") is not None:
+            auth_cache.set_token(token, token_data, float(payload["exp"]))
+
+    # Tokens issued before the uid claim existed still resolve by email
+    if token_data.user_id is None:
+        user = await get_user_by_email(db, token_data.email)
+        if user is None:
             raise credentials_exception
-        token_data = TokenData(email=email)
-    except JWTError:
-        raise credentials_exception from None
+        return user
 
-    user = get_user_by_email(db, token_data.email)
+    user = auth_cache.get_user(token_data.user_id)
     if user is None:
+        user = await db_get(db, User, token_data.user_id)
+        if user is None:
+            raise credentials_exception
+        # Detach so the cached row can be shared safely across sessions
+        db.expunge(user)
+        auth_cache.set_user(user)
+    # The token is bound to the email it was issued for
+    if user.email != token_data.email:
         raise credentials_exception
     return user
 
 
-def save_conversation(
-    db: Session,
+async def save_conversation(
+    db: AnySession,
     user: User,
     request: ToneAnalysisRequest,
     analysis: Dict[str, Any],
 ) -> Conversation:
-    conversation = Conversation(
-        user_id=user.id,
-        original_text=request.text.strip(),
-        context=request.context,
-        detected_tone=analysis.get("detected_tone"),
-        tone_category=analysis.get("tone_category"),
-        confidence=float(analysis.get("confidence", 0.0)) if analysis.get("confidence") is not None else None,
-        analysis_json=json.dumps(analysis, ensure_ascii=False),
-    )
+    conversation = Conversation(**conversation_values(user, request, analysis))
     db.add(conversation)
-    db.commit()
-    db.refresh(conversation)
+    with metrics.timer("db_commit"):
+        await db_commit(db, conversation)
     return conversation
 
 
-def serialize_user(user: User) -> UserOut:
-    return UserOut.model_validate(user)
+def conversation_values(user: User, request: ToneAnalysisRequest, analysis: Dict[str, Any]) -> Dict[str, Any]:
+    values = {
+        "user_id": user.id,
+        "original_text": request.text.strip(),
+        "context": request.context,
+        "detected_tone": analysis.get("detected_tone"),
+        "tone_category": analysis.get("tone_category"),
+        "confidence": float(analysis.get("confidence", 0.0)) if analysis.get("confidence") is not None else None,
+    }
+    values["analysis_json"] = encode_analysis(analysis, values)
+    return values
 
-class GeminiTextToningAnalyzer:
-    def __init__(self):
-        self.api_key = None
-        self.model = None
-        self.initialized = False
-        self.last_request_time = 0
-        self.request_delay = 2
-        
-    def initialize(self) -> bool:
-        """Initialize Gemini with correct model names."""
-        if not HAS_GEMINI:
-            logger.error("Gemini library not available")
-            return False
-            
+
+async def persist_conversation(
+    db: AnySession,
+    user: User,
+    request: ToneAnalysisRequest,
+    analysis: Dict[str, Any],
+) -> Optional[int]:
+    """Store an analysis and return its conversation id, going through the write-behind queue when enabled."""
+    if conversation_writer.running:
+        return await conversation_writer.submit(conversation_values(user, request, analysis))
+    conversation = await save_conversation(db, user, request, analysis)
+    return conversation.id
+
+
+class ConversationWriteBehind:
+    """Queues conversation rows and inserts them in batches from a background task."""
+
+    def __init__(
+        self,
+        flush_interval_ms: int = WRITE_BEHIND_FLUSH_INTERVAL_MS,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        id_timeout: float = WRITE_BEHIND_ID_TIMEOUT_SECONDS,
+    ):
+        self.flush_interval = max(flush_interval_ms, 1) / 1000.0
+        self.batch_size = max(batch_size, 1)
+        self.id_timeout = id_timeout
+        self._queue: Deque[Tuple[Dict[str, Any], asyncio.Future]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.id_timeouts = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._stopping
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Write-behind enabled: batches of {self.batch_size}, every {self.flush_interval * 1000:.0f}ms"
+        )
+
+    async def submit(self, values: Dict[str, Any]) -> Optional[int]:
+        """Queue a row and wait (bounded) for the flush that assigns its id."""
+        # Stamp now so created_at reflects the request, not the flush
+        values.setdefault("created_at", datetime.utcnow())
+        values.setdefault("updated_at", values["created_at"])
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((values, future))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
         try:
-            self.api_key = os.environ.get("GEMINI_API_KEY", "").strip()
-            if not self.api_key:
-                logger.warning("GEMINI_API_KEY not found in environment variables")
-                return False
-            
-            genai.configure(api_key=self.api_key)
-            
-            # Get available models first
+            # shield: a timeout here must not cancel the row's future
+            return await asyncio.wait_for(asyncio.shield(future), self.id_timeout)
+        except asyncio.TimeoutError:
+            self.id_timeouts += 1
+            logger.warning("Write-behind flush exceeded the id timeout; returning without conversation_id")
+            return None
+
+    async def stop(self):
+        """Stop the background task and drain everything still queued."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.flush()
+        logger.info(f"Write-behind drained: {self.rows_written} rows written, {self.rows_failed} failed")
+
+    async def _run(self):
+        while not self._stopping:
             try:
-                available_models = list(genai.list_models())
-                model_names = [model.name for model in available_models]
-                logger.info(f"Available models: {model_names}")
-                
-                # Filter for models that support generateContent
-                supported_models = []
-                for model in available_models:
-                    if 'generateContent' in model.supported_generation_methods:
-                        supported_models.append(model.name)
-                        logger.info(f"Supported model: {model.name}")
-                
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
             except Exception as e:
-                logger.warning(f"Could not list models: {e}")
-                supported_models = []
-            
-            # Try known working model names for the current API
-            model_names_to_try = [
-                "gemini-1.5-flash-001",
-                "gemini-1.5-pro-001",
-                "gemini-1.0-pro",
-                "gemini-pro",
-                "gemini-1.5-flash",
-                "gemini-1.5-pro",
-            ]
-            
-            # Add supported models from the API to our try list
-            if supported_models:
-                model_names_to_try = supported_models + model_names_to_try
-            
-            for model_name in model_names_to_try:
-                try:
-                    logger.info(f"Trying model: {model_name}")
-                    self.model = genai.GenerativeModel(model_name)
-                    # Test the model with a simple prompt
-                    test_response = self.model.generate_content("Say 'OK'")
-                    if test_response and test_response.text:
-                        logger.info(f"✅ Gemini model initialized: {model_name}")
-                        self.initialized = True
-                        return True
-                except Exception as e:
-                    logger.warning(f"Model {model_name} failed: {str(e)[:100]}...")
-                    continue
-            
-            logger.error("No working Gemini model found")
-            return False
-            
-        except Exception as e:
-            logger.error(f"Gemini initialization failed: {e}")
-            return False
-    
-    def wait_for_rate_limit(self):
-        """Wait to avoid rate limiting."""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.request_delay:
-            time.sleep(self.request_delay - time_since_last)
-        self.last_request_time = time.time()
-    
-    def analyze_tone_and_enhance(self, text: str, context: Optional[str] = None) -> Optional[Dict[str, Any]]:
-        """Analyze text tone and provide enhanced versions."""
-        if not self.initialized or not self.model:
-            logger.error("Gemini not initialized")
-            return None
-        
-        self.wait_for_rate_limit()
-        
+                logger.error(f"Write-behind flush failed: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._queue:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        rows = [values for values, _ in batch]
         try:
-            # Enhanced prompt for tone analysis and text enhancement
-            prompt = self._build_analysis_prompt(text, context)
-            
-            # Generate content
-            response = self.model.generate_content(prompt)
-            
-            if response and response.text:
-                logger.info("Gemini tone analysis response received")
-                return self.parse_tone_analysis_response(response.text, text)
-            else:
-                logger.warning("Gemini returned empty response")
-                return None
-                
+            with metrics.timer("db_commit"):
+                ids = await self._insert(rows)
         except Exception as e:
-            logger.error(f"Gemini tone analysis error: {e}")
-            if "429" in str(e) or "quota" in str(e).lower():
-                logger.warning("Rate limit hit, increasing delay")
-                self.request_delay += 2
-            return None
+            # Retry row by row so one bad row doesn't drop the whole batch
+            logger.error(f"Write-behind batch of {len(rows)} failed, retrying individually: {e}")
+            ids = []
+            for values in rows:
+                try:
+                    ids.extend(await self._insert([values]))
+                except Exception as row_error:
+                    logger.error(f"Write-behind dropped a conversation for user {values.get('user_id')}: {row_error}")
+                    ids.append(None)
+                    self.rows_failed += 1
+        self.flushes += 1
+        self.rows_written += sum(1 for conversation_id in ids if conversation_id is not None)
+        for (_, future), conversation_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(conversation_id)
+
+    async def _insert(self, rows: List[Dict[str, Any]]) -> List[int]:
+        # add_all + flush goes out as multi-row INSERT ... RETURNING where the dialect supports it
+        conversations = [Conversation(**values) for values in rows]
+        if AsyncSessionLocal is not None:
+            async with AsyncSessionLocal() as db:
+                db.add_all(conversations)
+                await db.flush()
+                ids = [conversation.id for conversation in conversations]
+                await db.commit()
+            return ids
+        return await asyncio.get_running_loop().run_in_executor(None, self._insert_sync, conversations)
+
+    @staticmethod
+    def _insert_sync(conversations: List[Conversation]) -> List[int]:
+        db = SessionLocal()
+        try:
+            db.add_all(conversations)
+            db.flush()
+            ids = [conversation.id for conversation in conversations]
+            db.commit()
+            return ids
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.running,
+            "queued": len(self._queue),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "id_timeouts": self.id_timeouts,
+        }
+
+
+conversation_writer = ConversationWriteBehind()
+
+
+def serialize_user(user: User) -> UserOut:
+    return UserOut.model_validate(user)
+
+
+def validate_analysis_request(request: ToneAnalysisRequest):
+    if not request.text or not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
     
-    def _build_analysis_prompt(self, text: str, context: Optional[str] = None) -> str:
-        """Build the prompt for tone analysis."""
-        context_part = f"Context: {context}\n" if context else ""
-        
-        prompt = f"""
-        Analyze the tone of the following text and provide enhanced versions in different tones.
-        
-        {context_part}
-        Text to analyze: "{text}"
-        
-        Please provide your response in this exact format:
-        
+    if len(request.text) > 1000:
+        raise HTTPException(status_code=400, detail="Text too long. Maximum 1000 characters.")
+
+
+async def run_tone_analysis(request: ToneAnalysisRequest, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+    """Route an analysis to the local classifier and/or Gemini; None means use the fallback."""
+    classifier = gemini_analyzer.local_classifier
+    if classifier is not None and LOCAL_CLASSIFIER_ROUTING in ("enhance", "local"):
+        tone, confidence = classifier.predict(request.text)
+        if confidence >= LOCAL_CLASSIFIER_THRESHOLD:
+            if LOCAL_CLASSIFIER_ROUTING == "enhance" and gemini_analyzer.initialized:
+                enhanced = await gemini_analyzer.enhance_with_known_tone_async(
+                    request.text, tone, confidence, request.context, use_cache=use_cache,
+                )
+                if enhanced:
+                    return {**enhanced, "service": "local-classifier+gemini"}
+            return {
+                **gemini_analyzer._generate_local_analysis(request.text, tone, confidence),
+                "service": "local-classifier",
+            }
+
+    # Try Gemini first
+    if gemini_analyzer.initialized:
+        return await gemini_analyzer.analyze_tone_and_enhance_async(
+            request.text,
+            request.context,
+            use_cache=use_cache,
+        )
+    return None
+
+
+def build_analysis_payload(analysis_result: Optional[Dict[str, Any]], request: ToneAnalysisRequest) -> Dict[str, Any]:
+    """Turn a Gemini analysis (or None) into the /analyze-tone response payload."""
+    response_payload: Dict[str, Any]
+    if analysis_result:
+        logger.info("Successfully generated tone analysis")
+        response_payload = dict(analysis_result)
+    else:
+        # Fallback to smart analysis
+        logger.info("Using fallback tone analysis")
+        metrics.inc("fallback")
+        fallback_analysis = gemini_analyzer._generate_fallback_analysis(request.text)
+        response_payload = {
+            **fallback_analysis,
+            "service": "smart-fallback",
+            "note": "Gemini unavailable. Using smart fallback analysis.",
+        }
+
+    response_payload["context"] = request.context
+    if response_payload.get("confidence") is not None:
+        try:
+            response_payload["confidence"] = float(response_payload["confidence"])
+        except (TypeError, ValueError):
+            response_payload["confidence"] = 0.0
+    else:
+        response_payload["confidence"] = 0.0
+    return response_payload
+
+
+def analysis_events(analysis: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Replay a complete analysis as the events emitted by the streaming endpoint."""
+    events: List[Dict[str, Any]] = [{
+        "event": "tone",
+        "detected_tone": analysis.get("detected_tone"),
+        "confidence": analysis.get("confidence"),
+        "tone_category": analysis.get("tone_category"),
+    }]
+    if analysis.get("explanation"):
+        events.append({"event": "explanation", "explanation": analysis["explanation"]})
+    for index, version in enumerate(analysis.get("enhanced_versions") or [], start=1):
+        events.append({"event": "enhanced_version", "index": index, **version})
+    for suggestion in analysis.get("suggestions") or []:
+        events.append({"event": "suggestion", "text": suggestion})
+    return events
+
+
+def encode_ndjson(event: Dict[str, Any]) -> bytes:
+    return (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def should_bypass_cache(request: Request) -> bool:
+    if request.headers.get(CACHE_BYPASS_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    return "no-cache" in request.headers.get("Cache-Control", "").lower()
+
+class SharedStateStore:
+    """Cross-process state for one host, kept in a small WAL-mode SQLite file."""
+
+    LIMITER_FIELDS = ("rate", "tokens", "updated_at", "blocked_until", "last_backoff", "backoffs", "retry_hints")
+    PURGE_EVERY = 256
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection must not cross a fork, so each process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limiter (name TEXT PRIMARY KEY, rate REAL, tokens REAL, updated_at REAL, "
+                "blocked_until REAL, last_backoff REAL, backoffs INTEGER, retry_hints INTEGER)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache (cache_key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def update_limiter(self, name: str, limiter: "AdaptiveRateLimiter", update):
+        """Load the limiter's bucket, run update() under an exclusive lock, and store the result."""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    f"SELECT {', '.join(self.LIMITER_FIELDS)} FROM rate_limiter WHERE name = ?", (name,)
+                ).fetchone()
+                if row is not None:
+                    for field, value in zip(self.LIMITER_FIELDS, row):
+                        setattr(limiter, field, value)
+                result = update()
+                connection.execute(
+                    f"INSERT OR REPLACE INTO rate_limiter (name, {', '.join(self.LIMITER_FIELDS)}) "
+                    f"VALUES (?, {', '.join('?' for _ in self.LIMITER_FIELDS)})",
+                    (name, *(getattr(limiter, field) for field in self.LIMITER_FIELDS)),
+                )
+                connection.execute("COMMIT")
+                return result
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def load_limiter(self, name: str, limiter: "AdaptiveRateLimiter"):
+        """Refresh the limiter from its stored bucket without taking the write lock."""
+        with self._lock:
+            row = self._connect().execute(
+                f"SELECT {', '.join(self.LIMITER_FIELDS)} FROM rate_limiter WHERE name = ?", (name,)
+            ).fetchone()
+        if row is not None:
+            for field, value in zip(self.LIMITER_FIELDS, row):
+                setattr(limiter, field, value)
+
+    def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value FROM analysis_cache WHERE cache_key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            try:
+                return json.loads(zlib.decompress(row[0]))
+            except (zlib.error, ValueError) as e:
+                # A truncated or foreign blob is a miss; drop it so the next set replaces it
+                logger.warning(f"Dropping unreadable shared cache entry: {e}")
+                connection.execute("DELETE FROM analysis_cache WHERE cache_key = ?", (key,))
+                return None
+
+    def cache_set(self, key: str, value: Dict[str, Any], ttl_seconds: float):
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO analysis_cache (cache_key, value, expires_at) VALUES (?, ?, ?)",
+                (key, blob, now + ttl_seconds),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                connection.execute("DELETE FROM analysis_cache WHERE expires_at <= ?", (now,))
+
+    def cache_clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM analysis_cache")
+
+
+shared_state = SharedStateStore(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+
+
+def normalize_cache_text(value: Optional[str]) -> str:
+    return " ".join((value or "").split())
+
+
+class AnalysisCache:
+    """LRU + TTL cache of Gemini analyses with optional cross-worker and SQL-backed tiers."""
+
+    PURGE_EVERY = 256
+
+    def __init__(
+        self,
+        max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = ANALYSIS_CACHE_TTL_SECONDS,
+        persist: bool = ANALYSIS_CACHE_PERSIST,
+        enabled: bool = ANALYSIS_CACHE_ENABLED,
+        shared: Optional[SharedStateStore] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist = persist
+        self.enabled = enabled
+        self.shared = shared
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._background: set = set()
+        self._persistent_writes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @staticmethod
+    def make_key(text: str, context: Optional[str], model_name: str) -> str:
+        raw = json.dumps(
+            [PROMPT_VERSION, model_name, normalize_cache_text(text), normalize_cache_text(context).lower()],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look a key up in every tier. The shared and SQL tiers block, so use get_async on the event loop."""
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is None and self.shared is not None:
+            value = self._remember(key, self._load_shared(key), "shared_hits")
+        if value is None and self.persist:
+            value = self._remember(key, self._load_persistent(key), "persistent_hits")
+        if value is None:
+            self.misses += 1
+        return value
+
+    async def get_async(self, key: str) -> Optional[Dict[str, Any]]:
+        """get() for the event loop: the shared and SQL tiers are read on a worker thread."""
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is None and self.shared is not None:
+            value = self._remember(key, await asyncio.to_thread(self._load_shared, key), "shared_hits")
+        if value is None and self.persist:
+            value = self._remember(key, await asyncio.to_thread(self._load_persistent, key), "persistent_hits")
+        if value is None:
+            self.misses += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        if not self.enabled:
+            return
+        value = copy.deepcopy(value)
+        self._store_memory(key, value)
+        if self.shared is not None:
+            self._in_background(self._save_shared, key, value)
+        if self.persist:
+            self._in_background(self._save_persistent, key, value)
+
+    def _in_background(self, func, *args):
+        # On the event loop the write goes to a worker thread; callers in threads just run it
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            func(*args)
+            return
+        task = loop.create_task(asyncio.to_thread(func, *args))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def record_bypass(self):
+        self.bypassed += 1
+
+    def clear(self):
+        self._entries.clear()
+        if self.shared is not None:
+            self.shared.cache_clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "persistent": self.persist,
+            "shared": self.shared is not None,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(value)
+
+    def _remember(self, key: str, value: Optional[Dict[str, Any]], counter: str) -> Optional[Dict[str, Any]]:
+        # Promote a hit from a slower tier into memory
+        if value is None:
+            return None
+        self._store_memory(key, value)
+        self.hits += 1
+        setattr(self, counter, getattr(self, counter) + 1)
+        return copy.deepcopy(value)
+
+    def _store_memory(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = (time.time() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load_shared(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self.shared.cache_get(key)
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            logger.warning(f"Shared analysis cache read failed: {e}")
+            return None
+
+    def _save_shared(self, key: str, value: Dict[str, Any]):
+        try:
+            self.shared.cache_set(key, value, self.ttl_seconds)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared analysis cache write failed: {e}")
+
+    def _load_persistent(self, key: str) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            entry = db.get(AnalysisCacheEntry, key)
+            if entry is None:
+                return None
+            if entry.expires_at <= datetime.utcnow():
+                db.delete(entry)
+                db.commit()
+                return None
+            return json.loads(entry.analysis_json)
+        except Exception as e:
+            logger.warning(f"Analysis cache read failed: {e}")
+            return None
+        finally:
+            db.close()
+
+    def _save_persistent(self, key: str, value: Dict[str, Any]):
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            db.merge(AnalysisCacheEntry(
+                cache_key=key,
+                analysis_json=json.dumps(value, ensure_ascii=False),
+                created_at=now,
+                expires_at=now + timedelta(seconds=self.ttl_seconds),
+            ))
+            self._persistent_writes += 1
+            if self._persistent_writes % self.PURGE_EVERY == 0:
+                # Expired rows are otherwise only removed when their own key is read again
+                db.query(AnalysisCacheEntry).filter(AnalysisCacheEntry.expires_at <= now).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            logger.warning(f"Analysis cache write failed: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+
+class StreamingToneParser:
+    """Incrementally parses a streamed Gemini analysis, emitting each field once its line is complete."""
+
+    HEADER_FIELDS = ("detected_tone", "confidence", "tone_category")
+
+    def __init__(self):
+        self._buffer = ""
+        self._chunks: List[str] = []
+        self._header: Dict[str, Any] = {}
+        self._tone_sent = False
+        self._section: Optional[str] = None
+        self._enhanced_count = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self._chunks.append(chunk)
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        events: List[Dict[str, Any]] = []
+        for line in lines:
+            events.extend(self._parse_line(line.strip()))
+        return events
+
+    def finish(self) -> List[Dict[str, Any]]:
+        events = self._parse_line(self._buffer.strip())
+        self._buffer = ""
+        return events + self._tone_event()
+
+    def _tone_event(self) -> List[Dict[str, Any]]:
+        if self._tone_sent or "detected_tone" not in self._header:
+            return []
+        self._tone_sent = True
+        return [{"event": "tone", **{field: self._header.get(field) for field in self.HEADER_FIELDS}}]
+
+    def _parse_line(self, line: str) -> List[Dict[str, Any]]:
+        if not line:
+            return []
+        line_lower = line.lower()
+        events: List[Dict[str, Any]] = []
+
+        if line_lower.startswith("detected_tone:"):
+            self._header["detected_tone"] = line.split(":", 1)[1].strip()
+        elif line_lower.startswith("confidence:"):
+            try:
+                self._header["confidence"] = float(line.split(":", 1)[1].strip())
+            except ValueError:
+                self._header["confidence"] = 0.8
+        elif line_lower.startswith("tone_category:"):
+            self._header["tone_category"] = line.split(":", 1)[1].strip()
+        elif line_lower.startswith("explanation:"):
+            events.extend(self._tone_event())
+            events.append({"event": "explanation", "explanation": line.split(":", 1)[1].strip()})
+        elif line_lower.startswith("enhanced_versions:"):
+            events.extend(self._tone_event())
+            self._section = "enhanced"
+        elif line_lower.startswith("suggestions:"):
+            events.extend(self._tone_event())
+            self._section = "suggestions"
+        elif self._section == "enhanced" and re.match(r'^\d+\.', line):
+            parts = line.split(":", 1)
+            if len(parts) == 2:
+                self._enhanced_count += 1
+                events.append({
+                    "event": "enhanced_version",
+                    "index": self._enhanced_count,
+                    "tone": parts[0].split(".", 1)[1].strip(),
+                    "text": parts[1].strip(),
+                })
+        elif self._section == "suggestions" and line.startswith("-"):
+            suggestion = line[1:].strip()
+            if suggestion:
+                events.append({"event": "suggestion", "text": suggestion})
+
+        if all(field in self._header for field in self.HEADER_FIELDS):
+            events = self._tone_event() + events
+        return events
+
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from a Retry-After header, RetryInfo detail or message hint."""
+    response = getattr(error, "response", None)
+    header = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(header) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    for detail in getattr(error, "details", None) or []:
+        retry_delay = getattr(detail, "retry_delay", None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+    match = RETRY_HINT_PATTERN.search(str(error))
+    if match:
+        return float(match.group(1)) / (1000.0 if match.group(2) else 1.0)
+    return None
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate backs off multiplicatively on 429s and recovers additively.
+    
+    With a SharedStateStore the bucket lives in the shared file, so every worker
+    on the host draws from, and backs off, the same quota.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float = GEMINI_RATE_LIMIT_RPM,
+        burst: float = GEMINI_RATE_LIMIT_BURST,
+        min_rate_per_minute: float = GEMINI_RATE_LIMIT_MIN_RPM,
+        backoff: float = GEMINI_RATE_LIMIT_BACKOFF,
+        recovery_per_minute: float = GEMINI_RATE_LIMIT_RECOVERY_RPM,
+        shared: Optional[SharedStateStore] = None,
+        name: str = "gemini",
+    ):
+        self.enabled = rate_per_minute > 0
+        self.max_rate = rate_per_minute / 60.0
+        self.min_rate = min(min_rate_per_minute / 60.0, self.max_rate)
+        self.rate = self.max_rate
+        self.burst = max(1.0, burst)
+        self.backoff = backoff
+        self.recovery = recovery_per_minute / 60.0
+        self.shared = shared
+        self.name = name
+        # Wall-clock times so they stay comparable across worker processes
+        self.tokens = self.burst
+        self.updated_at = time.time()
+        self.blocked_until = 0.0
+        # Concurrent 429s from one overload count as a single backoff
+        self.backoff_cooldown = 1.0
+        self.last_backoff = 0.0
+        self.backoffs = 0
+        self.retry_hints = 0
+        self._background: set = set()
+
+    def _apply(self, update):
+        """Run a state transition, under the shared lock when the bucket is shared."""
+        if self.shared is None:
+            return update()
+        try:
+            return self.shared.update_limiter(self.name, self, update)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared rate limiter unavailable, limiting locally: {e}")
+            return update()
+
+    async def _apply_async(self, update):
+        # The shared bucket may wait on another process's lock, so that runs on a worker thread
+        if self.shared is None:
+            return update()
+        return await asyncio.to_thread(self._apply, update)
+
+    def _apply_soon(self, update):
+        """Apply a transition whose result nobody waits for, off the event loop when on it."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self.shared is None or loop is None:
+            self._apply(update)
+            return
+        task = loop.create_task(asyncio.to_thread(self._apply, update))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def reserve(self) -> float:
+        """Take a token (possibly one not yet refilled) and return how long to wait for it."""
+        if not self.enabled:
+            return 0.0
+        return self._apply(self._reserve)
+
+    def _reserve(self) -> float:
+        # No await in here, so concurrent callers queue up behind each other's reservations
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def try_reserve(self) -> bool:
+        """Take a token only if one is available right now (used for optional calls like hedges)."""
+        if not self.enabled:
+            return True
+        return self._apply(self._try_reserve)
+
+    async def try_reserve_async(self) -> bool:
+        if not self.enabled:
+            return True
+        return await self._apply_async(self._try_reserve)
+
+    def _try_reserve(self) -> bool:
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1 or now < self.blocked_until:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self):
+        wait = await self._apply_async(self._reserve) if self.enabled else 0.0
+        metrics.observe("rate_limit_wait", wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        wait = self.reserve()
+        metrics.observe("rate_limit_wait", wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        if self.enabled:
+            self._apply_soon(self._recover)
+
+    def _recover(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        if self.enabled:
+            self._apply_soon(lambda: self._back_off(retry_after))
+
+    def _back_off(self, retry_after: Optional[float]):
+        now = time.time()
+        if retry_after is not None:
+            self.retry_hints += 1
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            # Nothing saved up may be spent before the server's deadline
+            self.tokens = min(self.tokens, 0.0)
+        if now - self.last_backoff >= self.backoff_cooldown:
+            self.last_backoff = now
+            self.backoffs += 1
+            self.rate = max(self.min_rate, self.rate * self.backoff)
+            logger.warning(f"Gemini rate limit hit, backing off to {self.rate * 60:.1f} requests/min")
+
+    @property
+    def delay(self) -> float:
+        """Current spacing between calls in seconds."""
+        return 1.0 / self.rate if self.enabled else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        if self.enabled and self.shared is not None:
+            try:
+                self.shared.load_limiter(self.name, self)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared rate limiter unavailable: {e}")
+        return {
+            "enabled": self.enabled,
+            "shared": self.shared is not None,
+            "rate_per_minute": round(self.rate * 60, 2),
+            "max_rate_per_minute": round(self.max_rate * 60, 2),
+            "tokens": round(max(self.tokens, 0.0), 2),
+            "blocked_for_seconds": round(max(0.0, self.blocked_until - time.time()), 2),
+            "backoffs": self.backoffs,
+            "retry_hints": self.retry_hints,
+        }
+
+
+class ModelCircuitOpenError(Exception):
+    """Raised when every pooled Gemini model is failing and its circuit is open."""
+
+
+class ModelHealth:
+    """Recent latency, outcomes and circuit breaker state of one pooled Gemini model."""
+
+    WINDOW = 100
+
+    def __init__(self, model: Any, probe_latency: Optional[float] = None):
+        self.model = model
+        self.name = getattr(model, "model_name", "") or ""
+        self.probe_latency = probe_latency
+        self.latencies: Deque[float] = deque(maxlen=self.WINDOW)
+        self.outcomes: Deque[bool] = deque(maxlen=self.WINDOW)
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.trial_inflight = False
+
+    @property
+    def state(self) -> str:
+        if self.consecutive_failures < GEMINI_BREAKER_FAILURES:
+            return "closed"
+        return "open" if time.monotonic() < self.opened_until else "half_open"
+
+    @property
+    def available(self) -> bool:
+        # A half-open breaker lets a single trial call through
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.trial_inflight)
+
+    @property
+    def latency(self) -> Optional[float]:
+        """Median of recent successful calls, or the probe time before any were seen."""
+        if not self.latencies:
+            return self.probe_latency
+        ordered = sorted(self.latencies)
+        return ordered[len(ordered) // 2]
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < max(1, GEMINI_HEDGE_MIN_SAMPLES):
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def stats(self) -> Dict[str, Any]:
+        latency = self.latency
+        hedge_after = self.percentile(GEMINI_HEDGE_PERCENTILE)
+        return {
+            "name": self.name,
+            "state": self.state,
+            "latency_ms": round(latency * 1000, 1) if latency is not None else None,
+            "hedge_after_ms": round(hedge_after * 1000, 1) if hedge_after is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "calls": self.calls,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class ModelPool:
+    """Working Gemini models in preference order, routed by measured latency and health."""
+
+    def __init__(self, models: Optional[List[Any]] = None, probe_latencies: Optional[List[Optional[float]]] = None):
+        models = models or []
+        probe_latencies = probe_latencies or [None] * len(models)
+        self.members = [ModelHealth(model, latency) for model, latency in zip(models, probe_latencies)]
+
+    def route(self) -> List[ModelHealth]:
+        """Available models, fastest first; unmeasured ones follow in preference order."""
+        available = [member for member in self.members if member.available]
+        return sorted(available, key=lambda member: (member.latency is None, member.latency or 0.0))
+
+    @property
+    def primary(self) -> Optional[ModelHealth]:
+        routed = self.route()
+        if routed:
+            return routed[0]
+        return self.members[0] if self.members else None
+
+    @property
+    def cache_name(self) -> str:
+        # Stable across routing changes so the analysis cache keeps hitting
+        return self.members[0].name if self.members else ""
+
+    def all_open(self) -> bool:
+        return bool(self.members) and not any(member.available for member in self.members)
+
+    def begin(self, member: ModelHealth):
+        if member.state == "half_open":
+            member.trial_inflight = True
+
+    def release(self, member: ModelHealth):
+        """Forget a call that was abandoned (e.g. a hedge that lost) without judging the model."""
+        member.trial_inflight = False
+
+    def record_success(self, member: ModelHealth, latency: Optional[float] = None):
+        if member.state != "closed":
+            logger.info(f"Gemini model {member.name} recovered, closing its circuit")
+        member.calls += 1
+        member.outcomes.append(True)
+        if latency is not None:
+            member.latencies.append(latency)
+        member.consecutive_failures = 0
+        member.trial_inflight = False
+
+    def record_failure(self, member: ModelHealth):
+        member.calls += 1
+        member.failures += 1
+        member.outcomes.append(False)
+        member.consecutive_failures += 1
+        member.trial_inflight = False
+        if member.consecutive_failures >= GEMINI_BREAKER_FAILURES:
+            member.opened_until = time.monotonic() + GEMINI_BREAKER_COOLDOWN_SECONDS
+            logger.warning(
+                f"Gemini model {member.name} failed {member.consecutive_failures} times in a row, "
+                f"opening its circuit for {GEMINI_BREAKER_COOLDOWN_SECONDS:g}s"
+            )
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [member.stats() for member in self.members]
+
+
+class AnalysisBatchScheduler:
+    """Collects analyses arriving within a short window and sends them as one Gemini prompt."""
+
+    def __init__(
+        self,
+        analyzer: "GeminiTextToningAnalyzer",
+        window_ms: int = GEMINI_BATCH_WINDOW_MS,
+        max_size: int = GEMINI_BATCH_MAX_SIZE,
+    ):
+        self.analyzer = analyzer
+        self.window = window_ms / 1000
+        self.max_size = max(1, max_size)
+        self._pending: List[Tuple[str, Optional[str], str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # Strong references so the event loop can't garbage-collect a running batch
+        self._tasks: set = set()
+        self.batches_sent = 0
+        self.batched_items = 0
+        self.single_fallbacks = 0
+
+    async def submit(self, text: str, context: Optional[str], cache_key: str) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, context, cache_key, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": int(self.window * 1000),
+            "max_size": self.max_size,
+            "pending": len(self._pending),
+            "batches_sent": self.batches_sent,
+            "batched_items": self.batched_items,
+            "single_fallbacks": self.single_fallbacks,
+        }
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            items, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+            task = asyncio.ensure_future(self._run_batch(items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, items: List[Tuple[str, Optional[str], str, asyncio.Future]]):
+        try:
+            await self._analyze_batch(items)
+        except Exception as e:
+            logger.error(f"Batched tone analysis failed: {e}")
+        finally:
+            # Whatever happened, no caller is left waiting (None means fall back)
+            for _, _, _, future in items:
+                self._resolve(future, None)
+
+    async def _analyze_batch(self, items: List[Tuple[str, Optional[str], str, asyncio.Future]]):
+        analyzer = self.analyzer
+        if len(items) == 1:
+            text, context, cache_key, future = items[0]
+            self._resolve(future, await analyzer._analyze_single_async(text, context, cache_key))
+            return
+        if analyzer._circuit_open():
+            return
+
+        self.batches_sent += 1
+        self.batched_items += len(items)
+        texts = [text for text, _, _, _ in items]
+        results: List[Optional[Dict[str, Any]]]
+        await analyzer.wait_for_rate_limit_async()
+        try:
+            prompt = analyzer._build_batch_analysis_prompt([(text, context) for text, context, _, _ in items])
+            async with analyzer._get_semaphore():
+                response = await analyzer._generate_content_async(prompt)
+            if not response or not response.text:
+                logger.warning("Gemini returned empty batch response")
+                results = [None] * len(items)
+            else:
+                logger.info(f"Gemini batch response received for {len(items)} texts")
+                results = analyzer.parse_batch_analysis_response(response.text, texts)
+        except Exception as e:
+            analyzer._handle_generation_error(e)
+            return
+
+        retries = []
+        for (text, context, cache_key, future), result in zip(items, results):
+            if result is not None:
+                analyzer.cache.set(cache_key, result)
+                self._resolve(future, result)
+            else:
+                self.single_fallbacks += 1
+                retries.append(self._retry_single(text, context, cache_key, future))
+        if retries:
+            logger.warning(f"{len(retries)} batched item(s) failed to parse, retrying individually")
+            await asyncio.gather(*retries)
+
+    async def _retry_single(self, text: str, context: Optional[str], cache_key: str, future: asyncio.Future):
+        self._resolve(future, await self.analyzer._analyze_single_async(text, context, cache_key))
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Optional[Dict[str, Any]]):
+        if not future.done():
+            future.set_result(result)
+
+
+class GeminiTextToningAnalyzer:
+    ANALYSIS_FORMAT_INSTRUCTIONS = """Please provide your response in this exact format:
+
         DETECTED_TONE: [primary tone name]
         CONFIDENCE: [0.XX]
         TONE_CATEGORY: [formal/casual/professional/friendly/persuasive/inspirational/empathetic/authoritative/enthusiastic/neutral]
         EXPLANATION: [brief explanation of why this tone was detected]
-        
+
         ENHANCED_VERSIONS:
         1. [Tone Name]: [Enhanced version of the text]
         2. [Tone Name]: [Enhanced version of the text]
         3. [Tone Name]: [Enhanced version of the text]
-        
+
         SUGGESTIONS:
         - [Suggestion 1]
         - [Suggestion 2]
         - [Suggestion 3]
-        
+
         Guidelines for enhancement:
         - Keep the core meaning intact
         - Make enhancements natural and context-appropriate
         - Ensure each enhanced version clearly demonstrates the target tone
         - Provide practical, actionable suggestions
-        
-        Available tones for enhancement: Formal, Casual, Professional, Friendly, Persuasive, Inspirational, Empathetic, Authoritative, Enthusiastic.
-        """
-        
-        return prompt
+
+        Available tones for enhancement: Formal, Casual, Professional, Friendly, Persuasive, Inspirational, Empathetic, Authoritative, Enthusiastic."""
+    
+    STRUCTURED_ANALYSIS_SHAPE = (
+        '{"tone":str,"confidence":0-1,"category":"' + "|".join(tone.value for tone in ToneCategory) + '",'
+        '"explanation":str,"enhanced":[{"tone":str,"text":str}]x3,"suggestions":[str]x3}'
+    )
+    STRUCTURED_ENHANCEMENT_SHAPE = '{"enhanced":[{"tone":str,"text":str}]x3,"suggestions":[str]x3}'
     
-    def parse_tone_analysis_response(self, response_text: str, original_text: str) -> Dict[str, Any]:
-        """Parse Gemini response into structured tone analysis."""
+    def __init__(self):
+        self.api_key = None
+        self.pool = ModelPool()
+        self.initialized = False
+        self.limiter = AdaptiveRateLimiter(shared=shared_state)
+        self.async_mode = GEMINI_ASYNC_MODE
+        self.max_concurrency = GEMINI_MAX_CONCURRENCY
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.cache = AnalysisCache(shared=shared_state)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced_requests = 0
+        self.batch_enabled = GEMINI_BATCH_ENABLED
+        self.batcher = AnalysisBatchScheduler(self)
+        self.local_classifier: Optional[LocalToneClassifier] = None
+        self._init_task: Optional[asyncio.Task] = None
+        self.structured_output = GEMINI_STRUCTURED_OUTPUT
+        self._json_mime_supported: Optional[bool] = None
+
+    def initialize(self) -> bool:
+        """Initialize Gemini with correct model names."""
+        if not HAS_GEMINI:
+            logger.error("Gemini library not available")
+            return False
+            
         try:
-            lines = [line.strip() for line in response_text.split('\n') if line.strip()]
+            self.api_key = os.environ.get("GEMINI_API_KEY", "").strip()
+            if not self.api_key:
+                logger.warning("GEMINI_API_KEY not found in environment variables")
+                return False
             
-            detected_tone = "neutral"
-            confidence = 0.8
-            tone_category = "neutral"
-            explanation = "The tone appears balanced and neutral."
-            enhanced_versions = []
-            suggestions = []
+            genai = load_genai()
+            genai.configure(api_key=self.api_key)
             
-            current_section = None
+            # Recently selected models skip discovery and probing entirely
+            cached_models = self._load_cached_model_names()
+            if cached_models:
+                self.pool = ModelPool([genai.GenerativeModel(name) for name in cached_models])
+                self.initialized = True
+                logger.info(f"✅ Gemini models initialized from cache: {', '.join(cached_models)}")
+                return True
             
-            for line in lines:
-                line_lower = line.lower()
-                
-                # Parse detected tone
-                if line_lower.startswith("detected_tone:"):
-                    detected_tone = line.split(":", 1)[1].strip()
-                elif line_lower.startswith("confidence:"):
-                    try:
-                        conf_str = line.split(":", 1)[1].strip()
-                        confidence = float(conf_str)
-                    except ValueError:
-                        confidence = 0.8
-                elif line_lower.startswith("tone_category:"):
-                    tone_category = line.split(":", 1)[1].strip()
-                elif line_lower.startswith("explanation:"):
-                    explanation = line.split(":", 1)[1].strip()
-                elif line_lower.startswith("enhanced_versions:"):
-                    current_section = "enhanced"
-                    continue
-                elif line_lower.startswith("suggestions:"):
-                    current_section = "suggestions"
-                    continue
-                
-                # Parse enhanced versions
-                if current_section == "enhanced" and re.match(r'^\d+\.', line):
-                    parts = line.split(":", 1)
-                    if len(parts) == 2:
-                        tone_name = parts[0].split(".", 1)[1].strip()
-                        enhanced_text = parts[1].strip()
-                        enhanced_versions.append({
-                            "tone": tone_name,
-                            "text": enhanced_text
-                        })
+            working = self._probe_models(self._candidate_model_names())
+            if working:
+                model_names = [name for name, _ in working]
+                self.pool = ModelPool(
+                    [genai.GenerativeModel(name) for name in model_names],
+                    [latency for _, latency in working],
+                )
+                self.initialized = True
+                self._save_cached_model_names(model_names)
+                logger.info(f"✅ Gemini models initialized: {', '.join(model_names)}")
+                return True
+            
+            logger.error("No working Gemini model found")
+            return False
+            
+        except Exception as e:
+            logger.error(f"Gemini initialization failed: {e}")
+            return False
+    
+    def start_background_initialize(self) -> asyncio.Task:
+        """Run initialize() on a worker thread; requests use the fallback until it finishes."""
+        async def run():
+            if await asyncio.to_thread(self.initialize):
+                logger.info("✅ Gemini Text Toning Analyzer initialized successfully")
+            else:
+                logger.warning("❌ Gemini initialization failed - using fallback mode")
+
+        self._init_task = asyncio.create_task(run())
+        return self._init_task
+    
+    @property
+    def initializing(self) -> bool:
+        return self._init_task is not None and not self._init_task.done()
+    
+    def _candidate_model_names(self) -> List[str]:
+        # Models the API reports as supporting generateContent go first
+        try:
+            available_models = list(genai.list_models())
+            logger.info(f"Available models: {[model.name for model in available_models]}")
+            supported_models = [
+                model.name for model in available_models
+                if 'generateContent' in model.supported_generation_methods
+            ]
+        except Exception as e:
+            logger.warning(f"Could not list models: {e}")
+            supported_models = []
+        return list(dict.fromkeys(supported_models + GEMINI_FALLBACK_MODELS))
+    
+    @staticmethod
+    def _probe_model(model_name: str) -> Optional[float]:
+        """Return how long the probe took, or None if the model gave no answer."""
+        started = time.perf_counter()
+        test_response = genai.GenerativeModel(model_name).generate_content("Say 'OK'")
+        if test_response and test_response.text:
+            return time.perf_counter() - started
+        return None
+    
+    def _probe_models(self, model_names: List[str]) -> List[Tuple[str, float]]:
+        """Probe candidates concurrently; return the most preferred working ones (up to the pool size)
+        with their probe latency."""
+        if not model_names:
+            return []
+        limit = max(1, GEMINI_MODEL_POOL_SIZE)
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, min(GEMINI_PROBE_CONCURRENCY, len(model_names))),
+            thread_name_prefix="gemini-probe",
+        )
+        futures = [executor.submit(self._probe_model, model_name) for model_name in model_names]
+        try:
+            try:
+                for _ in as_completed(futures, timeout=GEMINI_PROBE_DEADLINE_SECONDS):
+                    # Settle on the pool once every more preferred candidate has finished
+                    working = []
+                    for model_name, future in zip(model_names, futures):
+                        if not future.done():
+                            break
+                        if self._probe_succeeded(model_name, future):
+                            working.append((model_name, future.result()))
+                            if len(working) >= limit:
+                                return working
+                    else:
+                        return working
+            except FuturesTimeoutError:
+                logger.warning(f"Gemini model probing hit the {GEMINI_PROBE_DEADLINE_SECONDS:.0f}s deadline")
+            return [
+                (model_name, future.result())
+                for model_name, future in zip(model_names, futures)
+                if future.done() and self._probe_succeeded(model_name, future)
+            ][:limit]
+        finally:
+            # Candidates not yet probed are dropped so they don't spend quota
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    def _probe_succeeded(model_name: str, future) -> bool:
+        if future.cancelled():
+            return False
+        error = future.exception()
+        if error is not None:
+            logger.warning(f"Model {model_name} failed: {str(error)[:100]}...")
+            return False
+        return future.result() is not None
+    
+    def _api_key_fingerprint(self) -> str:
+        return hashlib.sha256(self.api_key.encode("utf-8")).hexdigest()[:16]
+    
+    def _load_cached_model_names(self) -> List[str]:
+        if not GEMINI_MODEL_CACHE_PATH or not os.path.exists(GEMINI_MODEL_CACHE_PATH):
+            return []
+        try:
+            with open(GEMINI_MODEL_CACHE_PATH, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("api_key") != self._api_key_fingerprint():
+                return []
+            if time.time() - float(cached["selected_at"]) > GEMINI_MODEL_CACHE_TTL_SECONDS:
+                return []
+            # Files written before pooling hold a single "model"
+            return list(cached.get("models") or [cached["model"]])[:max(1, GEMINI_MODEL_POOL_SIZE)]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring Gemini model cache {GEMINI_MODEL_CACHE_PATH}: {e}")
+            return []
+    
+    def _save_cached_model_names(self, model_names: List[str]):
+        if not GEMINI_MODEL_CACHE_PATH:
+            return
+        try:
+            with open(GEMINI_MODEL_CACHE_PATH, "w", encoding="utf-8") as f:
+                json.dump({
+                    "model": model_names[0],
+                    "models": model_names,
+                    "api_key": self._api_key_fingerprint(),
+                    "selected_at": time.time(),
+                }, f)
+        except OSError as e:
+            logger.warning(f"Could not write Gemini model cache {GEMINI_MODEL_CACHE_PATH}: {e}")
+    
+    @property
+    def model(self):
+        """The model calls are routed to first: the fastest one whose circuit is closed."""
+        primary = self.pool.primary
+        return primary.model if primary else None
+    
+    @model.setter
+    def model(self, model):
+        self.pool = ModelPool([model] if model is not None else [])
+    
+    def _circuit_open(self) -> bool:
+        """True while every pooled model is failing; callers go straight to the fallback."""
+        if self.pool.all_open():
+            metrics.inc("gemini_circuit_open")
+            logger.warning("All Gemini model circuits are open, using fallback")
+            return True
+        return False
+    
+    def wait_for_rate_limit(self):
+        """Wait to avoid rate limiting."""
+        self.limiter.acquire_sync()
+    
+    async def wait_for_rate_limit_async(self):
+        """Wait for a rate limiter token without blocking the event loop."""
+        await self.limiter.acquire()
+    
+    def analyze_tone_and_enhance(
+        self,
+        text: str,
+        context: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> Optional[Dict[str, Any]]:
+        """Analyze text tone and provide enhanced versions."""
+        if not self.initialized or not self.model:
+            logger.error("Gemini not initialized")
+            return None
+
+        cache_key = self._cache_key(text, context)
+        if use_cache:
+            cached = self._get_cached(cache_key, text)
+            if cached is not None:
+                return cached
+        else:
+            self.cache.record_bypass()
+
+        if self._circuit_open():
+            return None
+        self.wait_for_rate_limit()
+
+        try:
+            # Enhanced prompt for tone analysis and text enhancement
+            prompt = self._build_analysis_prompt(text, context)
+            
+            # Generate content
+            member = self.pool.primary
+            self.pool.begin(member)
+            started = time.perf_counter()
+            try:
+                response = member.model.generate_content(prompt, **self._generation_kwargs(self.structured_output))
+            except Exception:
+                self.pool.record_failure(member)
+                raise
+            self.pool.record_success(member, time.perf_counter() - started)
+            self.limiter.on_success()
+            return self._handle_response(response, text, cache_key)
                 
-                # Parse suggestions
-                elif current_section == "suggestions" and line.startswith("-"):
-                    suggestion = line[1:].strip()
-                    if suggestion:
-                        suggestions.append(suggestion)
+        except Exception as e:
+            self._handle_generation_error(e)
+            return None
+    
+    async def analyze_tone_and_enhance_async(
+        self,
+        text: str,
+        context: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> Optional[Dict[str, Any]]:
+        """Async variant of analyze_tone_and_enhance that never blocks the event loop."""
+        if not self.initialized or not self.model:
+            logger.error("Gemini not initialized")
+            return None
+
+        cache_key = self._cache_key(text, context)
+        if use_cache:
+            cached = await self._get_cached_async(cache_key, text)
+            if cached is not None:
+                return cached
+        else:
+            self.cache.record_bypass()
+
+        # Identical requests already in flight share one Gemini call. The work runs
+        # in its own task so a disconnecting caller does not cancel it for the rest.
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(self._analyze_uncached_async(text, context, cache_key))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda done, key=cache_key: self._release_inflight(key, done))
+        else:
+            self.coalesced_requests += 1
+            logger.info("Joining in-flight tone analysis for identical request")
+
+        result = await asyncio.shield(task)
+        if result is None:
+            return None
+        result = copy.deepcopy(result)
+        result["original_text"] = text
+        return result
+    
+    async def _analyze_uncached_async(self, text: str, context: Optional[str], cache_key: str) -> Optional[Dict[str, Any]]:
+        if self.batch_enabled:
+            return await self.batcher.submit(text, context, cache_key)
+        return await self._analyze_single_async(text, context, cache_key)
+    
+    async def _analyze_single_async(self, text: str, context: Optional[str], cache_key: str) -> Optional[Dict[str, Any]]:
+        if self._circuit_open():
+            return None
+        await self.wait_for_rate_limit_async()
+
+        try:
+            prompt = self._build_analysis_prompt(text, context)
+            async with self._get_semaphore():
+                response = await self._generate_content_async(prompt, structured=self.structured_output)
+            return self._handle_response(response, text, cache_key)
+
+        except Exception as e:
+            self._handle_generation_error(e)
+            return None
+    
+    def _release_inflight(self, cache_key: str, task: asyncio.Future):
+        if self._inflight.get(cache_key) is task:
+            del self._inflight[cache_key]
+    
+    async def enhance_with_known_tone_async(
+        self,
+        text: str,
+        tone: str,
+        confidence: float,
+        context: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> Optional[Dict[str, Any]]:
+        """Ask Gemini for enhancements only, keeping a tone detected locally."""
+        if not self.initialized or not self.model:
+            return None
+
+        cache_key = self._cache_key(text, context, variant=f"enhance:{tone}")
+        result = await self._get_cached_async(cache_key, text) if use_cache else None
+        if result is None:
+            if self._circuit_open():
+                return None
+            await self.wait_for_rate_limit_async()
+            try:
+                prompt = self._build_enhancement_prompt(text, tone, context)
+                async with self._get_semaphore():
+                    response = await self._generate_content_async(prompt, structured=self.structured_output)
+                result = self._handle_response(response, text, cache_key, expect_tone=False)
+            except Exception as e:
+                self._handle_generation_error(e)
+                return None
+            if result is None:
+                return None
+
+        local = self._generate_local_analysis(text, tone, confidence)
+        result.update({field: local[field] for field in ("detected_tone", "confidence", "tone_category", "explanation")})
+        return result
+    
+    async def stream_tone_analysis(
+        self,
+        text: str,
+        context: Optional[str] = None,
+        use_cache: bool = True,
+    ):
+        """Yield incremental analysis events as Gemini streams its response.
+
+        The last event is always {"event": "result", "analysis": ...} carrying the
+        fully parsed analysis, or None when Gemini could not be used or its stream broke off.
+        """
+        if not self.initialized or not self.model:
+            yield {"event": "result", "analysis": None}
+            return
+
+        cache_key = self._cache_key(text, context)
+        if use_cache:
+            cached = await self._get_cached_async(cache_key, text)
+            if cached is not None:
+                for event in analysis_events(cached):
+                    yield event
+                yield {"event": "result", "analysis": cached}
+                return
+        else:
+            self.cache.record_bypass()
+
+        if self._circuit_open():
+            yield {"event": "result", "analysis": None}
+            return
+        await self.wait_for_rate_limit_async()
+
+        parser = StreamingToneParser()
+        completed = False
+        member = self.pool.primary
+        try:
+            # The streaming parser reads the line format as it arrives
+            prompt = self._build_analysis_prompt(text, context, structured=False)
+            async with self._get_semaphore():
+                self.pool.begin(member)
+                metrics.gauge_add("gemini_inflight_calls", 1)
+                stream_started = time.perf_counter()
+                try:
+                    async for chunk in self._stream_content_async(prompt, member.model):
+                        for event in parser.feed(chunk):
+                            yield event
+                except Exception:
+                    self.pool.record_failure(member)
+                    raise
+                except BaseException:
+                    # The client went away mid-stream
+                    self.pool.release(member)
+                    raise
+                finally:
+                    metrics.gauge_add("gemini_inflight_calls", -1)
+                    metrics.observe("gemini_stream", time.perf_counter() - stream_started)
+            # Whole-stream time depends on the output length, so it is not used for routing
+            self.pool.record_success(member)
+            for event in parser.finish():
+                yield event
+            completed = True
+            self.limiter.on_success()
+        except Exception as e:
+            self._handle_generation_error(e)
+
+        # A stream cut off part-way is a failed call: the caller falls back instead of
+        # receiving (and saving) the fragment padded with template enhancements
+        analysis = None
+        if completed and parser.text.strip():
+            logger.info("Gemini streamed tone analysis received")
+            analysis, complete = self._parse_cacheable(parser.text, text)
+            if complete:
+                self.cache.set(cache_key, analysis)
+        yield {"event": "result", "analysis": analysis}
+    
+    async def _stream_content_async(self, prompt: str, model):
+        """Yield response text chunks from Gemini as they are generated."""
+        if self.async_mode == "executor" or not hasattr(model, "generate_content_async"):
+            async for chunk_text in self._stream_content_in_executor(prompt, model):
+                yield chunk_text
+            return
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+    
+    async def _stream_content_in_executor(self, prompt: str, model):
+        # Iterates the blocking stream on the executor and hands chunks to the event loop
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+
+        def produce():
+            try:
+                for chunk in model.generate_content(prompt, stream=True):
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk.text)
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        producer = loop.run_in_executor(self._get_executor(), produce)
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if item:
+                yield item
+        await producer
+    
+    async def _generate_content_async(self, prompt: str, structured: bool = False):
+        """Call the fastest healthy model, hedging to the next one if it runs past its latency
+        percentile and failing over to it if the call errors."""
+        candidates = self.pool.route()
+        if not candidates:
+            raise ModelCircuitOpenError("every Gemini model's circuit is open")
+        primary, backups = candidates[0], candidates[1:]
+        calls: Dict[asyncio.Future, ModelHealth] = {}
+
+        def launch(member: ModelHealth) -> asyncio.Future:
+            task = asyncio.ensure_future(self._call_model(member, prompt, structured))
+            calls[task] = member
+            return task
+
+        pending = {launch(primary)}
+        try:
+            hedge_after = primary.percentile(GEMINI_HEDGE_PERCENTILE) if GEMINI_HEDGE_ENABLED and backups else None
+            if hedge_after is not None:
+                done, _ = await asyncio.wait(pending, timeout=hedge_after)
+                # Extra calls are optional: a hedge needs a concurrency slot of its own (the caller's
+                # slot covers the primary) and a quota token to spare, or it is skipped
+                if not done and await self._try_acquire_slot():
+                    if await self.limiter.try_reserve_async():
+                        metrics.inc("gemini_hedged")
+                        logger.info(f"Gemini call to {primary.name} passed {hedge_after:.2f}s, hedging to {backups[0].name}")
+                        hedge = launch(backups.pop(0))
+                        hedge.add_done_callback(lambda _: self._get_semaphore().release())
+                        pending.add(hedge)
+                    else:
+                        self._get_semaphore().release()
+            
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if calls[task] is not primary:
+                            metrics.inc("gemini_backup_wins")
+                        return task.result()
+                    error = task.exception()
+                if not pending and backups and await self.limiter.try_reserve_async():
+                    metrics.inc("gemini_failovers")
+                    logger.warning(f"Gemini call failed ({error}), failing over to {backups[0].name}")
+                    pending.add(launch(backups.pop(0)))
+            raise error
+        finally:
+            for task in calls:
+                if not task.done():
+                    task.cancel()
+    
+    async def _call_model(self, member: ModelHealth, prompt: str, structured: bool = False):
+        """Call one pooled model through the async client or the bounded executor, recording its health."""
+        model = member.model
+        generation_kwargs = self._generation_kwargs(structured)
+        self.pool.begin(member)
+        metrics.gauge_add("gemini_inflight_calls", 1)
+        started = time.perf_counter()
+        try:
+            with metrics.timer("gemini_call"):
+                if self.async_mode == "executor" or not hasattr(model, "generate_content_async"):
+                    loop = asyncio.get_running_loop()
+                    call = loop.run_in_executor(
+                        self._get_executor(), lambda: model.generate_content(prompt, **generation_kwargs)
+                    )
+                else:
+                    call = model.generate_content_async(prompt, **generation_kwargs)
+                response = await asyncio.wait_for(call, GEMINI_CALL_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            self.pool.release(member)
+            raise
+        except asyncio.TimeoutError:
+            self.pool.record_failure(member)
+            raise asyncio.TimeoutError(
+                f"{member.name} did not answer within {GEMINI_CALL_TIMEOUT_SECONDS:.0f}s"
+            ) from None
+        except Exception:
+            self.pool.record_failure(member)
+            raise
+        finally:
+            metrics.gauge_add("gemini_inflight_calls", -1)
+        self.pool.record_success(member, time.perf_counter() - started)
+        self.limiter.on_success()
+        return response
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+    
+    async def _try_acquire_slot(self) -> bool:
+        """Take a concurrency slot only if one is free right now (nobody waiting for it either)."""
+        semaphore = self._get_semaphore()
+        if semaphore.locked():
+            return False
+        await semaphore.acquire()
+        return True
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="gemini",
+            )
+        return self._executor
+    
+    def shutdown(self):
+        """Release the executor used for blocking Gemini calls."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+    
+    def _cache_key(self, text: str, context: Optional[str], variant: str = "") -> str:
+        model_name = self.pool.cache_name
+        if variant:
+            model_name = f"{model_name}|{variant}"
+        return AnalysisCache.make_key(text, context, model_name)
+    
+    def _get_cached(self, cache_key: str, text: str) -> Optional[Dict[str, Any]]:
+        return self._restore_cached(self.cache.get(cache_key), text)
+    
+    async def _get_cached_async(self, cache_key: str, text: str) -> Optional[Dict[str, Any]]:
+        return self._restore_cached(await self.cache.get_async(cache_key), text)
+    
+    @staticmethod
+    def _restore_cached(cached: Optional[Dict[str, Any]], text: str) -> Optional[Dict[str, Any]]:
+        if cached is not None:
+            logger.info("Tone analysis served from cache")
+            # Normalization may have matched a differently spaced original
+            cached["original_text"] = text
+        return cached
+    
+    def _handle_response(
+        self,
+        response,
+        text: str,
+        cache_key: Optional[str] = None,
+        expect_tone: bool = True,
+    ) -> Optional[Dict[str, Any]]:
+        if response and response.text:
+            logger.info("Gemini tone analysis response received")
+            result, complete = self._parse_cacheable(response.text, text, expect_tone=expect_tone)
+            # Answers padded with canned output are returned but not cached
+            if cache_key and complete:
+                self.cache.set(cache_key, result)
+            return result
+        logger.warning("Gemini returned empty response")
+        return None
+    
+    def _handle_generation_error(self, e: Exception):
+        logger.error(f"Gemini tone analysis error: {e}")
+        if "429" in str(e) or "quota" in str(e).lower():
+            metrics.inc("gemini_rate_limited")
+            self.limiter.on_rate_limited(parse_retry_after(e))
+    
+    def _build_analysis_prompt(self, text: str, context: Optional[str] = None, structured: Optional[bool] = None) -> str:
+        """Build the prompt for tone analysis."""
+        if self._use_structured(structured):
+            return self._build_structured_prompt(
+                "Detect the tone of the text and rewrite it in 3 other tones.",
+                text, context, self.STRUCTURED_ANALYSIS_SHAPE,
+            )
+
+        context_part = f"Context: {context}\n" if context else ""
+
+        prompt = f"""
+        Analyze the tone of the following text and provide enhanced versions in different tones.
+
+        {context_part}
+        Text to analyze: "{text}"
+
+        {self.ANALYSIS_FORMAT_INSTRUCTIONS}
+        """
+
+        return prompt
+    
+    def _build_enhancement_prompt(
+        self,
+        text: str,
+        tone: str,
+        context: Optional[str] = None,
+        structured: Optional[bool] = None,
+    ) -> str:
+        """Build a prompt that only asks for enhancements of text whose tone is already known."""
+        if self._use_structured(structured):
+            return self._build_structured_prompt(
+                f"The text's tone is {tone}. Rewrite it in 3 other tones.",
+                text, context, self.STRUCTURED_ENHANCEMENT_SHAPE,
+            )
+
+        context_part = f"Context: {context}\n" if context else ""
+
+        prompt = f"""
+        Rewrite the following text in different tones. Its current tone is {tone}.
+
+        {context_part}
+        Text to rewrite: "{text}"
+
+        Please provide your response in this exact format:
+
+        ENHANCED_VERSIONS:
+        1. [Tone Name]: [Enhanced version of the text]
+        2. [Tone Name]: [Enhanced version of the text]
+        3. [Tone Name]: [Enhanced version of the text]
+
+        SUGGESTIONS:
+        - [Suggestion 1]
+        - [Suggestion 2]
+        - [Suggestion 3]
+
+        Keep the core meaning intact. Available tones: Formal, Casual, Professional, Friendly, Persuasive, Inspirational, Empathetic, Authoritative, Enthusiastic.
+        """
+
+        return prompt
+    
+    @staticmethod
+    def _build_structured_prompt(task: str, text: str, context: Optional[str], shape: str) -> str:
+        # No indentation or worked example: every character is an input token
+        context_part = f"Context: {json.dumps(context, ensure_ascii=False)}\n" if context else ""
+        return (
+            f"{task} Keep the meaning; enhancement tones from: {ENHANCEMENT_TONES}.\n"
+            f"{context_part}Text: {json.dumps(text, ensure_ascii=False)}\n"
+            f"Reply with only this JSON: {shape}"
+        )
+    
+    def _use_structured(self, structured: Optional[bool]) -> bool:
+        return self.structured_output if structured is None else structured
+    
+    def _generation_kwargs(self, structured: bool) -> Dict[str, Any]:
+        """Ask for a JSON response where the installed client supports response_mime_type."""
+        if not structured or not HAS_GEMINI:
+            return {}
+        if self._json_mime_supported is None:
+            try:
+                load_genai().GenerationConfig(response_mime_type="application/json")
+                self._json_mime_supported = True
+            except TypeError:
+                # google-generativeai 0.3.x: the prompt alone asks for JSON
+                self._json_mime_supported = False
+        if not self._json_mime_supported:
+            return {}
+        return {"generation_config": {"response_mime_type": "application/json"}}
+    
+    def _build_batch_analysis_prompt(self, items: List[Tuple[str, Optional[str]]]) -> str:
+        """Build one prompt that analyzes several (text, context) items, delimited per item."""
+        item_blocks = []
+        for index, (text, context) in enumerate(items, start=1):
+            context_part = f"Context: {context}\n        " if context else ""
+            item_blocks.append(
+                f"{BATCH_ITEM_DELIMITER.format(index=index)}\n"
+                f"        {context_part}Text to analyze: \"{text}\""
+            )
+        items_part = "\n        \n        ".join(item_blocks)
+
+        prompt = f"""
+        Analyze the tone of each of the following {len(items)} texts independently and provide enhanced versions in different tones.
+        Each text starts with a delimiter line such as {BATCH_ITEM_DELIMITER.format(index=1)}.
+
+        {items_part}
+
+        Answer every item, in order. Begin each answer with the same delimiter line as its item, then follow it with the answer for that item only.
+
+        {self.ANALYSIS_FORMAT_INSTRUCTIONS}
+        """
+
+        return prompt
+    
+    def parse_tone_analysis_response(
+        self,
+        response_text: str,
+        original_text: str,
+        strict: bool = False,
+        expect_tone: bool = True,
+    ) -> Optional[Dict[str, Any]]:
+        """Parse Gemini response into structured tone analysis.
+
+        Accepts both the line format and a structured-output JSON object.
+        With strict=True, returns None instead of filling in fallbacks when the
+        detected tone or the enhanced versions are missing. expect_tone=False is
+        for enhancement-only prompts, whose answers carry no tone.
+        """
+        with metrics.timer("parse"):
+            return self._parse_tone_analysis_response(response_text, original_text, strict, expect_tone)[0]
+    
+    def _parse_cacheable(
+        self,
+        response_text: str,
+        original_text: str,
+        expect_tone: bool = True,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Parse leniently, also reporting whether the answer needed no fallbacks (only those are cached)."""
+        with metrics.timer("parse"):
+            return self._parse_tone_analysis_response(response_text, original_text, False, expect_tone)
+    
+    def _parse_tone_analysis_response(
+        self,
+        response_text: str,
+        original_text: str,
+        strict: bool,
+        expect_tone: bool = True,
+    ) -> Tuple[Optional[Dict[str, Any]], bool]:
+        try:
+            structured = STRUCTURED_RESPONSE_PATTERN.match(response_text)
+            if structured:
+                fields = self._read_structured_fields(structured.group(1))
+            else:
+                fields = self._read_line_fields(response_text)
+            found_tone = fields.pop("found_tone")
+            
+            complete = bool((found_tone or not expect_tone) and fields["enhanced_versions"])
+            if not complete:
+                metrics.inc("parse_failures")
+                if strict:
+                    return None, False
             
             # Ensure we have at least some enhanced versions
-            if not enhanced_versions:
-                enhanced_versions = self._generate_fallback_enhancements(original_text)
+            if not fields["enhanced_versions"]:
+                fields["enhanced_versions"] = self._generate_fallback_enhancements(original_text)
             
             # Ensure we have suggestions
-            if not suggestions:
-                suggestions = self._generate_fallback_suggestions(detected_tone)
+            if not fields["suggestions"]:
+                fields["suggestions"] = self._generate_fallback_suggestions(fields["detected_tone"])
             
-            return {
-                "original_text": original_text,
-                "detected_tone": detected_tone,
-                "confidence": confidence,
-                "tone_category": tone_category,
-                "enhanced_versions": enhanced_versions,
-                "suggestions": suggestions,
-                "explanation": explanation
-            }
+            return {"original_text": original_text, **fields}, complete
             
         except Exception as e:
             logger.error(f"Error parsing tone analysis response: {e}")
-            return self._generate_fallback_analysis(original_text)
+            metrics.inc("parse_failures")
+            if strict:
+                return None, False
+            return self._generate_fallback_analysis(original_text), False
+    
+    @staticmethod
+    def _default_fields() -> Dict[str, Any]:
+        return {
+            "found_tone": False,
+            "detected_tone": "neutral",
+            "confidence": 0.8,
+            "tone_category": "neutral",
+            "enhanced_versions": [],
+            "suggestions": [],
+            "explanation": "The tone appears balanced and neutral.",
+        }
+    
+    def _read_line_fields(self, response_text: str) -> Dict[str, Any]:
+        """Read the DETECTED_TONE / ENHANCED_VERSIONS / SUGGESTIONS line format."""
+        fields = self._default_fields()
+        enhanced_versions = fields["enhanced_versions"]
+        suggestions = fields["suggestions"]
+        lines = [line.strip() for line in response_text.split('\n') if line.strip()]
+
+        current_section = None
+
+        for line in lines:
+            line_lower = line.lower()
+            
+            # Parse detected tone
+            if line_lower.startswith("detected_tone:"):
+                fields["detected_tone"] = line.split(":", 1)[1].strip()
+                fields["found_tone"] = True
+            elif line_lower.startswith("confidence:"):
+                try:
+                    conf_str = line.split(":", 1)[1].strip()
+                    fields["confidence"] = float(conf_str)
+                except ValueError:
+                    fields["confidence"] = 0.8
+            elif line_lower.startswith("tone_category:"):
+                fields["tone_category"] = line.split(":", 1)[1].strip()
+            elif line_lower.startswith("explanation:"):
+                fields["explanation"] = line.split(":", 1)[1].strip()
+            elif line_lower.startswith("enhanced_versions:"):
+                current_section = "enhanced"
+                continue
+            elif line_lower.startswith("suggestions:"):
+                current_section = "suggestions"
+                continue
+            
+            # Parse enhanced versions
+            if current_section == "enhanced" and re.match(r'^\d+\.', line):
+                parts = line.split(":", 1)
+                if len(parts) == 2:
+                    tone_name = parts[0].split(".", 1)[1].strip()
+                    enhanced_text = parts[1].strip()
+                    enhanced_versions.append({
+                        "tone": tone_name,
+                        "text": enhanced_text
+                    })
+            
+            # Parse suggestions
+            elif current_section == "suggestions" and line.startswith("-"):
+                suggestion = line[1:].strip()
+                if suggestion:
+                    suggestions.append(suggestion)
+
+        return fields
+    
+    def _read_structured_fields(self, payload: str) -> Dict[str, Any]:
+        """Decode and validate a structured-output JSON object in one pass.
+
+        Malformed JSON raises; fields of the wrong type are treated as missing.
+        """
+        data = json.loads(payload)
+        if not isinstance(data, dict):
+            raise ValueError("structured response is not a JSON object")
+        fields = self._default_fields()
+
+        tone = data.get("tone")
+        if isinstance(tone, str) and tone.strip():
+            fields["detected_tone"] = tone.strip()
+            fields["found_tone"] = True
+
+        confidence = data.get("confidence")
+        if isinstance(confidence, (int, float)) and not isinstance(confidence, bool):
+            fields["confidence"] = min(1.0, max(0.0, float(confidence)))
+
+        category = data.get("category")
+        if isinstance(category, str) and category.strip().lower() in TONE_CATEGORY_VALUES:
+            fields["tone_category"] = category.strip().lower()
+        elif fields["detected_tone"].lower() in TONE_CATEGORY_VALUES:
+            fields["tone_category"] = fields["detected_tone"].lower()
+
+        explanation = data.get("explanation")
+        if isinstance(explanation, str) and explanation.strip():
+            fields["explanation"] = explanation.strip()
+
+        for item in data.get("enhanced") or []:
+            if isinstance(item, dict) and isinstance(item.get("tone"), str) and isinstance(item.get("text"), str):
+                if item["tone"].strip() and item["text"].strip():
+                    fields["enhanced_versions"].append({"tone": item["tone"].strip(), "text": item["text"].strip()})
+
+        for suggestion in data.get("suggestions") or []:
+            if isinstance(suggestion, str) and suggestion.strip():
+                fields["suggestions"].append(suggestion.strip())
+
+        return fields
+    
+    def parse_batch_analysis_response(self, response_text: str, original_texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Split a batched Gemini response on its item delimiters and parse each item strictly."""
+        sections: Dict[int, str] = {}
+        matches = list(BATCH_ITEM_PATTERN.finditer(response_text))
+        for position, match in enumerate(matches):
+            end = matches[position + 1].start() if position + 1 < len(matches) else len(response_text)
+            index = int(match.group(1))
+            # Keep the first answer if the model repeats a delimiter
+            sections.setdefault(index, response_text[match.end():end])
+
+        results: List[Optional[Dict[str, Any]]] = []
+        for index, original_text in enumerate(original_texts, start=1):
+            section = sections.get(index)
+            if section is None:
+                results.append(None)
+            else:
+                results.append(self.parse_tone_analysis_response(section, original_text, strict=True))
+        return results
+    
+    def _generate_fallback_enhancements(self, text: str) -> List[Dict[str, str]]:
+        """Generate fallback enhanced versions."""
+        return [
+            {"tone": "Professional", "text": f"We would like to discuss the following matter: {text}"},
+            {"tone": "Friendly", "text": f"Hey! Just wanted to share: {text}"},
+            {"tone": "Formal", "text": f"It is important to note that: {text}"}
+        ]
+    
+    def _generate_fallback_suggestions(self, detected_tone: str) -> List[str]:
+        """Generate fallback suggestions based on detected tone."""
+        base_suggestions = [
+            "Consider your audience when choosing tone",
+            "Ensure your message aligns with your intent",
+            "Review for clarity and impact"
+        ]
+
+        tone_specific_suggestions = {
+            "formal": ["Use complete sentences", "Avoid contractions", "Maintain professional vocabulary"],
+            "casual": ["Use conversational language", "Feel free to use contractions", "Keep it relaxed and friendly"],
+            "professional": ["Be clear and concise", "Focus on key points", "Maintain respectful language"]
+        }
+
+        return tone_specific_suggestions.get(detected_tone.lower(), base_suggestions)
+    
+    def _generate_fallback_analysis(self, text: str) -> Dict[str, Any]:
+        """Generate complete fallback analysis."""
+        if self.local_classifier is not None:
+            tone, confidence = self.local_classifier.predict(text)
+            return self._generate_local_analysis(text, tone, confidence)
+        return {
+            "original_text": text,
+            "detected_tone": "neutral",
+            "confidence": 0.7,
+            "tone_category": "neutral",
+            "enhanced_versions": self._generate_fallback_enhancements(text),
+            "suggestions": self._generate_fallback_suggestions("neutral"),
+            "explanation": "The text appears to have a neutral tone, suitable for general communication."
+        }
+
+    def _generate_local_analysis(self, text: str, tone: str, confidence: float) -> Dict[str, Any]:
+        """Analysis built from a local classifier prediction and template enhancements."""
+        return {
+            "original_text": text,
+            "detected_tone": tone,
+            "confidence": round(confidence, 4),
+            "tone_category": tone,
+            "enhanced_versions": self._generate_fallback_enhancements(text),
+            "suggestions": self._generate_fallback_suggestions(tone),
+            "explanation": f"Detected by the local tone classifier with {confidence:.0%} confidence."
+        }
+
+DEFAULT_TONE_LEXICON: Dict[str, List[str]] = {
+    "formal": ["respectfully", "sincerely", "please be advised", "hereinafter"],
+    "casual": ["hey", "hi", "what's up", "lol", "haha", "thanks"],
+    "professional": ["team", "meeting", "agenda", "follow up", "action items"],
+    "friendly": ["great", "awesome", "wonderful", "happy", "excited"],
+    "persuasive": ["should", "must", "highly recommend", "benefit", "advantage"],
+    "enthusiastic": ["amazing", "incredible", "fantastic", "wow", "!"]
+}
+
+
+class ToneKeywordMatcher:
+    """Weighted tone lexicon compiled into a single trie-shaped regex.
+    
+    The whole lexicon is matched in one pass over the text, with word
+    boundaries enforced on phrase edges that are word characters, so "hi"
+    no longer matches inside "this".
+    """
+
+    def __init__(self, lexicon: Dict[str, Any]):
+        # phrase -> [(tone, weight)], tones keep lexicon order for tie-breaking
+        self.tones: List[str] = []
+        self.phrases: Dict[str, List[Tuple[str, float]]] = {}
+        for tone, entries in lexicon.items():
+            self.tones.append(tone)
+            weighted = entries.items() if isinstance(entries, dict) else ((phrase, 1.0) for phrase in entries)
+            for phrase, weight in weighted:
+                key = self._normalize(phrase)
+                if key:
+                    self.phrases.setdefault(key, []).append((tone, float(weight)))
+        self.pattern = re.compile(self._build_trie_pattern(self.phrases)) if self.phrases else None
+
+    @classmethod
+    def from_file(cls, path: str) -> "ToneKeywordMatcher":
+        with open(path, "r", encoding="utf-8") as lexicon_file:
+            return cls(json.load(lexicon_file))
+
+    @staticmethod
+    def _normalize(phrase: str) -> str:
+        return " ".join(phrase.lower().split())
+
+    @classmethod
+    def _build_trie_pattern(cls, phrases) -> str:
+        trie: Dict[str, Any] = {}
+        for phrase in phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[""] = True
+        # One shared lookbehind for every phrase that starts with a word character
+        word_start = {char: child for char, child in trie.items() if cls._is_word_char(char)}
+        other_start = {char: child for char, child in trie.items() if not cls._is_word_char(char)}
+        alternatives = []
+        if word_start:
+            alternatives.append(r"(?<!\w)" + cls._node_pattern(word_start, previous_char=None))
+        if other_start:
+            alternatives.append(cls._node_pattern(other_start, previous_char=None))
+        return "|".join(alternatives)
+
+    @staticmethod
+    def _is_word_char(char: Optional[str]) -> bool:
+        return bool(char) and (char.isalnum() or char == "_")
+
+    @classmethod
+    def _node_pattern(cls, node: Dict[str, Any], previous_char: Optional[str]) -> str:
+        alternatives = []
+        for char in sorted(key for key in node if key):
+            char_pattern = r"\s+" if char == " " else re.escape(char)
+            alternatives.append(char_pattern + cls._node_pattern(node[char], char))
+        # Longer phrases are tried first; ending here is the last resort
+        if "" in node:
+            alternatives.append(r"(?!\w)" if cls._is_word_char(previous_char) else "")
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    def score(self, text: str) -> Dict[str, float]:
+        """Sum the weights of the distinct lexicon phrases found in text, per tone."""
+        scores: Dict[str, float] = {}
+        if self.pattern is None:
+            return scores
+        seen = set()
+        for match in self.pattern.finditer(text.lower()):
+            phrase = self._normalize(match.group(0))
+            if phrase in seen:
+                continue
+            seen.add(phrase)
+            for tone, weight in self.phrases.get(phrase, ()):
+                scores[tone] = scores.get(tone, 0.0) + weight
+        return scores
+
+    def detect(self, text: str) -> Tuple[str, float]:
+        """Return the highest-scoring tone (ties go to the earlier tone) and its score."""
+        scores = self.score(text)
+        detected_tone = "neutral"
+        max_score = 0.0
+        for tone in self.tones:
+            if scores.get(tone, 0.0) > max_score:
+                max_score = scores[tone]
+                detected_tone = tone
+        return detected_tone, max_score
+
+
+def load_tone_matcher() -> ToneKeywordMatcher:
+    if TONE_LEXICON_PATH:
+        try:
+            matcher = ToneKeywordMatcher.from_file(TONE_LEXICON_PATH)
+            logger.info(f"Loaded tone lexicon with {len(matcher.phrases)} phrases from {TONE_LEXICON_PATH}")
+            return matcher
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load tone lexicon {TONE_LEXICON_PATH}: {e}")
+    return ToneKeywordMatcher(DEFAULT_TONE_LEXICON)
+
+
+def quick_analysis_result(detected_tone: str, max_matches: float) -> Dict[str, Any]:
+    return {
+        "detected_tone": detected_tone,
+        "confidence": min(0.3 + (max_matches * 0.1), 0.9),
+        "method": "keyword-analysis"
+    }
+
+
+# Set in process-pool workers by _init_quick_batch_worker
+_worker_tone_matcher: Optional[ToneKeywordMatcher] = None
+
+
+def _init_quick_batch_worker(lexicon: Dict[str, Any]):
+    global _worker_tone_matcher
+    _worker_tone_matcher = ToneKeywordMatcher(lexicon)
+
+
+def score_quick_batch_shard(texts: List[str]) -> List[Tuple[str, float]]:
+    """Detect tones for a shard of texts; runs in a pool worker or inline."""
+    matcher = _worker_tone_matcher or tone_matcher
+    return [matcher.detect(text) for text in texts]
+
+
+class QuickBatchPool:
+    """Process pool for CPU-bound keyword scoring of large /quick-analyze batches."""
+
+    def __init__(self, workers: int = QUICK_BATCH_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def score(self, texts: List[str]) -> List[Tuple[str, float]]:
+        if self.workers <= 0:
+            return score_quick_batch_shard(texts)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), score_quick_batch_shard, texts)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned (not forked) so workers never inherit locks held by server threads;
+            # they rebuild the matcher from its lexicon instead of inheriting module state
+            lexicon = {tone: {} for tone in tone_matcher.tones}
+            for phrase, weights in tone_matcher.phrases.items():
+                for tone, weight in weights:
+                    lexicon[tone][phrase] = weight
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_quick_batch_worker,
+                initargs=(lexicon,),
+            )
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class LocalToneClassifier:
+    """Multinomial logistic regression over hashed word n-grams, trained with NumPy.
     
-    def _generate_fallback_enhancements(self, text: str) -> List[Dict[str, str]]:
-        """Generate fallback enhanced versions."""
-        return [
-            {"tone": "Professional", "text": f"We would like to discuss the following matter: {text}"},
-            {"tone": "Friendly", "text": f"Hey! Just wanted to share: {text}"},
-            {"tone": "Formal", "text": f"It is important to note that: {text}"}
-        ]
+    Trained from stored conversations (original_text -> tone_category) and
+    small enough to predict in well under a millisecond.
+    """
+
+    TOKEN_PATTERN = re.compile(r"[a-z0-9']+|[!?]")
+
+    def __init__(self, n_features: int = 2 ** 18, classes: Optional[List[str]] = None):
+        self.n_features = n_features
+        self.classes = classes or [tone.value for tone in ToneCategory]
+        self.weights = np.zeros((n_features, len(self.classes)), dtype=np.float32)
+        self.bias = np.zeros(len(self.classes), dtype=np.float32)
+        self.trained_on = 0
+
+    def _features(self, text: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        tokens = self.TOKEN_PATTERN.findall(text.lower())
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        if not grams:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        # crc32 rather than hash() so feature indices are stable across processes
+        indices = np.fromiter((zlib.crc32(gram.encode("utf-8")) % self.n_features for gram in grams), dtype=np.int64)
+        values = np.full(len(indices), 1.0 / np.sqrt(len(indices)), dtype=np.float32)
+        return indices, values
+
+    def predict_proba(self, text: str) -> "np.ndarray":
+        indices, values = self._features(text)
+        logits = values @ self.weights[indices] + self.bias
+        logits = np.exp(logits - logits.max())
+        return logits / logits.sum()
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        probabilities = self.predict_proba(text)
+        best = int(probabilities.argmax())
+        return self.classes[best], float(probabilities[best])
+
+    def fit(
+        self,
+        texts: List[str],
+        labels: List[str],
+        epochs: int = 60,
+        learning_rate: float = 2.0,
+        l2: float = 1e-4,
+    ) -> "LocalToneClassifier":
+        """Full-batch gradient descent on the softmax cross-entropy loss."""
+        class_index = {name: position for position, name in enumerate(self.classes)}
+        rows, cols, vals = [], [], []
+        targets = []
+        for text, label in zip(texts, labels):
+            if label not in class_index:
+                continue
+            indices, values = self._features(text)
+            rows.append(np.full(len(indices), len(targets), dtype=np.int64))
+            cols.append(indices)
+            vals.append(values)
+            targets.append(class_index[label])
+        if len(targets) < 2 or len(set(targets)) < 2:
+            raise ValueError("Need labelled examples from at least two tone categories")
+
+        rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        targets = np.asarray(targets)
+        n_samples = len(targets)
+        one_hot = np.zeros((n_samples, len(self.classes)), dtype=np.float32)
+        one_hot[np.arange(n_samples), targets] = 1.0
+
+        # Train on the touched feature columns only, then scatter back
+        used, local_cols = np.unique(cols, return_inverse=True)
+        weights = np.zeros((len(used), len(self.classes)), dtype=np.float32)
+        bias = np.zeros(len(self.classes), dtype=np.float32)
+        for _ in range(epochs):
+            logits = np.zeros((n_samples, len(self.classes)), dtype=np.float32)
+            np.add.at(logits, rows, vals[:, None] * weights[local_cols])
+            logits += bias
+            logits = np.exp(logits - logits.max(axis=1, keepdims=True))
+            error = logits / logits.sum(axis=1, keepdims=True) - one_hot
+            gradient = np.zeros_like(weights)
+            np.add.at(gradient, local_cols, vals[:, None] * error[rows])
+            weights -= learning_rate * (gradient / n_samples + l2 * weights)
+            bias -= learning_rate * error.mean(axis=0)
+
+        self.weights[:] = 0
+        self.weights[used] = weights
+        self.bias = bias
+        self.trained_on = n_samples
+        return self
+
+    def save(self, path: str):
+        used = np.flatnonzero(np.any(self.weights != 0, axis=1))
+        np.savez_compressed(
+            path,
+            n_features=self.n_features,
+            classes=np.array(self.classes),
+            used=used,
+            weights=self.weights[used],
+            bias=self.bias,
+            trained_on=self.trained_on,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "LocalToneClassifier":
+        with np.load(path) as data:
+            classifier = cls(int(data["n_features"]), [str(name) for name in data["classes"]])
+            classifier.weights[data["used"]] = data["weights"]
+            classifier.bias = data["bias"]
+            classifier.trained_on = int(data["trained_on"])
+        return classifier
+
+
+def load_local_classifier() -> Optional[LocalToneClassifier]:
+    if not HAS_NUMPY or not os.path.exists(LOCAL_CLASSIFIER_PATH):
+        return None
+    try:
+        classifier = LocalToneClassifier.load(LOCAL_CLASSIFIER_PATH)
+        logger.info(f"Loaded local tone classifier trained on {classifier.trained_on} conversations")
+        return classifier
+    except Exception as e:
+        logger.error(f"Could not load local tone classifier {LOCAL_CLASSIFIER_PATH}: {e}")
+        return None
+
+
+def train_local_classifier(db: Session) -> LocalToneClassifier:
+    """Train a classifier from stored Gemini analyses (fallback and locally routed rows excluded)."""
+    rows = (
+        db.query(Conversation.original_text, Conversation.tone_category, Conversation.analysis_json)
+        .filter(Conversation.tone_category.isnot(None))
+        .yield_per(1000)
+    )
+    texts, labels = [], []
+    for original_text, tone_category, analysis_json in rows:
+        # "service" is never a column field, so decoding without the row's columns is enough
+        service = decode_analysis(analysis_json, {}).get("service") or ""
+        if service == "smart-fallback" or service.startswith("local-classifier"):
+            continue
+        texts.append(original_text)
+        labels.append(tone_category.strip().lower())
+    return LocalToneClassifier().fit(texts, labels)
+
+
+# Turn an analysis_json column created as TEXT into a binary one, keeping its contents
+ANALYSIS_BLOB_ALTERS = {
+    "postgresql": "ALTER TABLE conversations ALTER COLUMN analysis_json TYPE BYTEA USING convert_to(analysis_json, 'UTF8')",
+    "mysql": "ALTER TABLE conversations MODIFY analysis_json LONGBLOB NOT NULL",
+}
+
+
+def analysis_column_is_text(connection) -> bool:
+    """True when analysis_json predates the binary format. SQLite ignores declared types, so it never needs converting."""
+    if connection.dialect.name == "sqlite":
+        return False
+    for column in inspect(connection).get_columns("conversations"):
+        if column["name"] == "analysis_json":
+            return isinstance(column["type"], String)
+    return False
+
+
+def upgrade_analysis_column(connection) -> bool:
+    if not analysis_column_is_text(connection):
+        return False
+    statement = ANALYSIS_BLOB_ALTERS.get(connection.dialect.name)
+    if statement is None:
+        raise RuntimeError(
+            f"Change conversations.analysis_json to a binary column by hand on {connection.dialect.name}, then rerun"
+        )
+    connection.exec_driver_sql(statement)
+    return True
+
+
+def migrate_analysis_storage(db: Session, batch_size: int = 500) -> int:
+    """Rewrite legacy JSON-text analyses into the compact format, one committed batch at a time.
     
-    def _generate_fallback_suggestions(self, detected_tone: str) -> List[str]:
-        """Generate fallback suggestions based on detected tone."""
-        base_suggestions = [
-            "Consider your audience when choosing tone",
-            "Ensure your message aligns with your intent",
-            "Review for clarity and impact"
+    On databases that enforce column types, a TEXT analysis_json column is first
+    converted to a binary one (its JSON text is kept and rewritten below).
+    """
+    if upgrade_analysis_column(db.connection()):
+        db.commit()
+        logger.info("Converted conversations.analysis_json to a binary column")
+    columns = [getattr(Conversation, field) for field in ANALYSIS_COLUMN_FIELDS]
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(Conversation.id, Conversation.analysis_json, *columns)
+            .where(Conversation.id > last_id)
+            .order_by(Conversation.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return migrated
+        last_id = rows[-1].id
+        updates = [
+            {"id": row.id, "analysis_json": encode_analysis(decode_analysis(row.analysis_json, {}), row._asdict())}
+            for row in rows
+            if is_legacy_analysis(row.analysis_json)
         ]
-        
-        tone_specific_suggestions = {
-            "formal": ["Use complete sentences", "Avoid contractions", "Maintain professional vocabulary"],
-            "casual": ["Use conversational language", "Feel free to use contractions", "Keep it relaxed and friendly"],
-            "professional": ["Be clear and concise", "Focus on key points", "Maintain respectful language"]
-        }
-        
-        return tone_specific_suggestions.get(detected_tone.lower(), base_suggestions)
+        if updates:
+            # ORM bulk UPDATE by primary key: one executemany per batch
+            db.execute(update(Conversation), updates)
+            db.commit()
+            migrated += len(updates)
+
+
+class ConversationSearchIndex:
+    """FTS5 table over each conversation's original text and enhanced versions.
     
-    def _generate_fallback_analysis(self, text: str) -> Dict[str, Any]:
-        """Generate complete fallback analysis."""
+    Its rowid is the conversation id. Rows are indexed when the session flushes new
+    conversations (the analysis is only readable after decoding, so SQL triggers
+    can't do it); triggers handle text updates and deletes. The owner column holds
+    a per-user token that every query matches, so FTS5 only ranks the caller's rows.
+    """
+
+    DDL = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5("
+        "original_text, enhanced_text, owner, tokenize = 'porter unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN "
+        "DELETE FROM conversations_fts WHERE rowid = old.id; END",
+        "CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE OF original_text ON conversations BEGIN "
+        "UPDATE conversations_fts SET original_text = new.original_text WHERE rowid = new.id; END",
+    )
+    INSERT = sql_text(
+        "INSERT INTO conversations_fts (rowid, original_text, enhanced_text, owner) "
+        "VALUES (:id, :original_text, :enhanced_text, :owner)"
+    )
+    # Original text counts double in the ranking; the owner token doesn't count
+    SEARCH = (
+        "SELECT c.id, c.original_text, c.detected_tone, c.tone_category, c.confidence, c.context, c.created_at, "
+        "snippet(conversations_fts, -1, '[', ']', '…', 12) AS snippet, "
+        "bm25(conversations_fts, 2.0, 1.0, 0.0) AS rank "
+        "FROM conversations_fts JOIN conversations c ON c.id = conversations_fts.rowid "
+        "WHERE conversations_fts MATCH :query AND c.user_id = :user_id{filters} "
+        "ORDER BY rank LIMIT :limit OFFSET :offset"
+    )
+    MISSING = sql_text(
+        "SELECT c.id, c.user_id, c.original_text, c.analysis_json FROM conversations c "
+        "LEFT JOIN conversations_fts f ON f.rowid = c.id "
+        "WHERE f.rowid IS NULL AND c.id > :last_id ORDER BY c.id LIMIT :limit"
+    ).columns(id=Integer, user_id=Integer, original_text=Text, analysis_json=AnalysisBlob)
+
+    def __init__(self, enabled: bool = SEARCH_INDEX_ENABLED and IS_SQLITE):
+        self.enabled = enabled
+        self.available = False
+
+    def create(self, connection):
+        if not self.enabled:
+            return
+        try:
+            existing = connection.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'conversations_fts'"
+            ).scalar()
+            if existing is not None and "owner" not in existing:
+                # Indexes built before the owner column can't be scoped per user
+                connection.exec_driver_sql("DROP TABLE conversations_fts")
+                logger.warning("Rebuilt conversations_fts with an owner column; run index_conversations.py to re-index")
+            for statement in self.DDL:
+                connection.exec_driver_sql(statement)
+            self.available = True
+        except OperationalError as e:
+            if "fts5" not in str(e):
+                raise
+            logger.warning(f"SQLite was built without FTS5, conversation search will scan instead: {e}")
+
+    # These analyses carry canned template enhancements that would match every search
+    TEMPLATE_SERVICES = frozenset({"smart-fallback", "local-classifier"})
+
+    @staticmethod
+    def owner_token(user_id: int) -> str:
+        return f"u{user_id}"
+
+    @classmethod
+    def document(cls, conversation_id: int, user_id: int, original_text: str, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        enhanced = [] if analysis.get("service") in cls.TEMPLATE_SERVICES else analysis.get("enhanced_versions") or []
         return {
-            "original_text": text,
-            "detected_tone": "neutral",
-            "confidence": 0.7,
-            "tone_category": "neutral",
-            "enhanced_versions": self._generate_fallback_enhancements(text),
-            "suggestions": self._generate_fallback_suggestions("neutral"),
-            "explanation": "The text appears to have a neutral tone, suitable for general communication."
+            "id": conversation_id,
+            "original_text": original_text,
+            "enhanced_text": "\n".join(version.get("text", "") for version in enhanced if isinstance(version, dict)),
+            "owner": cls.owner_token(user_id),
+        }
+
+    def add(self, connection, conversations: List[Conversation], analyses: List[Dict[str, Any]]):
+        if not self.available:
+            return
+        connection.execute(
+            self.INSERT,
+            [
+                self.document(conversation.id, conversation.user_id, conversation.original_text, analysis)
+                for conversation, analysis in zip(conversations, analyses)
+            ],
+        )
+
+    @classmethod
+    def match_query(cls, query: str, user_id: int) -> Optional[str]:
+        """Turn free text into an FTS5 query over the user's rows: every word must match
+        the original or enhanced text, the last one as a prefix."""
+        terms = re.findall(r"\w+", query)[:SEARCH_MAX_TERMS]
+        if not terms:
+            return None
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += "*"
+        return f'{{owner}} : "{cls.owner_token(user_id)}" AND {{original_text enhanced_text}} : ({" ".join(quoted)})'
+
+    def search_statement(self, filters: Dict[str, Any]):
+        conditions = {
+            "tone_category": " AND lower(c.tone_category) = :tone_category",
+            "date_from": " AND c.created_at >= :date_from",
+            "date_to": " AND c.created_at < :date_to",
         }
+        used = [name for name in conditions if filters.get(name) is not None]
+        statement = sql_text(self.SEARCH.format(filters="".join(conditions[name] for name in used)))
+        # Typed so datetimes are stored-format strings rather than the driver's ISO default
+        dates = [bindparam(name, type_=DateTime) for name in ("date_from", "date_to") if name in used]
+        if dates:
+            statement = statement.bindparams(*dates)
+        return statement.columns(
+            id=Integer,
+            original_text=Text,
+            detected_tone=String,
+            tone_category=String,
+            confidence=Float,
+            context=String,
+            created_at=DateTime,
+            snippet=Text,
+            rank=Float,
+        )
+
+    def backfill(self, db: Session, batch_size: int = 500) -> int:
+        """Index conversations missing from the FTS table (rows written before it existed)."""
+        if not self.available:
+            return 0
+        indexed = 0
+        last_id = 0
+        while True:
+            rows = db.execute(self.MISSING, {"last_id": last_id, "limit": batch_size}).all()
+            if not rows:
+                return indexed
+            last_id = rows[-1].id
+            db.execute(
+                self.INSERT,
+                [
+                    self.document(row.id, row.user_id, row.original_text, decode_analysis(row.analysis_json, {}))
+                    for row in rows
+                ],
+            )
+            db.commit()
+            indexed += len(rows)
+
+
+conversation_search = ConversationSearchIndex()
+
+
+class ConversationStatsRollup:
+    """Keeps conversation_stats in step with inserts, so dashboards read O(buckets) rows."""
+
+    COUNTERS = ("conversations", "confidence_sum", "confidence_count", "enhancements")
+
+    @staticmethod
+    def bucket_key(user_id: int, created_at: Optional[datetime], tone_category: Optional[str]) -> Tuple[int, date, str]:
+        category = (tone_category or "").strip().lower() or "unknown"
+        return user_id, (created_at or datetime.utcnow()).date(), category
+
+    def accumulate(
+        self,
+        buckets: Dict[Tuple[int, date, str], Dict[str, float]],
+        key: Tuple[int, date, str],
+        confidence: Optional[float],
+        analysis: Dict[str, Any],
+    ):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = dict.fromkeys(self.COUNTERS, 0)
+        bucket["conversations"] += 1
+        if confidence is not None:
+            bucket["confidence_sum"] += confidence
+            bucket["confidence_count"] += 1
+        bucket["enhancements"] += len(analysis.get("enhanced_versions") or [])
+
+    def add(self, connection, conversations: List[Conversation], analyses: List[Dict[str, Any]]):
+        buckets: Dict[Tuple[int, date, str], Dict[str, float]] = {}
+        for conversation, analysis in zip(conversations, analyses):
+            key = self.bucket_key(conversation.user_id, conversation.created_at, conversation.tone_category)
+            self.accumulate(buckets, key, conversation.confidence, analysis)
+        self.apply(connection, buckets)
+
+    def apply(self, connection, buckets: Dict[Tuple[int, date, str], Dict[str, float]]):
+        """Add each bucket's counters to its row, creating the row if needed."""
+        if not buckets:
+            return
+        table = ConversationStat.__table__
+        rows = [
+            {"user_id": user_id, "day": day, "tone_category": category, **counters}
+            for (user_id, day, category), counters in buckets.items()
+        ]
+        upsert = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}.get(connection.dialect.name)
+        if upsert is not None:
+            statement = upsert(table)
+            connection.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[table.c.user_id, table.c.day, table.c.tone_category],
+                    set_={name: table.c[name] + statement.excluded[name] for name in self.COUNTERS},
+                ),
+                rows,
+            )
+            return
+        for row in rows:
+            updated = connection.execute(
+                update(table)
+                .where(
+                    table.c.user_id == row["user_id"],
+                    table.c.day == row["day"],
+                    table.c.tone_category == row["tone_category"],
+                )
+                .values({name: table.c[name] + row[name] for name in self.COUNTERS})
+            )
+            if updated.rowcount == 0:
+                connection.execute(table.insert(), row)
+
+    def rebuild_user(self, db: Session, user_id: int, batch_size: int = 1000) -> int:
+        """Recompute one user's buckets from their conversations, in one transaction."""
+        # Clearing first takes the write lock, so inserts for this user wait rather than double count
+        db.execute(ConversationStat.__table__.delete().where(ConversationStat.user_id == user_id))
+        buckets: Dict[Tuple[int, date, str], Dict[str, float]] = {}
+        rows = db.execute(
+            select(
+                Conversation.created_at,
+                Conversation.tone_category,
+                Conversation.confidence,
+                Conversation.analysis_json,
+            )
+            .where(Conversation.user_id == user_id)
+            .execution_options(yield_per=batch_size)
+        )
+        for row in rows:
+            key = self.bucket_key(user_id, row.created_at, row.tone_category)
+            self.accumulate(buckets, key, row.confidence, decode_analysis(row.analysis_json, {}))
+        self.apply(db.connection(), buckets)
+        db.commit()
+        return len(buckets)
+
+    def backfill(self, db: Session, batch_size: int = 1000) -> Tuple[int, int]:
+        """Rebuild every user's buckets; returns (users, buckets)."""
+        user_ids = db.execute(select(Conversation.user_id).distinct()).scalars().all()
+        db.rollback()
+        buckets = 0
+        for user_id in user_ids:
+            buckets += self.rebuild_user(db, user_id, batch_size)
+        return len(user_ids), buckets
+
+
+stats_rollup = ConversationStatsRollup()
+
+
+@event.listens_for(Session, "after_flush")
+def record_new_conversations(session: Session, flush_context):
+    # Same transaction as the INSERT, for the request path and write-behind batches alike
+    conversations = [instance for instance in session.new if isinstance(instance, Conversation)]
+    if not conversations:
+        return
+    analyses = [conversation.analysis for conversation in conversations]
+    connection = session.connection()
+    conversation_search.add(connection, conversations, analyses)
+    stats_rollup.add(connection, conversations, analyses)
+
+
+def init_db_schema(connection):
+    """Create missing tables, and indexes added to tables that already exist."""
+    Base.metadata.create_all(bind=connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+    if analysis_column_is_text(connection):
+        logger.error("conversations.analysis_json is still a TEXT column and new conversations can't be saved; run migrate_analysis.py")
+    conversation_search.create(connection)
+
+
+SCHEMA_ATTEMPTS = 3
+
+
+def create_schema():
+    # Workers starting together race between create_all's existence check and its
+    # CREATE; the loser fails with "already exists" and succeeds on a retry
+    for attempt in range(SCHEMA_ATTEMPTS):
+        try:
+            with engine.begin() as connection:
+                init_db_schema(connection)
+            return
+        except OperationalError:
+            if attempt == SCHEMA_ATTEMPTS - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+
+
+async def create_schema_async():
+    for attempt in range(SCHEMA_ATTEMPTS):
+        try:
+            async with async_engine.begin() as conn:
+                await conn.run_sync(init_db_schema)
+            return
+        except OperationalError:
+            if attempt == SCHEMA_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(0.1 * (attempt + 1))
+
 
 # Initialize Gemini analyzer
-Base.metadata.create_all(bind=engine)
+if not ASYNC_DATABASE:
+    create_schema()
 gemini_analyzer = GeminiTextToningAnalyzer()
+tone_matcher = load_tone_matcher()
+quick_batch_pool = QuickBatchPool()
+gemini_analyzer.local_classifier = load_local_classifier()
+metrics.register_gauge("gemini_rate_per_minute", "Current Gemini rate limiter refill rate", lambda: gemini_analyzer.limiter.rate * 60)
+metrics.register_gauge("gemini_rate_backoffs", "Multiplicative rate limiter backoffs since start", lambda: gemini_analyzer.limiter.backoffs)
+metrics.register_gauge(
+    "gemini_model_latency_seconds",
+    "Median recent latency of each pooled Gemini model",
+    lambda: {member.name: member.latency or 0.0 for member in gemini_analyzer.pool.members},
+)
+metrics.register_gauge(
+    "gemini_model_error_rate",
+    "Share of recent calls to each pooled Gemini model that failed",
+    lambda: {member.name: member.error_rate for member in gemini_analyzer.pool.members},
+)
+metrics.register_gauge(
+    "gemini_model_circuit_open",
+    "1 while a pooled Gemini model's circuit breaker is open",
+    lambda: {member.name: int(not member.available) for member in gemini_analyzer.pool.members},
+)
+metrics.register_gauge("write_behind_queued", "Conversations waiting in the write-behind queue", lambda: conversation_writer.stats()["queued"])
 
 app = FastAPI(title=APP_NAME)
 
@@ -530,36 +3741,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, NEXT_OFFSET_HEADER],
 )
 
 
 @app.post("/auth/register", response_model=UserOut, status_code=status.HTTP_201_CREATED)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
-    existing = get_user_by_email(db, user.email)
+async def register_user(user: UserCreate, db: AnySession = Depends(get_db)):
+    existing = await get_user_by_email(db, user.email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
+    await db_release(db)
 
     db_user = User(
         email=user.email.lower(),
-        hashed_password=get_password_hash(user.password),
+        hashed_password=await password_hasher.run(get_password_hash, user.password),
         full_name=user.full_name,
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db_commit(db, db_user)
     return db_user
 
 
 @app.post("/auth/login", response_model=TokenResponse)
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AnySession = Depends(get_db),
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
 
-    access_token = create_access_token({"sub": user.email})
+    access_token = create_access_token({"sub": user.email, "uid": user.id})
     return TokenResponse(
         access_token=access_token,
         token_type="bearer",
@@ -575,11 +3787,28 @@ async def get_profile(current_user: User = Depends(get_current_user)):
 async def startup_event():
     """Initialize Gemini on startup."""
     logger.info("Starting Smart Text Toning Analyzer...")
-    if gemini_analyzer.initialize():
+    if async_engine is not None:
+        await create_schema_async()
+    await password_hasher.prewarm()
+    if WRITE_BEHIND_ENABLED:
+        conversation_writer.start()
+    if GEMINI_INIT_BACKGROUND:
+        gemini_analyzer.start_background_initialize()
+    elif await asyncio.to_thread(gemini_analyzer.initialize):
         logger.info("✅ Gemini Text Toning Analyzer initialized successfully")
     else:
         logger.warning("❌ Gemini initialization failed - using fallback mode")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    gemini_analyzer.shutdown()
+    quick_batch_pool.shutdown()
+    password_hasher.shutdown()
+    # Drain queued conversations before the engine goes away
+    await conversation_writer.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+
 @app.get("/")
 async def root():
     return {
@@ -592,40 +3821,345 @@ async def root():
 
 @app.get("/conversations", response_model=List[ConversationSummary])
 async def list_conversations(
-    db: Session = Depends(get_db),
+    response: Response,
+    limit: int = Query(CONVERSATION_PAGE_DEFAULT, ge=1, le=CONVERSATION_PAGE_MAX),
+    cursor: Optional[str] = None,
+    preview_chars: Optional[int] = Query(None, ge=1),
+    db: AnySession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """List conversations newest first, one page at a time.
+    
+    When more rows exist, the X-Next-Cursor response header holds the value
+    to pass as ?cursor= for the next page. preview_chars truncates
+    original_text in the database instead of loading the full text.
+    """
+    text_column = Conversation.original_text
+    if preview_chars is not None:
+        text_column = func.substr(Conversation.original_text, 1, preview_chars)
+
+    statement = (
+        select(
+            Conversation.id,
+            text_column.label("original_text"),
+            Conversation.detected_tone,
+            Conversation.tone_category,
+            Conversation.confidence,
+            Conversation.context,
+            Conversation.created_at,
+        )
+        .where(Conversation.user_id == current_user.id)
+        .order_by(Conversation.created_at.desc(), Conversation.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        cursor_created_at, cursor_id = decode_conversation_cursor(cursor)
+        statement = statement.where(
+            or_(
+                Conversation.created_at < cursor_created_at,
+                and_(Conversation.created_at == cursor_created_at, Conversation.id < cursor_id),
+            )
+        )
+
+    rows = (await db_execute(db, statement)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_conversation_cursor(rows[-1].created_at, rows[-1].id)
+    if FAST_RESPONSES:
+        return conversation_summaries_response(rows, next_cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return [row._asdict() for row in rows]
+
+
+CONVERSATION_SUMMARY_FIELDS = tuple(ConversationSummary.model_fields)
+
+
+def conversation_summaries_response(rows: List[Any], next_cursor: Optional[str] = None) -> ORJSONResponse:
+    """Encode projected listing rows straight from their tuples, without per-row models or response validation."""
+    # The select() projects exactly CONVERSATION_SUMMARY_FIELDS, in order
+    response = ORJSONResponse([dict(zip(CONVERSATION_SUMMARY_FIELDS, row)) for row in rows])
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+
+def encode_conversation_cursor(created_at: datetime, conversation_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{conversation_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_conversation_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, conversation_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(conversation_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+@app.get("/conversations/export")
+async def export_conversations(
+    format: ExportFormat = ExportFormat.NDJSON,
+    include_analysis: bool = False,
+    gzip: bool = True,
+    current_user: User = Depends(get_current_user),
+):
+    """Download the user's whole history, oldest first, as NDJSON or CSV.
+
+    Rows are read in EXPORT_BATCH_SIZE batches through a server-side cursor
+    and encoded (and gzip-compressed) batch by batch, so memory stays flat
+    however many conversations the user has. include_analysis adds the
+    decoded analysis (as a JSON string in CSV).
+    """
+    columns = [getattr(Conversation, field) for field in CONVERSATION_SUMMARY_FIELDS]
+    if include_analysis:
+        columns.append(Conversation.analysis_json)
+    statement = (
+        select(*columns)
+        .where(Conversation.user_id == current_user.id)
+        .order_by(Conversation.created_at, Conversation.id)
+    )
+    encode = encode_ndjson_batch if format == ExportFormat.NDJSON else encode_csv_batch
+
+    async def body():
+        compressor = zlib.compressobj(EXPORT_COMPRESS_LEVEL, zlib.DEFLATED, 31) if gzip else None
+        first = True
+        async for rows in stream_partitions(statement):
+            chunk = encode(rows, include_analysis, header=first)
+            first = False
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        if first and format == ExportFormat.CSV:
+            # No rows: still send the header
+            chunk = encode([], include_analysis, header=True)
+            yield compressor.compress(chunk) if compressor is not None else chunk
+        if compressor is not None:
+            yield compressor.flush()
+
+    filename = f"conversations-{current_user.id}.{format.value}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("application/x-ndjson" if format == ExportFormat.NDJSON else "text/csv")
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_partitions(statement, batch_size: int = EXPORT_BATCH_SIZE):
+    """Yield a statement's rows in batches without loading the whole result, in either database mode."""
+    statement = statement.execution_options(yield_per=batch_size)
+    async with db_session() as db:
+        if isinstance(db, AsyncSession):
+            result = await db.stream(statement)
+            async for partition in result.partitions():
+                yield partition
+            return
+        # The sync driver blocks, so each fetch runs on the default executor
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, db.execute, statement)
+        partitions = result.partitions()
+        while True:
+            partition = await loop.run_in_executor(None, next, partitions, None)
+            if partition is None:
+                return
+            yield partition
+
+
+def export_record(row, include_analysis: bool) -> Dict[str, Any]:
+    record = {field: getattr(row, field) for field in CONVERSATION_SUMMARY_FIELDS}
+    record["created_at"] = record["created_at"].isoformat()
+    if include_analysis:
+        record["analysis"] = decode_analysis(row.analysis_json, record)
+    return record
+
+
+def encode_ndjson_batch(rows, include_analysis: bool, header: bool = False) -> bytes:
+    return "".join(
+        json.dumps(export_record(row, include_analysis), ensure_ascii=False) + "\n" for row in rows
+    ).encode("utf-8")
+
+
+def encode_csv_batch(rows, include_analysis: bool, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    fields = list(CONVERSATION_SUMMARY_FIELDS) + (["analysis"] if include_analysis else [])
+    if header:
+        writer.writerow(fields)
+    for row in rows:
+        record = export_record(row, include_analysis)
+        if include_analysis:
+            record["analysis"] = json.dumps(record["analysis"], ensure_ascii=False)
+        writer.writerow([record[field] for field in fields])
+    return buffer.getvalue().encode("utf-8")
+
+
+@app.get("/conversations/stats", response_model=ConversationStatsResponse)
+async def get_conversation_stats(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    tone_category: Optional[str] = None,
+    db: AnySession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    conversations = (
-        db.query(Conversation)
-        .filter(Conversation.user_id == current_user.id)
-        .order_by(Conversation.created_at.desc())
-        .all()
+    """Tone distribution and average confidence per UTC day, read from the conversation_stats rollup.
+    
+    Both dates are inclusive. Totals per tone cover the same range.
+    """
+    statement = (
+        select(ConversationStat)
+        .where(ConversationStat.user_id == current_user.id)
+        .order_by(ConversationStat.day, ConversationStat.tone_category)
     )
-    return [
-        ConversationSummary.model_validate(conversation)
-        for conversation in conversations
+    if date_from is not None:
+        statement = statement.where(ConversationStat.day >= date_from)
+    if date_to is not None:
+        statement = statement.where(ConversationStat.day <= date_to)
+    if tone_category:
+        statement = statement.where(ConversationStat.tone_category == tone_category.strip().lower())
+    buckets = (await db_execute(db, statement)).scalars().all()
+
+    totals: Dict[str, Dict[str, float]] = {}
+    days = []
+    for bucket in buckets:
+        days.append({
+            "day": bucket.day,
+            "tone_category": bucket.tone_category,
+            "conversations": bucket.conversations,
+            "average_confidence": average_confidence(bucket.confidence_sum, bucket.confidence_count),
+            "enhancements": bucket.enhancements,
+        })
+        total = totals.setdefault(bucket.tone_category, dict.fromkeys(ConversationStatsRollup.COUNTERS, 0))
+        for name in ConversationStatsRollup.COUNTERS:
+            total[name] += getattr(bucket, name)
+
+    conversations = sum(total["conversations"] for total in totals.values())
+    tones = [
+        {
+            "tone_category": category,
+            "conversations": total["conversations"],
+            "share": round(total["conversations"] / conversations, 4),
+            "average_confidence": average_confidence(total["confidence_sum"], total["confidence_count"]),
+            "enhancements": total["enhancements"],
+        }
+        for category, total in sorted(totals.items(), key=lambda item: -item[1]["conversations"])
     ]
+    return {"conversations": conversations, "tones": tones, "days": days}
+
+
+def average_confidence(confidence_sum: float, confidence_count: int) -> Optional[float]:
+    return round(confidence_sum / confidence_count, 4) if confidence_count else None
+
+
+@app.get("/conversations/search", response_model=List[ConversationSearchResult])
+async def search_conversations(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=500),
+    tone_category: Optional[str] = None,
+    date_from: Optional[Union[datetime, date]] = None,
+    date_to: Optional[Union[datetime, date]] = None,
+    limit: int = Query(SEARCH_PAGE_DEFAULT, ge=1, le=SEARCH_PAGE_MAX),
+    offset: int = Query(0, ge=0),
+    db: AnySession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Search the user's conversations, best match first.
+    
+    Every word of q must appear in the original text or an enhanced version
+    (the last word may be a prefix). Results can be narrowed to a tone_category
+    and to date_from <= created_at < date_to; a plain date as date_to includes
+    that whole day. When more results exist, the
+    X-Next-Offset response header holds the offset of the next page.
+    """
+    match = conversation_search.match_query(q, current_user.id)
+    if match is None:
+        raise HTTPException(status_code=400, detail="Search query needs at least one word")
+    filters = {
+        "tone_category": tone_category.strip().lower() if tone_category else None,
+        "date_from": search_bound(date_from),
+        "date_to": search_bound(date_to, end=True),
+    }
+
+    if conversation_search.available:
+        params = {name: value for name, value in filters.items() if value is not None}
+        params.update(query=match, user_id=current_user.id, limit=limit + 1, offset=offset)
+        rows = [row._asdict() for row in (await db_execute(db, conversation_search.search_statement(filters), params)).all()]
+    else:
+        rows = await scan_conversations(db, current_user, q, filters, limit + 1, offset)
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_OFFSET_HEADER] = str(offset + limit)
+    return rows
+
+
+async def scan_conversations(
+    db: AnySession,
+    user: User,
+    query: str,
+    filters: Dict[str, Any],
+    limit: int,
+    offset: int,
+) -> List[Dict[str, Any]]:
+    """Search without an FTS index: original_text only, newest first."""
+    statement = (
+        select(*(getattr(Conversation, field) for field in CONVERSATION_SUMMARY_FIELDS))
+        .where(Conversation.user_id == user.id)
+        .order_by(Conversation.created_at.desc(), Conversation.id.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+    for term in re.findall(r"\w+", query)[:SEARCH_MAX_TERMS]:
+        statement = statement.where(Conversation.original_text.ilike(f"%{term}%"))
+    if filters["tone_category"] is not None:
+        statement = statement.where(func.lower(Conversation.tone_category) == filters["tone_category"])
+    if filters["date_from"] is not None:
+        statement = statement.where(Conversation.created_at >= filters["date_from"])
+    if filters["date_to"] is not None:
+        statement = statement.where(Conversation.created_at < filters["date_to"])
+    return [row._asdict() for row in (await db_execute(db, statement)).all()]
+
+
+def search_bound(value: Optional[Union[datetime, date]], end: bool = False) -> Optional[datetime]:
+    """Normalize a date range bound to naive UTC, like created_at."""
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.combine(value + timedelta(days=1) if end else value, datetime.min.time())
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
 
 @app.get("/conversations/{conversation_id}", response_model=ConversationDetail)
 async def get_conversation_detail(
     conversation_id: int,
-    db: Session = Depends(get_db),
+    db: AnySession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    conversation = (
-        db.query(Conversation)
-        .filter(
+    result = await db_execute(
+        db,
+        select(Conversation)
+        .where(
             Conversation.id == conversation_id,
             Conversation.user_id == current_user.id,
         )
-        .first()
+        .limit(1),
     )
+    conversation = result.scalars().first()
 
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    analysis_payload = json.loads(conversation.analysis_json or "{}")
+    analysis_payload = conversation.analysis
     detail = ConversationDetail(
         id=conversation.id,
         original_text=conversation.original_text,
@@ -643,66 +4177,114 @@ async def health():
     return {
         "status": "healthy",
         "gemini_available": gemini_analyzer.initialized,
+        "gemini_initializing": gemini_analyzer.initializing,
         "has_gemini_library": HAS_GEMINI,
-        "rate_limit_delay": gemini_analyzer.request_delay
+        "rate_limit_delay": round(gemini_analyzer.limiter.delay, 3),
+        "rate_limiter": gemini_analyzer.limiter.stats(),
+        "gemini_models": gemini_analyzer.pool.stats(),
+        "analysis_cache": gemini_analyzer.cache.stats(),
+        "inflight_analyses": len(gemini_analyzer._inflight),
+        "coalesced_requests": gemini_analyzer.coalesced_requests,
+        "batching": gemini_analyzer.batcher.stats() if gemini_analyzer.batch_enabled else None,
+        "auth_cache": auth_cache.stats(),
+        "password_hashing": password_hasher.stats(),
+        "write_behind": conversation_writer.stats(),
+        "local_classifier": {
+            "loaded": gemini_analyzer.local_classifier is not None,
+            "routing": LOCAL_CLASSIFIER_ROUTING,
+            "trained_on": gemini_analyzer.local_classifier.trained_on if gemini_analyzer.local_classifier else 0,
+        },
     }
 
 @app.post("/analyze-tone", response_model=ToneAnalysisResponse)
 async def analyze_tone(
     request: ToneAnalysisRequest,
-    db: Session = Depends(get_db),
+    http_request: Request,
+    db: AnySession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     """Analyze text tone and provide enhanced versions."""
     
-    if not request.text or not request.text.strip():
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
-    
-    if len(request.text) > 1000:
-        raise HTTPException(status_code=400, detail="Text too long. Maximum 1000 characters.")
+    validate_analysis_request(request)
     
+    metrics.gauge_add("inflight_requests", 1, "/analyze-tone")
     try:
-        # Try Gemini first
-        analysis_result = None
-        if gemini_analyzer.initialized:
-            analysis_result = gemini_analyzer.analyze_tone_and_enhance(
-                request.text, 
-                request.context
-            )
-        
-        response_payload: Dict[str, Any]
-        if analysis_result:
-            logger.info("Successfully generated tone analysis")
-            response_payload = dict(analysis_result)
-        else:
-            # Fallback to smart analysis
-            logger.info("Using fallback tone analysis")
-            fallback_analysis = gemini_analyzer._generate_fallback_analysis(request.text)
-            response_payload = {
-                **fallback_analysis,
-                "service": "smart-fallback",
-                "note": "Gemini unavailable. Using smart fallback analysis.",
-            }
-
-        response_payload["context"] = request.context
-        if response_payload.get("confidence") is not None:
-            try:
-                response_payload["confidence"] = float(response_payload["confidence"])
-            except (TypeError, ValueError):
-                response_payload["confidence"] = 0.0
-        else:
-            response_payload["confidence"] = 0.0
+        with metrics.timer("analyze_request"):
+            analysis_result = await run_tone_analysis(request, use_cache=not should_bypass_cache(http_request))
+            response_payload = build_analysis_payload(analysis_result, request)
 
-        conversation = save_conversation(db, current_user, request, response_payload)
-        response_payload["conversation_id"] = conversation.id
+            response_payload["conversation_id"] = await persist_conversation(db, current_user, request, response_payload)
 
-        return JSONResponse(response_payload)
+        return ORJSONResponse(response_payload) if FAST_RESPONSES else JSONResponse(response_payload)
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Unexpected error in tone analysis: {e}")
         raise HTTPException(status_code=500, detail="Internal server error during tone analysis")
+    finally:
+        metrics.gauge_add("inflight_requests", -1, "/analyze-tone")
+
+@app.post("/analyze-tone/stream")
+async def analyze_tone_stream(
+    request: ToneAnalysisRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_user),
+):
+    """Stream tone analysis as NDJSON events while Gemini is still generating.
+    
+    Emits a "tone" event first, then "explanation", one "enhanced_version" per
+    version and one "suggestion" per suggestion as each line completes, and
+    finally a "done" event with the full payload and conversation_id. If Gemini
+    fails after some events went out, a "reset" event tells the client to discard
+    them before the fallback analysis is streamed in the same order.
+    """
+    
+    validate_analysis_request(request)
+    use_cache = not should_bypass_cache(http_request)
+    
+    async def event_stream():
+        metrics.gauge_add("inflight_requests", 1, "/analyze-tone/stream")
+        try:
+            analysis_result = None
+            sent_events = False
+            async for event in gemini_analyzer.stream_tone_analysis(request.text, request.context, use_cache=use_cache):
+                if event["event"] == "result":
+                    analysis_result = event["analysis"]
+                    continue
+                sent_events = True
+                yield encode_ndjson(event)
+            
+            response_payload = build_analysis_payload(analysis_result, request)
+            if not analysis_result:
+                if sent_events:
+                    yield encode_ndjson({"event": "reset", "reason": "Gemini stream interrupted, using fallback analysis"})
+                for event in analysis_events(response_payload):
+                    yield encode_ndjson(event)
+            
+            # The request-scoped session may already be closed while streaming
+            async with db_session() as db:
+                response_payload["conversation_id"] = await persist_conversation(db, current_user, request, response_payload)
+            yield encode_ndjson({"event": "done", "analysis": response_payload})
+
+        except Exception as e:
+            logger.error(f"Unexpected error in streaming tone analysis: {e}")
+            yield encode_ndjson({"event": "error", "detail": "Internal server error during tone analysis"})
+        finally:
+            metrics.gauge_add("inflight_requests", -1, "/analyze-tone/stream")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of stage latencies, counters and gauges."""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (set METRICS_ENABLED=true)")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/supported-tones")
 async def get_supported_tones():
@@ -719,32 +4301,220 @@ async def quick_analyze(text: str):
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     
     # Simple tone detection based on keywords (fallback)
-    text_lower = text.lower()
-    
-    tone_indicators = {
-        "formal": ["respectfully", "sincerely", "please be advised", "hereinafter"],
-        "casual": ["hey", "hi", "what's up", "lol", "haha", "thanks"],
-        "professional": ["team", "meeting", "agenda", "follow up", "action items"],
-        "friendly": ["great", "awesome", "wonderful", "happy", "excited"],
-        "persuasive": ["should", "must", "highly recommend", "benefit", "advantage"],
-        "enthusiastic": ["amazing", "incredible", "fantastic", "wow", "!"]
-    }
+    detected_tone, max_matches = tone_matcher.detect(text)
     
-    detected_tone = "neutral"
-    max_matches = 0
+    return {"text": text, **quick_analysis_result(detected_tone, max_matches)}
+
+@app.post("/quick-analyze/batch")
+async def quick_analyze_batch(request: Request):
+    """Keyword tone analysis for many texts, streamed back as NDJSON in input order.
+    
+    The body is either a JSON array or, with an application/x-ndjson content
+    type, one JSON value per line. Items are strings or {"id": ..., "text": ...}
+    objects. Both forms are parsed as they arrive and large batches are sharded
+    across a process pool; at most QUICK_BATCH_MAX_INFLIGHT shards are held in
+    memory at a time.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        items = iter_ndjson_body(request)
+    else:
+        # Read just far enough to reject a body that is not an array before the response starts
+        parser = JSONArrayStreamParser()
+        chunks = request.stream()
+        first_items: List[Any] = []
+        finished = False
+        try:
+            async for chunk in chunks:
+                first_items.extend(parser.feed(chunk))
+                if parser.started:
+                    break
+            else:
+                first_items.extend(parser.finish())
+                finished = True
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON") from None
+        items = iter_json_array_body(parser, chunks, first_items, finished)
     
-    for tone, indicators in tone_indicators.items():
-        matches = sum(1 for indicator in indicators if indicator in text_lower)
-        if matches > max_matches:
-            max_matches = matches
-            detected_tone = tone
+    return RequestBodyStreamingResponse(stream_quick_batch(items), media_type="application/x-ndjson")
+
+
+class RequestBodyStreamingResponse(StreamingResponse):
+    """StreamingResponse for generators that are still reading the request body.
     
-    return {
-        "text": text,
-        "detected_tone": detected_tone,
-        "confidence": min(0.3 + (max_matches * 0.1), 0.9),
-        "method": "keyword-analysis"
-    }
+    StreamingResponse normally listens for client disconnects on receive(),
+    which would swallow the body chunks the generator is waiting for.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_ndjson_body(request: Request):
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_ndjson_item(line)
+    if buffer.strip():
+        yield parse_ndjson_item(buffer)
+
+
+def parse_ndjson_item(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError:
+        return {"error": "Invalid JSON line"}
+
+
+class JSONArrayStreamParser:
+    """Incrementally parses a JSON array body, yielding each element once it is complete.
+    
+    Elements are yielded as they are parsed, so the ones before a syntax error
+    still reach the caller before the ValueError does.
+    """
+
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        # start -> first -> separator <-> value ... -> done
+        self._state = "start"
+
+    @property
+    def started(self) -> bool:
+        """True once the opening bracket has been seen."""
+        return self._state != "start"
+
+    def feed(self, chunk: bytes) -> Iterator[Any]:
+        self._buffer += self._utf8.decode(chunk)
+        yield from self._parse(final=False)
+
+    def finish(self) -> Iterator[Any]:
+        self._buffer += self._utf8.decode(b"", final=True)
+        yield from self._parse(final=True)
+        if self._state != "done":
+            raise ValueError("JSON array is incomplete")
+
+    def _parse(self, final: bool) -> Iterator[Any]:
+        buffer = self._buffer
+        position = 0
+        while True:
+            position = self.WHITESPACE.match(buffer, position).end()
+            if position >= len(buffer):
+                break
+            char = buffer[position]
+            if self._state == "start":
+                if char != "[":
+                    raise ValueError("Body must be a JSON array")
+                self._state = "first"
+                position += 1
+            elif self._state == "separator" or (self._state == "first" and char == "]"):
+                if char == "]":
+                    self._state = "done"
+                elif char == "," and self._state == "separator":
+                    self._state = "value"
+                else:
+                    raise ValueError(f"Unexpected {char!r} in JSON array")
+                position += 1
+            elif self._state in ("first", "value"):
+                try:
+                    item, end = self._decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if final:
+                        raise
+                    break
+                # A number is only complete once a delimiter follows; it may continue in the next chunk
+                if not final and (end == len(buffer) or buffer[end] not in " \t\n\r,]"):
+                    break
+                self._state = "separator"
+                position = end
+                yield item
+            else:
+                raise ValueError("Unexpected data after the JSON array")
+        self._buffer = buffer[position:]
+
+
+async def iter_json_array_body(parser: JSONArrayStreamParser, chunks, first_items: List[Any], finished: bool):
+    for item in first_items:
+        yield item
+    if finished:
+        return
+    try:
+        async for chunk in chunks:
+            for item in parser.feed(chunk):
+                yield item
+        for item in parser.finish():
+            yield item
+    except ValueError:
+        # The response has already started, so a malformed array ends it with an error line
+        yield {"error": "Invalid JSON array"}
+
+
+async def stream_quick_batch(items):
+    shard: List[Tuple[int, Any]] = []
+    inflight: deque = deque()
+    index = 0
+    
+    async for item in items:
+        shard.append((index, item))
+        index += 1
+        if len(shard) >= QUICK_BATCH_SHARD_SIZE:
+            inflight.append(asyncio.ensure_future(score_quick_batch_items(shard)))
+            shard = []
+            # Bound memory: wait for the oldest shard before reading further input
+            while len(inflight) >= QUICK_BATCH_MAX_INFLIGHT:
+                yield await pop_quick_batch_shard(inflight)
+    
+    if shard:
+        # Only a batch that fits in one partial shard is scored inline; the tail
+        # of a larger batch goes to the pool like every other shard
+        inline = len(shard) == index
+        inflight.append(asyncio.ensure_future(score_quick_batch_items(shard, inline=inline)))
+    while inflight:
+        yield await pop_quick_batch_shard(inflight)
+
+
+async def pop_quick_batch_shard(inflight: deque) -> bytes:
+    lines = await inflight.popleft()
+    return b"".join(encode_ndjson(line) for line in lines)
+
+
+async def score_quick_batch_items(shard: List[Tuple[int, Any]], inline: bool = False) -> List[Dict[str, Any]]:
+    lines: List[Dict[str, Any]] = []
+    texts: List[str] = []
+    for index, item in shard:
+        line: Dict[str, Any] = {"index": index}
+        text = item
+        if isinstance(item, dict):
+            if item.get("id") is not None:
+                line["id"] = item["id"]
+            line["error"] = item.get("error")
+            text = item.get("text")
+        if not line.get("error") and (not isinstance(text, str) or not text.strip()):
+            line["error"] = "Text cannot be empty"
+        if not line.get("error"):
+            line.pop("error", None)
+            texts.append(text)
+        lines.append(line)
+    
+    if inline:
+        # A small batch is not worth a round trip to the pool
+        scores = score_quick_batch_shard(texts)
+    else:
+        scores = await quick_batch_pool.score(texts)
+    
+    scored = iter(scores)
+    for line in lines:
+        if "error" not in line:
+            line.update(quick_analysis_result(*next(scored)))
+    return lines
 
 if __name__ == "__main__":
     import uvicorn
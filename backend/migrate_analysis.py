@@ -0,0 +1,23 @@
+"""Rewrite legacy JSON-text conversation analyses into the compact binary format"""
+import sys
+import time
+
+from main import SessionLocal, migrate_analysis_storage
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        migrated = migrate_analysis_storage(db, batch_size=batch_size)
+    finally:
+        db.close()
+
+    print(f"Migrated {migrated} conversations in {time.perf_counter() - started:.2f}s")
+    if migrated:
+        print("Run VACUUM on SQLite databases to reclaim the freed space.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+# main reads its configuration at import, so point it at a throwaway database first
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ["GEMINI_API_KEY"] = ""
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_emails = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def register_user(client):
+    """Register a fresh user and return (user_id, auth headers)."""
+    def register():
+        email = f"user{next(_emails)}@example.com"
+        user = client.post("/auth/register", json={"email": email, "password": "pw", "full_name": "Test"}).json()
+        token = client.post("/auth/login", data={"username": email, "password": "pw"}).json()["access_token"]
+        return user["id"], {"Authorization": f"Bearer {token}"}
+    return register
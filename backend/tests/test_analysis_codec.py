@@ -0,0 +1,89 @@
+import json
+import zlib
+
+import pytest
+
+from analysis_codec import (
+    ANALYSIS_CODEC_RAW,
+    ANALYSIS_CODEC_ZLIB,
+    ANALYSIS_COMPRESS_MIN_BYTES,
+    ANALYSIS_FORMAT_VERSION,
+    decode_analysis,
+    encode_analysis,
+    is_legacy_analysis,
+)
+
+ANALYSIS = {
+    "original_text": "Can we move the meeting?",
+    "context": "email",
+    "detected_tone": "Polite",
+    "tone_category": "professional",
+    "confidence": 0.82,
+    "explanation": "A courteous request.",
+    "enhanced_versions": [{"tone": "Formal", "text": "Would it be possible to reschedule the meeting?"}],
+    "suggestions": ["Propose a new time"],
+}
+COLUMNS = {field: ANALYSIS[field] for field in ("original_text", "context", "detected_tone", "tone_category", "confidence")}
+
+
+def test_round_trip_leaves_out_fields_held_in_columns():
+    raw = encode_analysis(ANALYSIS, COLUMNS)
+    assert raw[0] == ANALYSIS_FORMAT_VERSION
+    assert raw[1] == ANALYSIS_CODEC_RAW
+    assert raw[2] == 0b11111
+    assert b"Can we move the meeting" not in raw
+    assert decode_analysis(raw, COLUMNS) == ANALYSIS
+
+
+def test_fields_that_differ_from_their_column_are_kept():
+    columns = dict(COLUMNS, detected_tone="polite", confidence=None)
+    raw = encode_analysis(ANALYSIS, columns)
+    assert decode_analysis(raw, columns) == ANALYSIS
+
+
+def test_unicode_survives_the_round_trip():
+    analysis = dict(ANALYSIS, explanation="Höflich — 丁寧 🙂")
+    assert decode_analysis(encode_analysis(analysis, {}), {}) == analysis
+
+
+def test_large_payloads_are_compressed():
+    analysis = dict(ANALYSIS, suggestions=["Say when you are free next week"] * 40)
+    raw = encode_analysis(analysis, COLUMNS)
+    assert raw[1] == ANALYSIS_CODEC_ZLIB
+    assert len(raw) < len(json.dumps(analysis))
+    assert decode_analysis(raw, COLUMNS) == analysis
+
+
+def test_small_payloads_stay_uncompressed():
+    raw = encode_analysis({"suggestions": []}, {})
+    assert len(raw) - 3 < ANALYSIS_COMPRESS_MIN_BYTES
+    assert raw[1] == ANALYSIS_CODEC_RAW
+
+
+@pytest.mark.parametrize("legacy", [json.dumps(ANALYSIS), json.dumps(ANALYSIS).encode("utf-8")])
+def test_legacy_json_text_is_read_as_is(legacy):
+    assert is_legacy_analysis(legacy)
+    # Legacy rows carry every field themselves; the columns are not consulted
+    assert decode_analysis(legacy, {"detected_tone": "other"}) == ANALYSIS
+
+
+@pytest.mark.parametrize("raw", [None, b"", ""])
+def test_empty_values_decode_to_an_empty_analysis(raw):
+    assert decode_analysis(raw, COLUMNS) == {}
+
+
+def test_compact_records_are_not_legacy():
+    assert not is_legacy_analysis(encode_analysis(ANALYSIS, COLUMNS))
+    assert not is_legacy_analysis(None)
+
+
+def test_unknown_version_is_rejected():
+    raw = bytes((ANALYSIS_FORMAT_VERSION + 1, ANALYSIS_CODEC_RAW, 0)) + b"{}"
+    with pytest.raises(ValueError, match="version"):
+        decode_analysis(raw, {})
+
+
+def test_unknown_codec_is_rejected():
+    raw = bytes((ANALYSIS_FORMAT_VERSION, 9, 0)) + zlib.compress(b"{}")
+    with pytest.raises(ValueError, match="codec"):
+        decode_analysis(raw, {})
@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+import main
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """A fresh cache wired into resolve_current_user and the User hooks."""
+    fresh = main.AuthCache(user_ttl_seconds=30)
+    monkeypatch.setattr(main, "auth_cache", fresh)
+    return fresh
+
+
+@pytest.fixture
+def db():
+    main.create_schema()
+    session = main.SessionLocal()
+    yield session
+    session.close()
+
+
+def make_user(db) -> main.User:
+    user = main.User(email=f"auth{next(_ids)}@example.com", hashed_password="hash-1")
+    db.add(user)
+    db.commit()
+    return user
+
+
+def token_for(user: main.User, **overrides) -> str:
+    return main.create_access_token({"sub": user.email, "uid": user.id, **overrides})
+
+
+def resolve(token: str, db) -> main.User:
+    return asyncio.run(main.resolve_current_user(token, db))
+
+
+def assert_rejected(token: str, db):
+    with pytest.raises(HTTPException) as error:
+        resolve(token, db)
+    assert error.value.status_code == 401
+
+
+def test_valid_token_is_cached_with_its_user(cache, db):
+    user = make_user(db)
+    token = token_for(user)
+
+    assert resolve(token, db).id == user.id
+    assert resolve(token, db).id == user.id
+    assert cache.token_hits == 1
+    assert cache.user_hits == 1
+
+
+def test_expired_token_is_rejected_even_when_cached(cache, db):
+    user = make_user(db)
+    token = main.create_access_token({"sub": user.email, "uid": user.id}, timedelta(seconds=-5))
+    claims = jwt.get_unverified_claims(token)
+    # As if it had been verified and cached while it was still valid
+    cache.set_token(token, main.TokenData(email=user.email, user_id=user.id), float(claims["exp"]))
+
+    assert_rejected(token, db)
+    assert cache.get_token(token) is None
+
+
+def test_token_whose_uid_and_email_disagree_is_rejected(cache, db):
+    first, second = make_user(db), make_user(db)
+
+    assert_rejected(token_for(first, uid=second.id), db)
+    # Also when the other user's row is already cached
+    resolve(token_for(second), db)
+    assert_rejected(token_for(first, uid=second.id), db)
+
+
+def test_email_change_evicts_the_user_and_its_tokens(cache, db):
+    user = make_user(db)
+    token = token_for(user)
+    resolve(token, db)
+
+    user = db.get(main.User, user.id)
+    user.email = f"renamed{next(_ids)}@example.com"
+    db.commit()
+
+    assert cache.stats()["users"] == 0
+    assert cache.stats()["tokens"] == 0
+    assert_rejected(token, db)
+    assert resolve(token_for(user), db).email == user.email
+
+
+def test_password_change_evicts_the_user_and_its_tokens(cache, db):
+    user = make_user(db)
+    resolve(token_for(user), db)
+
+    user = db.get(main.User, user.id)
+    user.hashed_password = "hash-2"
+    db.commit()
+
+    assert cache.stats()["users"] == 0
+    assert cache.stats()["tokens"] == 0
+
+
+def test_unrelated_update_keeps_the_cache(cache, db):
+    user = make_user(db)
+    resolve(token_for(user), db)
+
+    user = db.get(main.User, user.id)
+    user.full_name = "New Name"
+    db.commit()
+
+    assert cache.stats()["users"] == 1
+    assert cache.stats()["tokens"] == 1
+
+
+def test_deleted_user_is_evicted_and_rejected(cache, db):
+    user = make_user(db)
+    token = token_for(user)
+    resolve(token, db)
+
+    db.delete(db.get(main.User, user.id))
+    db.commit()
+
+    assert cache.stats()["users"] == 0
+    assert_rejected(token, db)
+
+
+def test_user_ttl_expires_as_configured(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "time", lambda: now[0])
+    user = main.User(id=999, email="ttl@example.com", hashed_password="x")
+    cache.set_user(user)
+
+    now[0] += 29.9
+    assert cache.get_user(999) is user
+    now[0] += 0.2
+    assert cache.get_user(999) is None
+    assert (cache.user_hits, cache.user_misses) == (1, 1)
@@ -0,0 +1,41 @@
+import pytest
+
+from main import BATCH_ITEM_DELIMITER, GeminiTextToningAnalyzer
+
+
+def item(tone: str) -> str:
+    return (
+        f"DETECTED_TONE: {tone}\nCONFIDENCE: 0.8\nTONE_CATEGORY: {tone.lower()}\nEXPLANATION: Because.\n"
+        f"ENHANCED_VERSIONS:\n1. Formal: A formal rewrite.\nSUGGESTIONS:\n- Keep it short\n"
+    )
+
+
+@pytest.fixture(scope="module")
+def analyzer():
+    return GeminiTextToningAnalyzer()
+
+
+def test_items_are_matched_to_their_index(analyzer):
+    response = "\n".join(
+        f"{BATCH_ITEM_DELIMITER.format(index=index)}\n{item(tone)}" for index, tone in ((2, "Casual"), (1, "Friendly"))
+    )
+    first, second = analyzer.parse_batch_analysis_response(response, ["one", "two"])
+    assert (first["original_text"], first["detected_tone"]) == ("one", "Friendly")
+    assert (second["original_text"], second["detected_tone"]) == ("two", "Casual")
+
+
+def test_delimiter_variants_are_accepted(analyzer):
+    response = f"Here you go:\n  == item 1 ==  \n{item('Formal')}\n=====ITEM 2=====\n{item('Casual')}"
+    results = analyzer.parse_batch_analysis_response(response, ["a", "b"])
+    assert [result["detected_tone"] for result in results] == ["Formal", "Casual"]
+
+
+def test_missing_and_unparseable_items_are_none(analyzer):
+    response = f"=== ITEM 1 ===\nI am not sure.\n=== ITEM 3 ===\n{item('Formal')}"
+    results = analyzer.parse_batch_analysis_response(response, ["a", "b", "c"])
+    assert [result and result["detected_tone"] for result in results] == [None, None, "Formal"]
+
+
+def test_a_repeated_delimiter_keeps_the_first_answer(analyzer):
+    response = f"=== ITEM 1 ===\n{item('Formal')}\n=== ITEM 1 ===\n{item('Casual')}"
+    assert analyzer.parse_batch_analysis_response(response, ["a"])[0]["detected_tone"] == "Formal"
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from main import decode_conversation_cursor, encode_conversation_cursor
+
+
+@pytest.mark.parametrize("created_at", [datetime(2025, 3, 9, 14, 5, 7, 123456), datetime(2025, 3, 9)])
+def test_round_trip(created_at):
+    cursor = encode_conversation_cursor(created_at, 4217)
+    assert "=" not in cursor
+    assert decode_conversation_cursor(cursor) == (created_at, 4217)
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "bm9waXBl", "MjAyNS0wMy0wOXxhYmM"])
+def test_malformed_cursors_are_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_conversation_cursor(cursor)
+    assert error.value.status_code == 400
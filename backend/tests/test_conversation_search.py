@@ -0,0 +1,131 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+import main
+
+
+@pytest.fixture
+def db():
+    session = main.SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture(params=["fts", "scan"])
+def index_mode(request, monkeypatch):
+    """Run a test against the FTS5 index and against the LIKE fallback."""
+    if request.param == "scan":
+        monkeypatch.setattr(main.conversation_search, "available", False)
+    else:
+        assert main.conversation_search.available
+    return request.param
+
+
+def add_conversation(db, user_id: int, text_: str, created_at: datetime = datetime(2025, 3, 10, 15, 0)) -> int:
+    analysis = {
+        "detected_tone": "professional",
+        "tone_category": "professional",
+        "confidence": 0.8,
+        "enhanced_versions": [{"tone": "Formal", "text": f"Formally: {text_}"}],
+        "suggestions": [],
+        "explanation": "",
+    }
+    request = main.ToneAnalysisRequest(text=text_)
+    conversation = main.Conversation(
+        **main.conversation_values(main.User(id=user_id), request, analysis), created_at=created_at,
+    )
+    db.add(conversation)
+    db.commit()
+    return conversation.id
+
+
+def search(client, headers, **params):
+    response = client.get("/conversations/search", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return [row["id"] for row in response.json()]
+
+
+def test_users_only_find_their_own_conversations(client, register_user, db, index_mode):
+    first_id, first = register_user()
+    second_id, second = register_user()
+    mine = add_conversation(db, first_id, "Quarterly budget review")
+    theirs = add_conversation(db, second_id, "Quarterly budget review")
+
+    assert search(client, first, q="budget") == [mine]
+    assert search(client, second, q="budget") == [theirs]
+    assert search(client, first, q="quarterly budget review") == [mine]
+
+
+def test_owner_token_keeps_other_users_rows_out_of_the_match():
+    # The MATCH itself is scoped, not only the join
+    with main.engine.connect() as connection:
+        connection.execute(main.conversation_search.INSERT, [
+            main.conversation_search.document(900001, 7001, "roadmap planning", {}),
+            main.conversation_search.document(900002, 7002, "roadmap planning", {}),
+        ])
+        matched = connection.execute(
+            text("SELECT rowid FROM conversations_fts WHERE conversations_fts MATCH :query"),
+            {"query": main.conversation_search.match_query("roadmap", 7001)},
+        ).scalars().all()
+        connection.rollback()
+    assert matched == [900001]
+
+
+def test_terms_do_not_match_the_owner_column():
+    query = main.conversation_search.match_query("u42", 7)
+    with main.engine.connect() as connection:
+        connection.execute(main.conversation_search.INSERT, [
+            main.conversation_search.document(900003, 7, "nothing relevant", {}),
+            main.conversation_search.document(900004, 42, "nothing relevant", {}),
+        ])
+        matched = connection.execute(
+            text("SELECT rowid FROM conversations_fts WHERE conversations_fts MATCH :query"), {"query": query},
+        ).scalars().all()
+        connection.rollback()
+    assert matched == []
+
+
+def test_user_filter_still_applies_if_the_index_is_wrong(client, register_user, db):
+    first_id, first = register_user()
+    second_id, _ = register_user()
+    theirs = add_conversation(db, second_id, "Confidential merger memo")
+    # Simulate a row indexed under the wrong owner
+    db.execute(
+        text("UPDATE conversations_fts SET owner = :owner WHERE rowid = :id"),
+        {"owner": main.conversation_search.owner_token(first_id), "id": theirs},
+    )
+    db.commit()
+
+    assert search(client, first, q="merger") == []
+
+
+def test_fallback_scan_ignores_enhanced_text_and_has_no_snippet(client, register_user, db, monkeypatch):
+    monkeypatch.setattr(main.conversation_search, "available", False)
+    user_id, headers = register_user()
+    add_conversation(db, user_id, "Lunch on Friday?")
+
+    assert search(client, headers, q="formally") == []
+    rows = client.get("/conversations/search", params={"q": "lunch"}, headers=headers).json()
+    assert [(row["original_text"], row["snippet"], row["rank"]) for row in rows] == [("Lunch on Friday?", None, None)]
+
+
+@pytest.mark.parametrize(
+    "params, found",
+    [
+        ({"date_to": "2025-03-10"}, True),  # a plain date includes that whole day
+        ({"date_to": "2025-03-09"}, False),
+        ({"date_to": "2025-03-10T15:00:00"}, False),  # a datetime is exclusive
+        ({"date_to": "2025-03-10T15:00:01"}, True),
+        ({"date_from": "2025-03-10T15:00:00"}, True),  # date_from is inclusive
+        ({"date_from": "2025-03-11"}, False),
+        ({"date_to": "2025-03-10T16:00:01+01:00"}, True),  # offsets are converted to UTC
+        ({"date_to": "2025-03-10T16:00:00+01:00"}, False),
+    ],
+)
+def test_date_bounds(client, register_user, db, index_mode, params, found):
+    user_id, headers = register_user()
+    conversation_id = add_conversation(db, user_id, "Invoice reminder", datetime(2025, 3, 10, 15, 0))
+
+    assert search(client, headers, q="invoice", **params) == ([conversation_id] if found else [])
@@ -0,0 +1,84 @@
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete, insert, select
+
+import main
+from analysis_codec import decode_analysis, is_legacy_analysis
+
+
+@pytest.fixture
+def db():
+    main.create_schema()
+    session = main.SessionLocal()
+    # Other tests leave conversations behind; these tests count every row
+    session.execute(delete(main.Conversation))
+    session.commit()
+    if session.get(main.User, 1) is None:
+        session.add(main.User(id=1, email="migrate@example.com", hashed_password="x"))
+        session.commit()
+    yield session
+    session.execute(delete(main.Conversation))
+    session.commit()
+    session.close()
+
+
+def legacy_row(index: int) -> dict:
+    analysis = {
+        "original_text": f"Message {index}",
+        "context": "chat",
+        "detected_tone": "friendly",
+        "tone_category": "friendly",
+        "confidence": 0.9,
+        "enhanced_versions": [{"tone": "Formal", "text": f"Formal message {index}"}],
+        "suggestions": ["Add a greeting"],
+        "explanation": "Warm wording.",
+    }
+    return {
+        "user_id": 1,
+        "original_text": analysis["original_text"],
+        "context": "chat",
+        "detected_tone": "friendly",
+        "tone_category": "friendly",
+        "confidence": 0.9,
+        "created_at": datetime(2025, 1, 1, 12, index),
+        # JSON text, as stored before the compact format
+        "analysis_json": json.dumps(analysis),
+    }
+
+
+def stored(db):
+    return db.execute(select(main.Conversation).order_by(main.Conversation.id)).scalars().all()
+
+
+def test_rewrites_legacy_rows_in_batches(db):
+    rows = [legacy_row(index) for index in range(5)]
+    db.execute(insert(main.Conversation.__table__), rows)
+    db.commit()
+    assert all(is_legacy_analysis(conversation.analysis_json) for conversation in stored(db))
+
+    assert main.migrate_analysis_storage(db, batch_size=2) == 5
+
+    db.expire_all()
+    for conversation, row in zip(stored(db), rows):
+        assert not is_legacy_analysis(conversation.analysis_json)
+        assert conversation.analysis == json.loads(row["analysis_json"])
+
+
+def test_leaves_compact_rows_alone_and_is_idempotent(db):
+    db.execute(insert(main.Conversation.__table__), [legacy_row(0)])
+    db.commit()
+    main.migrate_analysis_storage(db)
+    db.expire_all()
+    before = [conversation.analysis_json for conversation in stored(db)]
+
+    db.execute(insert(main.Conversation.__table__), [legacy_row(1)])
+    db.commit()
+    assert main.migrate_analysis_storage(db) == 1
+    assert main.migrate_analysis_storage(db) == 0
+
+    db.expire_all()
+    after = stored(db)
+    assert after[0].analysis_json == before[0]
+    assert decode_analysis(after[1].analysis_json, {})["suggestions"] == ["Add a greeting"]
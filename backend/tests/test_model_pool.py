@@ -0,0 +1,208 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+class FakeModel:
+    def __init__(self, name, delay=0.0, error=None):
+        self.model_name = f"models/{name}"
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(text=self.model_name)
+
+
+@pytest.fixture(autouse=True)
+def pool_settings(monkeypatch):
+    monkeypatch.setattr(main, "GEMINI_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(main, "GEMINI_BREAKER_COOLDOWN_SECONDS", 30.0)
+    monkeypatch.setattr(main, "GEMINI_HEDGE_ENABLED", True)
+    monkeypatch.setattr(main, "GEMINI_HEDGE_PERCENTILE", 0.95)
+    monkeypatch.setattr(main, "GEMINI_HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(main, "metrics", main.Metrics(enabled=True))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [500.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_analyzer(*models, max_concurrency=4) -> main.GeminiTextToningAnalyzer:
+    analyzer = main.GeminiTextToningAnalyzer()
+    analyzer.initialized = True
+    analyzer.async_mode = "native"
+    analyzer.max_concurrency = max_concurrency
+    analyzer.batch_enabled = False
+    analyzer.limiter = main.AdaptiveRateLimiter(rate_per_minute=0)
+    analyzer.pool = main.ModelPool(list(models))
+    return analyzer
+
+
+def measured(member: main.ModelHealth, latency: float, samples: int):
+    member.latencies.extend([latency] * samples)
+
+
+async def generate(analyzer, prompt="prompt"):
+    # Callers hold a concurrency slot around the call, as the analysis paths do
+    async with analyzer._get_semaphore():
+        return await analyzer._generate_content_async(prompt)
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    pool = main.ModelPool([FakeModel("a")])
+    member = pool.members[0]
+
+    pool.record_failure(member)
+    pool.record_failure(member)
+    pool.record_success(member)
+    pool.record_failure(member)
+    pool.record_failure(member)
+    assert member.state == "closed"
+
+    pool.record_failure(member)
+    assert member.state == "open"
+    assert not member.available
+    assert pool.all_open()
+
+
+def test_single_trial_call_after_cooldown_decides(clock):
+    pool = main.ModelPool([FakeModel("a")])
+    member = pool.members[0]
+    for _ in range(3):
+        pool.record_failure(member)
+
+    clock[0] += 30
+    assert member.state == "half_open"
+    assert member.available
+    pool.begin(member)
+    # Only the one trial call goes through while it is in flight
+    assert not member.available
+
+    pool.record_failure(member)
+    assert member.state == "open"
+    clock[0] += 29
+    assert member.state == "open"
+
+    clock[0] += 1
+    pool.begin(member)
+    pool.record_success(member, 0.1)
+    assert member.state == "closed"
+    assert member.available
+
+
+def test_abandoned_trial_releases_the_half_open_slot(clock):
+    pool = main.ModelPool([FakeModel("a")])
+    member = pool.members[0]
+    for _ in range(3):
+        pool.record_failure(member)
+    clock[0] += 30
+    pool.begin(member)
+    pool.release(member)
+    assert member.state == "half_open"
+    assert member.available
+
+
+def test_no_hedge_before_min_samples():
+    slow, fast = FakeModel("slow", delay=0.05), FakeModel("fast")
+    analyzer = make_analyzer(slow, fast)
+    measured(analyzer.pool.members[0], 0.001, 4)
+
+    response = asyncio.run(generate(analyzer))
+    assert response.text == "models/slow"
+    assert fast.calls == 0
+    assert main.metrics.counters["gemini_hedged"] == 0
+
+
+def test_no_hedge_while_within_percentile():
+    primary, backup = FakeModel("primary", delay=0.01), FakeModel("backup")
+    analyzer = make_analyzer(primary, backup)
+    measured(analyzer.pool.members[0], 1.0, 5)
+
+    assert asyncio.run(generate(analyzer)).text == "models/primary"
+    assert backup.calls == 0
+
+
+def test_hedge_fires_after_percentile_and_backup_can_win():
+    slow, fast = FakeModel("slow", delay=0.5), FakeModel("fast")
+    analyzer = make_analyzer(slow, fast)
+    measured(analyzer.pool.members[0], 0.01, 5)
+
+    response = asyncio.run(generate(analyzer))
+    assert response.text == "models/fast"
+    assert fast.calls == 1
+    assert main.metrics.counters["gemini_hedged"] == 1
+    assert main.metrics.counters["gemini_backup_wins"] == 1
+    # The losing primary was abandoned, not counted against it
+    assert analyzer.pool.members[0].failures == 0
+
+
+def test_hedge_takes_its_own_slot_and_returns_it():
+    slow, fast = FakeModel("slow", delay=0.5), FakeModel("fast", delay=0.05)
+    analyzer = make_analyzer(slow, fast, max_concurrency=2)
+    measured(analyzer.pool.members[0], 0.01, 5)
+
+    async def scenario():
+        semaphore = analyzer._get_semaphore()
+        call = asyncio.ensure_future(generate(analyzer))
+        await asyncio.sleep(0.03)
+        in_flight_locked = semaphore.locked()
+        await call
+        await asyncio.sleep(0)
+        return in_flight_locked, semaphore.locked()
+
+    in_flight_locked, after_locked = asyncio.run(scenario())
+    assert fast.calls == 1
+    assert in_flight_locked
+    assert not after_locked
+
+
+def test_hedge_skipped_without_a_free_slot():
+    slow, fast = FakeModel("slow", delay=0.05), FakeModel("fast")
+    analyzer = make_analyzer(slow, fast, max_concurrency=1)
+    measured(analyzer.pool.members[0], 0.001, 5)
+
+    assert asyncio.run(generate(analyzer)).text == "models/slow"
+    assert fast.calls == 0
+    assert main.metrics.counters["gemini_hedged"] == 0
+
+
+def test_failover_to_backup_on_error():
+    broken, backup = FakeModel("broken", error=RuntimeError("500")), FakeModel("backup")
+    analyzer = make_analyzer(broken, backup)
+
+    assert asyncio.run(generate(analyzer)).text == "models/backup"
+    assert analyzer.pool.members[0].consecutive_failures == 1
+    assert main.metrics.counters["gemini_failovers"] == 1
+
+
+def test_all_circuits_open_uses_the_fallback(client, register_user, monkeypatch):
+    first, second = FakeModel("first"), FakeModel("second")
+    analyzer = main.gemini_analyzer
+    monkeypatch.setattr(analyzer, "initialized", True)
+    monkeypatch.setattr(analyzer, "pool", main.ModelPool([first, second]))
+    for member in analyzer.pool.members:
+        for _ in range(3):
+            analyzer.pool.record_failure(member)
+
+    with pytest.raises(main.ModelCircuitOpenError):
+        asyncio.run(analyzer._generate_content_async("prompt"))
+
+    _, headers = register_user()
+    response = client.post(
+        "/analyze-tone", json={"text": "thanks for the quick reply"}, headers={**headers, "X-Bypass-Cache": "1"},
+    )
+    assert response.status_code == 200
+    assert response.json()["service"] != "gemini"
+    assert first.calls == second.calls == 0
+    assert main.metrics.counters["gemini_circuit_open"] >= 1
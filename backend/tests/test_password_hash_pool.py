@@ -0,0 +1,43 @@
+import asyncio
+
+import main
+
+
+def test_run_records_queue_and_compute_time_separately(monkeypatch):
+    fresh = main.Metrics(enabled=True)
+    monkeypatch.setattr(main, "metrics", fresh)
+    pool = main.PasswordHashPool(workers=1, mode="thread", max_queue=4)
+
+    async def hash_twice():
+        await pool.prewarm()
+        return await asyncio.gather(
+            pool.run(main.get_password_hash, "first"),
+            pool.run(main.get_password_hash, "second"),
+        )
+
+    try:
+        hashes = asyncio.run(hash_twice())
+    finally:
+        pool.shutdown()
+
+    assert all(main.verify_password(word, hashed) for word, hashed in zip(("first", "second"), hashes))
+    assert "password_hash" not in fresh.stages
+    assert sum(fresh.stages["password_hash_queue"].counts) == 2
+    assert sum(fresh.stages["password_hash_compute"].counts) == 2
+    # With one worker the second call waits roughly one hash for the first.
+    assert fresh.stages["password_hash_queue"].total > 0
+    assert pool.completed == 2
+
+
+def test_prewarm_is_not_counted(monkeypatch):
+    fresh = main.Metrics(enabled=True)
+    monkeypatch.setattr(main, "metrics", fresh)
+    pool = main.PasswordHashPool(workers=2, mode="thread")
+    try:
+        asyncio.run(pool.prewarm())
+    finally:
+        pool.shutdown()
+
+    assert pool.completed == 0
+    assert pool.hashing_seconds == 0
+    assert fresh.stages == {}
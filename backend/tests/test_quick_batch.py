@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+
+
+class RecordingPool:
+    def __init__(self):
+        self.shards = []
+
+    async def score(self, texts):
+        self.shards.append(list(texts))
+        return main.score_quick_batch_shard(texts)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    recording = RecordingPool()
+    monkeypatch.setattr(main, "quick_batch_pool", recording)
+    monkeypatch.setattr(main, "QUICK_BATCH_SHARD_SIZE", 2)
+    return recording
+
+
+def parse_in_chunks(body: bytes, size: int):
+    parser = main.JSONArrayStreamParser()
+    items = []
+    for start in range(0, len(body), size):
+        items.extend(parser.feed(body[start:start + size]))
+    return items + list(parser.finish())
+
+
+def post_batch(client, body, content_type="application/json"):
+    response = client.post("/quick-analyze/batch", content=body, headers={"Content-Type": content_type})
+    return response, [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.mark.parametrize("size", [1, 3, 64])
+def test_array_parser_handles_any_chunking(size):
+    items = ["hey!", {"id": 7, "text": "Sincerely, café ☕"}, 12345, [1, {"a": None}], -0.5e3, True]
+    body = (" \n[ " + ", ".join(json.dumps(item, ensure_ascii=False) for item in items) + " ]\n").encode("utf-8")
+    assert parse_in_chunks(body, size) == items
+
+
+def test_array_parser_waits_for_a_number_to_finish():
+    parser = main.JSONArrayStreamParser()
+    assert list(parser.feed(b"[12")) == []
+    assert list(parser.feed(b"34")) == []
+    assert list(parser.feed(b".5")) == []
+    assert list(parser.feed(b"e1, -")) == [12345.0]
+    assert list(parser.feed(b"0]")) == [0]
+    assert list(parser.finish()) == []
+
+
+@pytest.mark.parametrize("body", [b"[]", b"  [ ]  "])
+def test_array_parser_empty_array(body):
+    assert parse_in_chunks(body, 1) == []
+
+
+@pytest.mark.parametrize("body", [b'{"text": "hi"}', b"", b'["a" "b"]', b'["a",]', b'["a"', b'["a"] x', b"[,]"])
+def test_array_parser_rejects_malformed_bodies(body):
+    with pytest.raises(ValueError):
+        parse_in_chunks(body, 2)
+
+
+def test_small_batch_is_scored_inline(client, pool):
+    response, lines = post_batch(client, json.dumps(["hey there"]))
+    assert response.status_code == 200
+    assert lines == [{"index": 0, "detected_tone": "casual", "confidence": 0.4, "method": "keyword-analysis"}]
+    assert pool.shards == []
+
+
+def test_leftover_shard_goes_to_the_pool(client, pool):
+    texts = ["hey", "wow!", "please be advised", "team meeting", "thanks"]
+    response, lines = post_batch(client, json.dumps(texts))
+    assert response.status_code == 200
+    assert [line["index"] for line in lines] == list(range(5))
+    assert pool.shards == [texts[:2], texts[2:4], texts[4:]]
+
+
+def test_ndjson_leftover_shard_goes_to_the_pool(client, pool):
+    body = "\n".join(json.dumps({"id": index, "text": text}) for index, text in enumerate(["hey", "wow", "team"]))
+    response, lines = post_batch(client, body, "application/x-ndjson")
+    assert [line["id"] for line in lines] == [0, 1, 2]
+    assert pool.shards == [["hey", "wow"], ["team"]]
+
+
+def test_body_that_is_not_an_array_is_rejected(client, pool):
+    for body in ('{"text": "hi"}', "", "nope"):
+        response = client.post("/quick-analyze/batch", content=body, headers={"Content-Type": "application/json"})
+        assert response.status_code == 400
+
+
+def test_malformed_array_is_rejected_before_streaming(client, pool):
+    response = client.post("/quick-analyze/batch", content='["hey" oops]', headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+
+
+def test_malformed_array_ends_with_an_error_line():
+    # Once results are streaming, a later syntax error can only end the response
+    async def chunks():
+        yield b' "team" oops]'
+
+    async def collect():
+        parser = main.JSONArrayStreamParser()
+        first_items = list(parser.feed(b'["hey", "wow",'))
+        items = main.iter_json_array_body(parser, chunks(), first_items, finished=False)
+        return [json.loads(line) async for output in main.stream_quick_batch(items) for line in output.splitlines()]
+
+    lines = asyncio.run(collect())
+    assert [line.get("error") for line in lines] == [None, None, None, "Invalid JSON array"]
+    assert lines[-1]["index"] == 3
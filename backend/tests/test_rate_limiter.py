@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+NOW = datetime(2026, 1, 5, 12, 0, 0, tzinfo=timezone.utc)
+
+
+class FixedDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW if tz else NOW.replace(tzinfo=None)
+
+
+class RateLimited(Exception):
+    def __init__(self, message="429 Resource exhausted", headers=None, details=None):
+        super().__init__(message)
+        self.response = SimpleNamespace(headers=headers or {}) if headers is not None else None
+        self.details = details
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000.0]
+    monkeypatch.setattr(main.time, "time", lambda: now[0])
+    return now
+
+
+def make_limiter(**overrides) -> main.AdaptiveRateLimiter:
+    settings = dict(rate_per_minute=60, burst=2, min_rate_per_minute=6, backoff=0.5, recovery_per_minute=6)
+    settings.update(overrides)
+    return main.AdaptiveRateLimiter(**settings)
+
+
+def test_retry_after_seconds_header():
+    assert main.parse_retry_after(RateLimited(headers={"Retry-After": "7"})) == 7.0
+    assert main.parse_retry_after(RateLimited(headers={"Retry-After": "-3"})) == 0.0
+
+
+def test_retry_after_http_date_header(monkeypatch):
+    monkeypatch.setattr(main, "datetime", FixedDatetime)
+    error = RateLimited(headers={"Retry-After": "Mon, 05 Jan 2026 12:00:30 GMT"})
+    assert main.parse_retry_after(error) == 30.0
+    past = RateLimited(headers={"Retry-After": "Mon, 05 Jan 2026 11:59:00 GMT"})
+    assert main.parse_retry_after(past) == 0.0
+
+
+def test_retry_after_from_details_and_message():
+    delay = SimpleNamespace(retry_delay=SimpleNamespace(seconds=4, nanos=500_000_000))
+    assert main.parse_retry_after(RateLimited(details=[delay])) == 4.5
+    assert main.parse_retry_after(RateLimited("Please retry in 1500ms")) == 1.5
+    assert main.parse_retry_after(RateLimited("quota exceeded")) is None
+    assert main.parse_retry_after(RateLimited(headers={"Retry-After": "soon"})) is None
+
+
+def test_burst_then_waits_at_current_rate(clock):
+    limiter = make_limiter()
+    assert limiter.reserve() == 0.0
+    assert limiter.reserve() == 0.0
+    assert limiter.reserve() == pytest.approx(1.0)
+    clock[0] += 1.0
+    assert limiter.reserve() == pytest.approx(1.0)
+
+
+def test_backs_off_on_429_once_per_cooldown(clock):
+    limiter = make_limiter()
+    limiter.on_rate_limited()
+    limiter.on_rate_limited()
+    assert limiter.rate * 60 == pytest.approx(30)
+    assert limiter.backoffs == 1
+
+    clock[0] += limiter.backoff_cooldown
+    limiter.on_rate_limited()
+    assert limiter.rate * 60 == pytest.approx(15)
+    assert limiter.delay == pytest.approx(4.0)
+
+
+def test_backoff_stops_at_min_rate(clock):
+    limiter = make_limiter()
+    for _ in range(10):
+        limiter.on_rate_limited()
+        clock[0] += limiter.backoff_cooldown
+    assert limiter.rate * 60 == pytest.approx(6)
+
+
+def test_recovers_additively_up_to_max_rate(clock):
+    limiter = make_limiter()
+    limiter.on_rate_limited()
+    assert limiter.rate * 60 == pytest.approx(30)
+    limiter.on_success()
+    assert limiter.rate * 60 == pytest.approx(36)
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.rate * 60 == pytest.approx(60)
+
+
+def test_retry_after_blocks_until_deadline(clock):
+    limiter = make_limiter()
+    limiter.on_rate_limited(retry_after=10)
+    assert limiter.retry_hints == 1
+    # The saved-up burst may not be spent before the deadline
+    assert limiter.try_reserve() is False
+    assert limiter.reserve() == pytest.approx(10)
+
+    clock[0] += 10
+    assert limiter.reserve() == 0.0
@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def store(tmp_path):
+    return main.SharedStateStore(str(tmp_path / "shared.db"))
+
+
+def stored_keys(store):
+    with sqlite3.connect(store.path) as connection:
+        return [row[0] for row in connection.execute("SELECT cache_key FROM analysis_cache")]
+
+
+def corrupt(store, key, blob):
+    store._connect().execute("UPDATE analysis_cache SET value = ? WHERE cache_key = ?", (blob, key))
+
+
+def test_round_trip_and_expiry(store, monkeypatch):
+    store.cache_set("k", {"detected_tone": "friendly", "text": "héllo"}, ttl_seconds=10)
+    assert store.cache_get("k") == {"detected_tone": "friendly", "text": "héllo"}
+
+    later = main.time.time() + 11
+    monkeypatch.setattr(main.time, "time", lambda: later)
+    assert store.cache_get("k") is None
+
+
+@pytest.mark.parametrize("blob", [b"not zlib at all", main.zlib.compress(b"{truncated")])
+def test_unreadable_entry_is_a_miss_and_deleted(store, blob):
+    store.cache_set("bad", {"detected_tone": "formal"}, ttl_seconds=60)
+    store.cache_set("good", {"detected_tone": "casual"}, ttl_seconds=60)
+    corrupt(store, "bad", blob)
+
+    assert store.cache_get("bad") is None
+    assert stored_keys(store) == ["good"]
+    assert store.cache_get("good") == {"detected_tone": "casual"}
+
+
+def test_analysis_cache_treats_a_corrupt_shared_entry_as_a_miss(store):
+    cache = main.AnalysisCache(shared=store)
+    store.cache_set("bad", {"detected_tone": "formal"}, ttl_seconds=60)
+    corrupt(store, "bad", b"\x00\x01garbage")
+
+    assert cache._load_shared("bad") is None
+    assert stored_keys(store) == []
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+import main
+
+
+class FakeModel:
+    model_name = "models/fake"
+
+
+def events(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.fixture
+def streaming_gemini(monkeypatch):
+    """Make the shared analyzer look initialized, streaming whatever the test supplies."""
+    analyzer = main.gemini_analyzer
+    monkeypatch.setattr(analyzer, "initialized", True)
+    monkeypatch.setattr(analyzer, "pool", main.ModelPool([FakeModel()]))
+
+    def use(chunks, error=None):
+        async def stream(prompt, model):
+            for chunk in chunks:
+                yield chunk
+            if error is not None:
+                raise error
+        monkeypatch.setattr(analyzer, "_stream_content_async", stream)
+    return use
+
+
+HEADER = "DETECTED_TONE: Friendly\nCONFIDENCE: 0.9\nTONE_CATEGORY: friendly\nEXPLANATION: Warm.\n"
+
+
+def test_interrupted_stream_resets_before_the_fallback(client, register_user, streaming_gemini):
+    _, headers = register_user()
+    streaming_gemini([HEADER, "ENHANCED_VERSIONS:\n1. Formal: Good day.\n2. Cas"], error=RuntimeError("connection reset"))
+
+    received = events(client.post(
+        "/analyze-tone/stream", json={"text": "hello there"}, headers={**headers, "X-Bypass-Cache": "1"},
+    ))
+    names = [event["event"] for event in received]
+
+    reset = names.index("reset")
+    assert names[:reset] == ["tone", "explanation", "enhanced_version"]
+    # After the reset the fallback is streamed from the start, in the documented order
+    assert names[reset + 1] == "tone"
+    assert [event["index"] for event in received[reset:] if event["event"] == "enhanced_version"][0] == 1
+    assert names[-1] == "done"
+    done = received[-1]["analysis"]
+    assert done["service"] == "smart-fallback"
+    assert done["note"]
+    assert done["conversation_id"] is not None
+
+
+def test_failure_before_any_event_needs_no_reset(client, register_user, streaming_gemini):
+    _, headers = register_user()
+    streaming_gemini([], error=RuntimeError("refused"))
+
+    names = [event["event"] for event in events(client.post(
+        "/analyze-tone/stream", json={"text": "hello again"}, headers={**headers, "X-Bypass-Cache": "1"},
+    ))]
+
+    assert "reset" not in names
+    assert names[0] == "tone" and names[-1] == "done"
+
+
+def test_complete_stream_has_no_reset(client, register_user, streaming_gemini):
+    _, headers = register_user()
+    streaming_gemini([HEADER, "ENHANCED_VERSIONS:\n1. Formal: Good day.\n", "SUGGESTIONS:\n- Smile\n"])
+
+    received = events(client.post(
+        "/analyze-tone/stream", json={"text": "good day"}, headers={**headers, "X-Bypass-Cache": "1"},
+    ))
+
+    assert "reset" not in [event["event"] for event in received]
+    done = received[-1]["analysis"]
+    assert done["detected_tone"] == "Friendly"
+    assert done["enhanced_versions"] == [{"tone": "Formal", "text": "Good day."}]
+
+
+def feed_all(parser, chunks):
+    received = []
+    for chunk in chunks:
+        received.extend(parser.feed(chunk))
+    return received
+
+
+def test_parser_joins_a_line_split_across_chunks():
+    parser = main.StreamingToneParser()
+    received = feed_all(parser, ["DETECTED_TO", "NE: Friendly\nCONFID", "ENCE: 0.", "85\nTONE_CATEGORY: fri", "endly\n"])
+    # The tone goes out once its header is complete, not on a partial line
+    assert received == [{"event": "tone", "detected_tone": "Friendly", "confidence": 0.85, "tone_category": "friendly"}]
+
+    received = feed_all(parser, ["ENHANCED_VERSIONS:\n1. For", "mal: Good ", "day.\n2. Casual: Hey"])
+    assert received == [{"event": "enhanced_version", "index": 1, "tone": "Formal", "text": "Good day."}]
+    assert parser.text.startswith("DETECTED_TONE: Friendly\nCONFIDENCE: 0.85\n")
+
+
+def test_parser_holds_an_incomplete_final_line_until_finish():
+    parser = main.StreamingToneParser()
+    received = feed_all(parser, [HEADER, "SUGGESTIONS:\n- Keep it short\n- Add a greet"])
+    assert [event["event"] for event in received] == ["tone", "explanation", "suggestion"]
+
+    assert parser.finish() == [{"event": "suggestion", "text": "Add a greet"}]
+    assert parser.finish() == []
+
+
+def test_parser_emits_a_header_without_explanation_at_finish():
+    parser = main.StreamingToneParser()
+    assert feed_all(parser, ["DETECTED_TONE: Formal\nCONFIDENCE: high"]) == []
+    assert parser.finish() == [
+        {"event": "tone", "detected_tone": "Formal", "confidence": 0.8, "tone_category": None},
+    ]
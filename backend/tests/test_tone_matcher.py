@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import main
+
+
+def test_phrases_match_only_on_word_boundaries():
+    matcher = main.ToneKeywordMatcher({"formal": ["formal"], "casual": ["hi"]})
+    assert matcher.score("An informal note, this time") == {}
+    assert matcher.score("A formal note. Hi!") == {"formal": 1.0, "casual": 1.0}
+    assert matcher.score("formal_ly, formals") == {}
+
+
+def test_multi_word_phrases_allow_any_whitespace():
+    matcher = main.ToneKeywordMatcher({"professional": ["follow up", "action items"]})
+    assert matcher.score("I will FOLLOW\n  up on the action items") == {"professional": 2.0}
+    assert matcher.score("follow upward") == {}
+
+
+def test_punctuation_phrases_match_anywhere():
+    matcher = main.ToneKeywordMatcher(main.DEFAULT_TONE_LEXICON)
+    assert matcher.score("Done!") == {"enthusiastic": 1.0}
+    # Distinct phrases count once however often they appear
+    assert matcher.score("wow!!! wow!") == {"enthusiastic": 2.0}
+    assert matcher.detect("Hey, see you at the meeting") == ("casual", 1.0)
+
+
+def test_weighted_lexicon_and_tie_break():
+    matcher = main.ToneKeywordMatcher({
+        "formal": {"regards": 2.5},
+        "friendly": {"regards": 0.5, "cheers": 2.0},
+    })
+    assert matcher.score("Kind regards") == {"formal": 2.5, "friendly": 0.5}
+    assert matcher.detect("Cheers and regards") == ("formal", 2.5)
+    # Equal scores go to the tone listed first
+    assert matcher.detect("cheers") == ("friendly", 2.0)
+    assert main.ToneKeywordMatcher({"formal": {"cheers": 2.0}, "friendly": {"cheers": 2.0}}).detect("cheers")[0] == "formal"
+    assert matcher.detect("nothing here") == ("neutral", 0.0)
+
+
+def test_custom_lexicon_is_loaded_from_tone_lexicon_path(tmp_path, monkeypatch):
+    path = tmp_path / "lexicon.json"
+    path.write_text(json.dumps({"empathetic": {"sorry to hear": 3}, "casual": ["yo"]}))
+    monkeypatch.setattr(main, "TONE_LEXICON_PATH", str(path))
+
+    matcher = main.load_tone_matcher()
+    assert matcher.tones == ["empathetic", "casual"]
+    assert matcher.detect("So sorry to hear that, yo") == ("empathetic", 3.0)
+
+
+@pytest.mark.parametrize("content", [None, "{not json"])
+def test_unreadable_lexicon_falls_back_to_default(tmp_path, monkeypatch, content):
+    path = tmp_path / "lexicon.json"
+    if content is not None:
+        path.write_text(content)
+    monkeypatch.setattr(main, "TONE_LEXICON_PATH", str(path))
+
+    assert main.load_tone_matcher().tones == list(main.DEFAULT_TONE_LEXICON)
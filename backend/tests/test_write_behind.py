@@ -0,0 +1,103 @@
+import asyncio
+
+import main
+
+
+class RecordingWriter(main.ConversationWriteBehind):
+    """Write-behind whose inserts are recorded instead of hitting the database."""
+
+    def __init__(self, insert_delay: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.insert_delay = insert_delay
+        self.batches = []
+        self._next_id = 0
+
+    async def _insert(self, rows):
+        await asyncio.sleep(self.insert_delay)
+        self.batches.append([values["original_text"] for values in rows])
+        ids = list(range(self._next_id + 1, self._next_id + len(rows) + 1))
+        self._next_id += len(rows)
+        return ids
+
+
+def rows(count):
+    return [{"user_id": 1, "original_text": f"text {index}"} for index in range(count)]
+
+
+def test_stop_drains_the_queue():
+    writer = RecordingWriter(flush_interval_ms=60_000, batch_size=100, id_timeout=0.01)
+
+    async def scenario():
+        writer.start()
+        # Nothing flushes within the id timeout, so the rows are still queued
+        ids = await asyncio.gather(*(writer.submit(values) for values in rows(3)))
+        await writer.stop()
+        return ids
+
+    assert asyncio.run(scenario()) == [None, None, None]
+    assert writer.batches == [["text 0", "text 1", "text 2"]]
+    assert writer.rows_written == 3
+    assert not writer.running
+
+
+def test_full_batch_flushes_before_the_interval():
+    writer = RecordingWriter(flush_interval_ms=60_000, batch_size=3, id_timeout=5)
+
+    async def scenario():
+        writer.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        ids = await asyncio.gather(*(writer.submit(values) for values in rows(3)))
+        elapsed = loop.time() - started
+        await writer.stop()
+        return ids, elapsed
+
+    ids, elapsed = asyncio.run(scenario())
+    assert ids == [1, 2, 3]
+    assert elapsed < 1
+    assert writer.batches == [["text 0", "text 1", "text 2"]]
+    assert writer.flushes == 1
+
+
+def test_slow_flush_returns_no_id_but_still_writes():
+    writer = RecordingWriter(insert_delay=0.2, flush_interval_ms=1, batch_size=100, id_timeout=0.05)
+
+    async def scenario():
+        writer.start()
+        conversation_id = await writer.submit(rows(1)[0])
+        await writer.stop()
+        return conversation_id
+
+    assert asyncio.run(scenario()) is None
+    assert writer.id_timeouts == 1
+    assert writer.rows_written == 1
+
+
+def test_bad_row_is_dropped_without_losing_the_batch():
+    writer = main.ConversationWriteBehind(flush_interval_ms=60_000, batch_size=100, id_timeout=5)
+    db = main.SessionLocal()
+    user = main.User(email="write-behind@example.com", hashed_password="hash")
+    db.add(user)
+    db.commit()
+    request = main.ToneAnalysisRequest(text="queued hello")
+    analysis = {"detected_tone": "friendly", "tone_category": "friendly", "confidence": 0.9}
+    good = main.conversation_values(user, request, analysis)
+    bad = {**main.conversation_values(user, request, analysis), "original_text": None}
+
+    async def scenario():
+        writer.start()
+        submitted = asyncio.gather(writer.submit(good), writer.submit(bad))
+        await asyncio.sleep(0)
+        await writer.stop()
+        return await submitted
+
+    try:
+        good_id, bad_id = asyncio.run(scenario())
+        assert bad_id is None
+        assert writer.rows_failed == 1
+        assert db.get(main.Conversation, good_id).original_text == "queued hello"
+    finally:
+        db.query(main.Conversation).filter(main.Conversation.user_id == user.id).delete()
+        db.delete(user)
+        db.commit()
+        db.close()
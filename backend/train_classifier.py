@@ -0,0 +1,36 @@
+"""Train the local tone classifier from stored conversations"""
+import sys
+import time
+
+from main import (
+    HAS_NUMPY,
+    LOCAL_CLASSIFIER_PATH,
+    SessionLocal,
+    train_local_classifier,
+)
+
+
+def main():
+    if not HAS_NUMPY:
+        print("NumPy is required: pip install numpy")
+        sys.exit(1)
+
+    path = sys.argv[1] if len(sys.argv) > 1 else LOCAL_CLASSIFIER_PATH
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        classifier = train_local_classifier(db)
+    except ValueError as e:
+        print(f"Not enough training data: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+    classifier.save(path)
+    print(f"Trained on {classifier.trained_on} conversations in {time.perf_counter() - started:.2f}s")
+    print(f"Saved classifier to {path}")
+    print("Restart the backend to load it (set LOCAL_CLASSIFIER_ROUTING to route /analyze-tone through it).")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 """Quick script to view SQLite database contents"""
+import json
 import sqlite3
 from datetime import datetime
 
+from analysis_codec import decode_analysis
+
 def view_database():
     conn = sqlite3.connect('text_toner.db')
     cursor = conn.cursor()
@@ -50,8 +53,15 @@ def view_database():
         print("📝 LATEST CONVERSATION DETAILS")
         print("="*80)
         latest = conversations[0]
-        cursor.execute('SELECT analysis_json FROM conversations WHERE id = ?', (latest[0],))
-        analysis = cursor.fetchone()[0]
+        cursor.execute('SELECT analysis_json, context FROM conversations WHERE id = ?', (latest[0],))
+        analysis_json, context = cursor.fetchone()
+        analysis = decode_analysis(analysis_json, {
+            "original_text": latest[3],
+            "context": context,
+            "detected_tone": latest[4],
+            "tone_category": latest[5],
+            "confidence": latest[6],
+        })
         
         print(f"ID: {latest[0]}")
         print(f"User: {latest[2]}")
@@ -61,7 +71,7 @@ def view_database():
         print(f"Confidence: {latest[6]}")
         print(f"Created At: {latest[7]}")
         print(f"\nFull Analysis JSON:")
-        print(analysis)
+        print(json.dumps(analysis, indent=2, ensure_ascii=False))
     
     conn.close()
     print("\n" + "="*80)
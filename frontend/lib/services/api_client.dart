@@ -298,25 +298,41 @@ class ApiClient {
     throw _buildException(response);
   }
 
+  /// Loads the whole history, following the backend's X-Next-Cursor pages.
   Future<List<ConversationSummary>> getConversationHistory() async {
-    final uri = _buildUri(AppConfig.conversationsEndpointPath);
-
-    final response = await _http
-        .get(uri, headers: _jsonHeaders(withAuth: true))
-        .timeout(const Duration(seconds: 15));
+    final conversations = <ConversationSummary>[];
+    String? cursor;
+
+    do {
+      // Pages use the server's default size, which stays within its configured maximum
+      final baseUri = _buildUri(AppConfig.conversationsEndpointPath);
+      final uri = cursor == null
+          ? baseUri
+          : baseUri.replace(queryParameters: {'cursor': cursor});
+
+      final response = await _http
+          .get(uri, headers: _jsonHeaders(withAuth: true))
+          .timeout(const Duration(seconds: 15));
+
+      if (response.statusCode < 200 || response.statusCode >= 300) {
+        throw _buildException(response);
+      }
 
-    if (response.statusCode >= 200 && response.statusCode < 300) {
       final decoded = jsonDecode(response.body);
-      if (decoded is List) {
-        return decoded
-            .whereType<Map<String, dynamic>>()
-            .map(ConversationSummary.fromJson)
-            .toList();
+      if (decoded is! List) {
+        throw const FormatException('Unexpected conversation list format');
       }
-      throw const FormatException('Unexpected conversation list format');
-    }
+      conversations.addAll(
+        decoded
+            .whereType<Map<String, dynamic>>()
+            .map(ConversationSummary.fromJson),
+      );
 
-    throw _buildException(response);
+      // Absent on the last page (package:http lowercases header names)
+      cursor = response.headers['x-next-cursor'];
+    } while (cursor != null && cursor.isNotEmpty);
+
+    return conversations;
   }
 
   Future<ConversationDetail> getConversationDetail(int id) async {